@@ -13,34 +13,178 @@ The class also gives the possibility of performing just a single recognition and
 """
 from cairlib.DialogueTurn import DialogueTurn, TurnPiece
 from speaker_recognition_util import recognize_speaker
+from stt_backends import AzureSttBackend
+from transcription_pool import TranscriptionPool
+from latency_tracer import LatencyTracer
+from client_protocol import open_protocol
+import metrics
+from profile_registry import ProfileRegistry
+from speaker_embedding import SpeakerEmbeddings, SpeakerChangeDetector
+from speaker_backends import AzureSpeakerBackend
+import speaker_embedding
 import azure.cognitiveservices.speech as speechsdk
 import xml.etree.cElementTree as ET
 import threading
+import itertools
 import pyaudio
-import struct
-import math
+import audio_analysis
+from vad import AdaptiveVad, SpeechGate
+from audio_capture import AudioCapture
+from ring_buffer import RingBuffer
+from segmenter import Segmenter, segment_start, segment_end, turn_end
+from endpointing import Endpointer
 import wave
 import string
 import time
-import json
 import os
-import gc
 
 rms_threshold = 40
-short_normalize = (1.0 / 32768.0)
-chunk = 1024
+# Number of samples of each chunk read from the microphone
+chunk = 512
 audio_format = pyaudio.paInt16
 channels = 1
-rate = 44100
+# Sample rate of the audio processed by the recorder and sent to the services (the capture is resampled if needed)
+rate = 16000
 s_width = 2
 split_silence_time = 0.5
 final_silence_time = 2
+# Seconds of audio preceding the noise detection that are kept and prepended to each segment
+pre_roll_time = 0.5
+# Maximum time waited at the end of a turn for the streaming recognizer to return the last recognized sentence
+streaming_timeout = 2
+# Seconds before the end of the pushed audio that the last streaming result must reach: the recognized speech ends
+# before the silence that closes the segment, and a little earlier than the last chunk above the VAD threshold
+stream_end_tolerance = split_silence_time + 0.25
+# Seconds of speech after which the speaker is identified during the turn, when the identification is done per turn
+turn_identification_time = 4
+unknown_speaker_id = "00000000-0000-0000-0000-000000000000"
 exit_keywords = ["passo e chiudo", "cosa ne pensi"]
 
 
 class Recorder:
-    def __init__(self, lang):
+    # If archive_dir is given, every segment is also saved as a WAV file in that folder.
+    # If streaming is True, the audio is sent to a continuous recognizer while it is captured (listen_continuous only).
+    # pre_roll is the number of seconds of audio preceding the noise that are prepended to each segment.
+    # speaker_id_mode is "segment" to identify the speaker of each segment, or "turn" to identify the speaker once per
+    # turn on the audio of all its segments.
+    # speaker_backend is the backend used to identify the speakers (Azure by default, see speaker_backends)
+    # stt_backend is the backend used to transcribe the segments (Azure by default, see stt_backends)
+    # capture is the source of the audio chunks (the microphone by default, a file when the recorder is benchmarked)
+    # If trace_file is given, the time at which each stage of the turns and segments is reached is written in that
+    # JSONL file (see latency_tracer)
+    # transcription_pool is the pool of threads transcribing the segments (a new one with the default number of workers
+    # by default, the recorder server gives each session its own)
+    # session is the name of the session of the recorder server the recorder belongs to, used to label its metrics
+    # If endpointing is True, the silence that ends a turn depends on the prosody and on the transcripts of the turn
+    # (see endpointing), otherwise it is always final_silence_time seconds
+    def __init__(self, lang, archive_dir=None, streaming=False, pre_roll=pre_roll_time, speaker_id_mode="segment",
+                 speaker_backend=None, stt_backend=None, capture=None, trace_file=None, transcription_pool=None,
+                 endpointing=True, session=None):
         self.p = pyaudio.PyAudio()
+        if capture is None:
+            # The microphone is read by PortAudio on its own thread and the chunks are queued until they are processed
+            capture = AudioCapture(self.p, audio_format, channels, rate, chunk, self.find_input_device())
+        self.capture = capture
+
+        # Audio heard just before the noise is detected, prepended to every segment
+        self.prev_input = RingBuffer(int(pre_roll * rate))
+        # Voice activity detector following the noise floor, rms_threshold is the minimum threshold
+        self.vad = AdaptiveVad(rms_threshold, chunk / rate)
+        # Spectral check that rejects the segments without speech before they are transcribed
+        self.speech_gate = SpeechGate(rate)
+        # Splits the audio in segments and turns, measuring the silences in samples
+        self.segmenter = Segmenter(self.vad, self.prev_input, rate, split_silence_time, final_silence_time)
+        # Decides how much silence ends the turn, and the silence that ended the last turn
+        self.endpointer = Endpointer(lang, rate, final_silence_time, exit_keywords) if endpointing else None
+        self.turn_final_silence = final_silence_time
+        # Initialize object that will contain the data related to the dialogue turn
+        self.dialogue_turn = DialogueTurn()
+        self.recognized_text = ""
+        self.mode = "continuous"
+        self.root = ET.Element("response")
+        self.stt_backend = stt_backend or AzureSttBackend(lang, rate, channels)
+        # Enrolled profiles, reloaded only when the file changes
+        self.profiles = ProfileRegistry()
+        # Local speaker model, used to narrow the candidates and to skip the identification of a voice already
+        # identified in the same turn
+        self.speaker_embeddings = SpeakerEmbeddings()
+        self.speaker_changes = SpeakerChangeDetector()
+        self.speaker_backend = speaker_backend or AzureSpeakerBackend()
+        # Bounded pool of threads transcribing the segments, and group of the tasks of the current turn
+        self.transcription_pool = transcription_pool or TranscriptionPool()
+        self.turn_tasks = self.transcription_pool.new_turn()
+        # Audio of the current turn and identification of its speaker, used when the speaker is identified per turn
+        self.speaker_id_mode = speaker_id_mode
+        self.turn_audio = []
+        self.turn_audio_samples = 0
+        self.turn_speaker = [unknown_speaker_id]
+        self.turn_speaker_task = None
+        self.archive_dir = archive_dir
+        self.session = session
+        # Protocol spoken with the current client, used to push the sentences before the end of the turn
+        self.protocol = None
+        # Set when the client disconnects while a turn is being recorded, so that the turn is abandoned
+        self.client_gone = threading.Event()
+        # Ids of the turns, used by the tracer (the ids of the segments are given by the segmenter and are also
+        # appended to the archived file names, as more segments can end in the same second)
+        self.tracer = LatencyTracer(trace_file)
+        self.turn_counter = itertools.count()
+        self.turn_id = next(self.turn_counter)
+        # Data used by the streaming mode
+        self.lang = lang
+        self.streaming = streaming
+        self.streaming_timeout = streaming_timeout
+        self.stream_recognizer = None
+        self.push_stream = None
+        # Set when the recognizer is canceled by an error: it is replaced when the next segment starts
+        self.stream_canceled = False
+        self.stream_condition = threading.Condition()
+        # Position (in samples) of the audio pushed to the recognizers and of the end of the last recognized result, and
+        # position of the start of the stream of the current recognizer
+        self.pushed_samples = 0
+        self.recognized_samples = 0
+        self.stream_origin = 0
+        # Segment being recorded, registered when it starts so that the results arriving before its end find it
+        self.stream_segment = None
+        # Segments of the current turn and sentences recognized in the current turn
+        self.stream_segments = []
+        self.stream_sentences = []
+        self.register_metrics()
+
+    # The metrics already counted by the capture and by the pools are read when they are scraped. The recorders of
+    # the sessions of the recorder server publish them with the name of the session as label
+    def register_metrics(self):
+        capture = self.capture
+        labels = {"session": self.session} if self.session else None
+        self.vad_triggers = metrics.registry.counter("recorder_vad_triggers_total", "Segments started because of noise",
+                                                     labels=labels)
+        self.segments_rejected = metrics.registry.counter(
+            "recorder_segments_rejected_total", "Segments rejected by the spectral gate because they contain no speech",
+            labels=labels)
+        self.segments_per_turn = metrics.registry.histogram("recorder_segments_per_turn", "Segments recorded in a turn",
+                                                            buckets=(1, 2, 3, 5, 8, 13, 21), labels=labels)
+        # The chunks dropped by the capture or discarded when it restarts are not processed
+        self.chunks_processed = metrics.registry.counter("recorder_chunks_processed_total",
+                                                         "Audio chunks processed by the recorder", labels=labels)
+        metrics.registry.counter("recorder_capture_overflows_total", "Input overflows reported by PortAudio",
+                                 fn=lambda: capture.overflows, labels=labels)
+        metrics.registry.counter("recorder_dropped_chunks_total", "Chunks dropped because the capture queue was full",
+                                 fn=lambda: capture.dropped_chunks, labels=labels)
+        metrics.registry.gauge("recorder_capture_backlog", "Chunks captured and not read yet", fn=capture.backlog,
+                               labels=labels)
+        metrics.registry.gauge("recorder_noise_floor", "Noise floor (rms) estimated by the voice activity detector",
+                               fn=lambda: self.vad.noise_floor, labels=labels)
+        metrics.registry.gauge("recorder_vad_threshold", "Rms needed to start a segment",
+                               fn=self.vad.start_threshold, labels=labels)
+        metrics.registry.gauge("recorder_workers_in_flight", "Transcription and identification tasks running",
+                               fn=self.transcription_pool.in_flight, labels=labels)
+        metrics.registry.gauge("recorder_workers_queued", "Transcription and identification tasks waiting for a worker",
+                               fn=self.transcription_pool.queue_depth, labels=labels)
+        metrics.registry.gauge("profiles_enrolled", "Profiles in the profiles file",
+                               fn=lambda: len(self.profiles.get()))
+
+    # Returns the index of the USB microphone, or None to use the default one
+    def find_input_device(self):
         info = self.p.get_host_api_info_by_index(0)
         num_devices = info.get('deviceCount')
         input_device = -1
@@ -51,188 +195,504 @@ class Recorder:
                     input_device = i
         if input_device == -1:
             print("Using default microphone")
-            self.stream = self.p.open(format=audio_format, channels=channels, rate=rate, input=True, output=True,
-                                      frames_per_buffer=chunk, start=False)
-        else:
-            print("Using USB PnP Audio Device")
-            self.stream = self.p.open(format=audio_format, channels=channels, rate=rate, input=True, output=True,
-                                      frames_per_buffer=chunk, start=False, input_device_index=input_device)
+            return None
+        print("Using USB PnP Audio Device")
+        return input_device
 
-        self.prev_input = []
-        self.max_chunks = 20
-        # Initialize object that will contain the data related to the dialogue turn
-        self.dialogue_turn = DialogueTurn()
-        self.recognized_text = ""
-        self.mode = "continuous"
-        self.root = ET.Element("response")
-        self.speech_config = speechsdk.SpeechConfig(subscription=os.environ["COGNITIVE_SERVICE_KEY"],
-                                                    region="westeurope", speech_recognition_language=lang)
-        self.t1 = threading.Thread(target=self.speech_and_speaker_recognition, args=("", 0,))
+    @staticmethod
+    def clean_sentence(text):
+        sentence = text.translate(str.maketrans('', '', string.punctuation)).lower()
+        if len(sentence) > 512:
+            print("STT string exceeds 512 characters - truncated")
+            sentence = sentence[:512]
+        return sentence
 
-    def speech_recognition(self, wav_filename):
+    # Returns the sentence recognized in the segment, or None
+    def speech_recognition(self, recording, segment=None):
         print("T1: Performing speech to text...")
-        audio_input = speechsdk.AudioConfig(filename=wav_filename)
-        speech_recognizer = speechsdk.SpeechRecognizer(speech_config=self.speech_config, audio_config=audio_input)
-        result = speech_recognizer.recognize_once_async().get()
-        # If something has been recognized by Microsoft
-        if result.text:
-            sentence = result.text.translate(str.maketrans('', '', string.punctuation)).lower()
-            if len(sentence) > 512:
-                print("STT string exceeds 512 characters - truncated")
-                sentence = sentence[:512]
-            # Add a turn piece only if the user said something more than the phrase to end the turn
+        self.tracer.event("stt_start", segment=segment)
+        text = self.stt_backend.transcribe(recording, self.session)
+        self.tracer.event("stt_end", segment=segment, recognized=bool(text))
+        if text:
+            sentence = self.clean_sentence(text)
             if sentence:
-                self.recognized_text = self.recognized_text + " " + sentence
+                return sentence
         else:
             print("T1: Not able to perform speech to text!")
-        del speech_recognizer
-        gc.collect()
-        # Delete the original wav file without final silence
-        if os.path.exists(wav_filename):
-            os.remove(wav_filename)
-
-    def speech_and_speaker_recognition(self, wav_filename, wav_duration):
-        if os.path.isfile("profiles.json"):
-            with open('profiles.json', 'r', encoding='utf-8') as f:
-                prof_dict = json.load(f)
-        else:
-            prof_dict = {}
-        ident_speaker_id = ["00000000-0000-0000-0000-000000000000"]
-        t2 = threading.Thread(target=recognize_speaker, args=(format(wav_filename), prof_dict, ident_speaker_id))
-        if prof_dict:
-            t2.start()
+        return None
+
+    # Returns the speaker id, the sentence and the duration of the segment, or None if nothing has been recognized
+    # wav_duration and offset are the duration of the segment and its distance from the start of the turn, measured by
+    # the segmenter in samples. identification is the task identifying the speaker of the segment in the pool, or None
+    # when the speaker is identified per turn
+    def speech_and_speaker_recognition(self, recording, wav_duration, segment=None, offset=None, identification=None):
         print("T1: Performing speech to text...")
-        audio_input = speechsdk.AudioConfig(filename=wav_filename)
-        speech_recognizer = speechsdk.SpeechRecognizer(speech_config=self.speech_config, audio_config=audio_input)
-        result = speech_recognizer.recognize_once_async().get()
-        # If something has been recognized by Microsoft
-        if result.text:
-            sentence = result.text.translate(str.maketrans('', '', string.punctuation)).lower()
-            if len(sentence) > 512:
-                print("STT string exceeds 512 characters - truncated")
-                sentence = sentence[:512]
-            if prof_dict:
-                t2.join()
-                print("T1: T2 has completed the identification")
-            ident_speaker_id = ident_speaker_id[0]
+        self.tracer.event("stt_start", segment=segment)
+        try:
+            text = self.stt_backend.transcribe(recording, self.session)
+            self.tracer.event("stt_end", segment=segment, recognized=bool(text))
+        finally:
+            # The identification is waited for on every path, so that it never completes after the end of the turn
+            ident_speaker_id = self.segment_speaker_id(identification)
+        if text:
+            sentence = self.clean_sentence(text)
             # Add a turn piece only if the user said something more than the phrase to end the turn
             if sentence:
-                turn_piece = TurnPiece(ident_speaker_id, sentence, wav_duration)
-                self.dialogue_turn.add_turn_piece(turn_piece)
+                self.publish_piece(segment, ident_speaker_id, sentence, wav_duration, offset)
+                return ident_speaker_id, sentence, wav_duration
         else:
             print("T1: Not able to perform speech to text!")
-        del speech_recognizer
-        gc.collect()
-        # Delete the original wav file without final silence
-        if os.path.exists(wav_filename):
-            os.remove(wav_filename)
+        return None
+
+    # Waits for the identification of the speaker of a segment and returns the identified id
+    @staticmethod
+    def segment_speaker_id(identification):
+        if identification is None:
+            return unknown_speaker_id
+        try:
+            speaker_id = identification.result()
+            print("T1: T2 has completed the identification")
+            return speaker_id
+        except Exception as e:
+            print("T2: Speaker identification failed:", e)
+            return unknown_speaker_id
+
+    # Pushes the sentence of a segment to the client as soon as it is recognized (if the protocol supports it)
+    def publish_piece(self, segment, speaker_id, sentence, duration, offset=None):
+        if self.protocol is not None:
+            self.protocol.piece(self.turn_id, segment, speaker_id, sentence, duration, offset)
+
+    # Identifies the speaker of a segment, unless the same voice has already been identified in this turn, and returns
+    # the identified id (also written in ident_speaker_id)
+    def identify_segment(self, recording, prof_dict, ident_speaker_id, segment=None):
+        self.tracer.event("speaker_id_start", segment=segment)
+        emb = speaker_embedding.embedding(recording, rate)
+        same_speaker_id = self.speaker_changes.same_speaker(emb, self.speaker_embeddings.center(list(prof_dict)))
+        if same_speaker_id is not None:
+            print("T2: Same voice as a segment already identified in this turn")
+            ident_speaker_id[0] = same_speaker_id
+            self.tracer.event("speaker_id_end", segment=segment, skipped=True)
+            return same_speaker_id
+        wav_audio = audio_analysis.to_wav_bytes(recording, rate, channels)
+        recognize_speaker(wav_audio, self.speaker_embeddings.candidates(emb, prof_dict), ident_speaker_id,
+                          self.speaker_backend, self.session)
+        self.tracer.event("speaker_id_end", segment=segment, skipped=False)
+        if ident_speaker_id[0] != unknown_speaker_id:
+            self.speaker_changes.add(emb, ident_speaker_id[0])
+        return ident_speaker_id[0]
+
+    # Starts a new dialogue turn, with its own group of transcription tasks
+    def new_turn(self):
+        self.turn_id = next(self.turn_counter)
+        self.segmenter.new_turn()
+        if self.endpointer is not None:
+            self.endpointer.new_turn()
+        self.dialogue_turn = DialogueTurn()
+        self.turn_tasks = self.transcription_pool.new_turn()
+        self.turn_audio = []
+        self.turn_audio_samples = 0
+        self.turn_speaker = [unknown_speaker_id]
+        self.turn_speaker_task = None
+        self.speaker_changes.reset()
+
+    # Waits for every segment of the turn and adds the turn pieces to the dialogue turn in capture order
+    def finish_turn(self):
+        if self.speaker_id_mode == "turn" and self.turn_speaker_task is None:
+            # Identify the speaker while the last segments are being transcribed
+            self.start_turn_identification()
+        if len(self.turn_tasks):
+            self.segments_per_turn.observe(len(self.turn_tasks))
+        results = self.turn_tasks.join()
+        self.tracer.event("join_complete", turn=self.turn_id)
+        turn_speaker_id = self.turn_speaker_id() if self.speaker_id_mode == "turn" else None
+        for result in results:
+            if result is not None:
+                ident_speaker_id, sentence, wav_duration = result
+                if turn_speaker_id is not None:
+                    ident_speaker_id = turn_speaker_id
+                self.dialogue_turn.add_turn_piece(TurnPiece(ident_speaker_id, sentence, wav_duration))
+
+    # Keeps the audio of the segments of the turn and, as soon as there is enough speech, identifies the speaker
+    def add_turn_audio(self, recording):
+        self.turn_audio.append(recording)
+        self.turn_audio_samples += len(recording) // s_width
+        if self.turn_speaker_task is None and self.turn_audio_samples >= turn_identification_time * rate:
+            self.start_turn_identification()
+
+    # Sends a single identification request with the audio of the turn collected so far
+    def start_turn_identification(self):
+        prof_dict = self.profiles.get()
+        if not prof_dict or not self.turn_audio:
+            return
+        wav_audio = audio_analysis.to_wav_bytes(b''.join(self.turn_audio), rate, channels)
+        self.turn_speaker_task = self.transcription_pool.submit(self.identify_turn, wav_audio, prof_dict,
+                                                                self.turn_speaker, self.turn_id)
+
+    def identify_turn(self, wav_audio, prof_dict, turn_speaker, turn_id):
+        self.tracer.event("speaker_id_start", turn=turn_id)
+        try:
+            recognize_speaker(wav_audio, prof_dict, turn_speaker, self.speaker_backend, self.session)
+        finally:
+            self.tracer.event("speaker_id_end", turn=turn_id)
+
+    # Waits for the identification of the speaker of the turn and returns the identified id
+    def turn_speaker_id(self):
+        if self.turn_speaker_task is not None:
+            try:
+                self.turn_speaker_task.result()
+            except Exception as e:
+                print("T2: Speaker identification failed:", e)
+        return self.turn_speaker[0]
+
+    # Text of the segments of the current turn that have already been transcribed
+    def partial_text(self):
+        return " ".join(result[1] for result in self.turn_tasks.done_results() if result is not None)
+
+    # Text of the current turn recognized so far, in streaming mode as well
+    def turn_text(self):
+        if self.streaming:
+            with self.stream_condition:
+                return " ".join(sentence for segment, sentence, duration in self.stream_sentences)
+        if self.mode == "continuous":
+            return self.partial_text()
+        # In the other modes the results are the sentences
+        return " ".join(result for result in self.turn_tasks.done_results() if result is not None)
+
+    def pool_stats(self):
+        return {"queue_depth": self.transcription_pool.queue_depth(),
+                "in_flight": self.transcription_pool.in_flight()}
+
+    # Creates the continuous recognizer used in streaming mode, reading from a push stream that stays open. A recognizer
+    # canceled by an error is closed before being replaced
+    def start_streaming(self):
+        self.stop_streaming()
+        stream_config = speechsdk.SpeechConfig(subscription=os.environ["COGNITIVE_SERVICE_KEY"],
+                                               region="westeurope", speech_recognition_language=self.lang)
+        # End the utterances after the same silence used to split the segments
+        stream_config.set_property(speechsdk.PropertyId.Speech_SegmentationSilenceTimeoutMs,
+                                   str(int(split_silence_time * 1000)))
+        stream_format = speechsdk.audio.AudioStreamFormat(samples_per_second=rate, bits_per_sample=16,
+                                                          channels=channels)
+        self.push_stream = speechsdk.audio.PushAudioInputStream(stream_format=stream_format)
+        audio_input = speechsdk.audio.AudioConfig(stream=self.push_stream)
+        self.stream_recognizer = speechsdk.SpeechRecognizer(speech_config=stream_config, audio_config=audio_input)
+        self.stream_recognizer.recognizing.connect(self.on_recognizing)
+        self.stream_recognizer.recognized.connect(self.on_recognized)
+        self.stream_recognizer.canceled.connect(self.on_canceled)
+        with self.stream_condition:
+            # The results of the new stream are placed after the audio pushed to the previous one (the audio not
+            # recognized before the cancellation is lost), so that they are still matched with the segments of the turn
+            self.stream_origin = self.pushed_samples
+            self.recognized_samples = self.pushed_samples
+            self.stream_canceled = False
+        self.stream_recognizer.start_continuous_recognition_async().get()
+        print("*** Streaming recognizer started ***")
+
+    def stop_streaming(self):
+        recognizer, push_stream = self.stream_recognizer, self.push_stream
+        self.stream_recognizer = None
+        self.push_stream = None
+        if recognizer is not None:
+            recognizer.stop_continuous_recognition_async().get()
+            push_stream.close()
+            print("*** Streaming recognizer stopped ***")
+
+    def push_audio(self, data):
+        self.push_stream.write(data)
+        with self.stream_condition:
+            self.pushed_samples += len(data) // s_width
+
+    # Pushes the partial hypothesis of the recognizer to the client while the user is talking
+    def on_recognizing(self, evt):
+        if self.protocol is not None and evt.result.text:
+            self.protocol.interim(self.turn_id, self.clean_sentence(evt.result.text))
+
+    def on_recognized(self, evt):
+        result = evt.result
+        piece = None
+        with self.stream_condition:
+            # The offset and the duration of the result are expressed in ticks of 100 ns from the start of the stream
+            start_sample = self.stream_origin + result.offset * rate // 10 ** 7
+            end_sample = self.stream_origin + (result.offset + result.duration) * rate // 10 ** 7
+            if result.reason == speechsdk.ResultReason.RecognizedSpeech and result.text:
+                sentence = self.clean_sentence(result.text)
+                # The sentence belongs to the last segment that started before the recognized speech
+                segment = None
+                for seg in self.stream_segments:
+                    if seg["start"] <= start_sample:
+                        segment = seg
+                if sentence and segment is not None:
+                    print("T1: Recognized:", sentence)
+                    self.tracer.event("stt_end", segment=segment["id"], recognized=True)
+                    self.stream_sentences.append((segment, sentence, result.duration / 10 ** 7))
+                    piece = (segment["id"], segment["speaker"][0], sentence, result.duration / 10 ** 7,
+                             segment["offset"] + (start_sample - segment["start"]) / rate)
+            self.recognized_samples = max(self.recognized_samples, end_sample)
+            self.stream_condition.notify_all()
+        # Sent outside of the lock, not to block the recorder while the socket is busy
+        if piece is not None:
+            self.publish_piece(*piece)
+
+    def on_canceled(self, evt):
+        print("*** Streaming recognition canceled:", evt.cancellation_details.reason, "***")
+        # Unless stop_streaming closed the stream, the recognizer is replaced when the next segment starts (it cannot
+        # be stopped from its own callback)
+        with self.stream_condition:
+            if evt.cancellation_details.reason != speechsdk.CancellationReason.EndOfStream:
+                self.stream_canceled = True
+            self.stream_condition.notify_all()
+
+    # Waits for the recognizer to reach the end of the audio pushed in the turn and adds the sentences to the dialogue
+    # turn
+    def finish_streaming_turn(self):
+        with self.stream_condition:
+            if self.stream_segments:
+                end = self.pushed_samples - int(stream_end_tolerance * rate)
+                self.stream_condition.wait_for(lambda: self.recognized_samples >= end or
+                                               self.stream_canceled, timeout=self.streaming_timeout)
+            sentences = self.stream_sentences
+            self.stream_sentences = []
+            segments = self.stream_segments
+            self.stream_segments = []
+        if segments:
+            self.segments_per_turn.observe(len(segments))
+        if self.speaker_id_mode == "turn" and self.turn_speaker_task is None:
+            self.start_turn_identification()
+        # Wait for the identification of the speakers
+        self.turn_tasks.join()
+        self.tracer.event("join_complete", turn=self.turn_id)
+        turn_speaker_id = self.turn_speaker_id() if self.speaker_id_mode == "turn" else None
+        for segment, sentence, duration in sentences:
+            turn_piece = TurnPiece(turn_speaker_id or segment["speaker"][0], sentence, duration)
+            self.dialogue_turn.add_turn_piece(turn_piece)
 
     @staticmethod
     def rms(frame):
-        count = len(frame) / s_width
-        frmt = "%dh" % count
-        shorts = struct.unpack(frmt, frame)
-
-        sum_squares = 0.0
-        for sample in shorts:
-            n = sample * short_normalize
-            sum_squares += n * n
-        rms = math.pow(sum_squares / count, 0.5)
-        return rms * 1000
-
-    def record(self):
+        return audio_analysis.rms(frame)
+
+    # Starts the capture: the audio captured while the recorder was not listening is discarded
+    def start_listening(self):
+        self.capture.start()
+        self.segmenter.reset()
+
+    # Reads the microphone until the end of the turn or, if stop is given, until stop() returns True (it is checked
+    # between the segments)
+    def listen_turn(self, stop=None):
+        while True:
+            if self.client_gone.is_set():
+                return
+            events = self.process_chunk(self.capture.read())
+            if stop is None:
+                if any(event == turn_end for event, segment in events):
+                    self.turn_final_silence = self.segmenter.final_silence / rate
+                    print("*** End of turn after", round(self.turn_final_silence, 2), "seconds of silence ***")
+                    return
+            elif self.segmenter.segment is None and stop():
+                return
+
+    # Passes a chunk to the segmenter and handles the start and the end of the segments
+    def process_chunk(self, data):
+        self.chunks_processed.inc()
+        events = self.segmenter.process(data)
+        for event, segment in events:
+            if event == segment_start:
+                self.start_segment(segment)
+            elif event == segment_end:
+                if self.streaming:
+                    self.push_audio(data)
+                self.end_segment(segment)
+        if not events and self.streaming and self.segmenter.segment is not None:
+            self.push_audio(data)
+        if self.endpointer is not None and self.segmenter.segment is None and self.segmenter.turn_segments:
+            # The silence needed to end the turn changes as the transcripts of the turn arrive
+            self.segmenter.set_final_silence_time(self.endpointer.final_silence(self.turn_text()))
+        return events
+
+    def start_segment(self, segment):
         print('*** Noise detected: start recording ***')
-        rec = []
-        if self.prev_input:
-            for c in self.prev_input:
-                rec.append(c)
-
-        start_time = time.time()
-        current = time.time()
-        end = time.time() + split_silence_time
-        timeout = time.time() + 30
-        while current <= end:
-            data = self.stream.read(chunk, exception_on_overflow=False)
-            if self.rms(data) >= rms_threshold:
-                end = time.time() + split_silence_time
-            current = time.time()
-            rec.append(data)
-            # Limit the audio duration to 1 minute
-            if time.time() > timeout:
-                break
-        end_time = time.time()
-        wav_duration = end_time - start_time
-        self.prev_input = []
-        self.write(b''.join(rec), wav_duration)
-
-    def write(self, recording, wav_duration):
+        self.vad_triggers.inc()
+        self.tracer.event("noise_onset", turn=self.turn_id, segment=segment.index)
+        if self.streaming:
+            if self.stream_recognizer is None or self.stream_canceled:
+                self.start_streaming()
+            # start and offset are those of the first pushed sample (of the pre-roll audio), the speaker is filled in
+            # when the segment ends and is identified
+            self.stream_segment = {"id": segment.index, "start": self.pushed_samples,
+                                   "offset": max(segment.offset - segment.pre_roll_time, 0),
+                                   "speaker": [unknown_speaker_id]}
+            with self.stream_condition:
+                self.stream_segments.append(self.stream_segment)
+            # The pre-roll audio and the first chunk
+            self.push_audio(segment.pcm())
+
+    def end_segment(self, segment):
+        self.tracer.event("segment_end", segment=segment.index, offset=segment.offset, duration=segment.duration)
+        if self.streaming:
+            pcm = segment.pcm()
+            if self.endpointer is not None:
+                self.endpointer.end_segment(pcm)
+            self.write_streaming(pcm, self.stream_segment)
+            return
+        # The audio pushed in streaming mode has already been sent, so the gate is applied only to the other modes
+        recording = self.speech_gate.filter(segment.pcm())
+        if recording is None:
+            print('*** No speech in the recording: segment discarded. Return to listening ***')
+            self.segments_rejected.inc()
+            self.tracer.event("segment_rejected", segment=segment.index)
+            return
+        if self.endpointer is not None:
+            self.endpointer.end_segment(recording)
+        # The duration and the offset are those measured by the segmenter, not those of the trimmed recording
+        self.write(recording, segment.duration, segment.index, segment.offset)
+
+    # Saves a copy of the segment on disk (only when an archive folder has been given)
+    def archive(self, recording, segment):
         date_time = time.strftime("%Y%m%d-%H%M%S")
-        filename = os.path.join(os.getcwd(), '{}.wav'.format(date_time))
+        millis = int(time.time() * 1000) % 1000
+        filename = os.path.join(self.archive_dir, '{}-{:03d}-{}.wav'.format(date_time, millis, segment))
         wf = wave.open(filename, 'wb')
         wf.setnchannels(channels)
         wf.setsampwidth(self.p.get_sample_size(audio_format))
         wf.setframerate(rate)
         wf.writeframes(recording)
         wf.close()
-        print('*** Recording saved. Return to listening ***')
         # print('Written to file: {}'.format(filename))
+
+    def write(self, recording, wav_duration, segment=None, offset=None):
+        if self.archive_dir:
+            self.archive(recording, segment)
+        self.tracer.event("buffer_ready", segment=segment)
+        print('*** Recording completed. Return to listening ***')
+        if self.mode == "continuous" and self.speaker_id_mode == "turn":
+            self.add_turn_audio(recording)
         if self.mode == "continuous":
-            self.t1 = threading.Thread(target=self.speech_and_speaker_recognition, args=(filename, wav_duration,))
-            self.t1.start()
+            # When the speaker is identified per segment, the identification is submitted before the transcription, so
+            # that the transcription never waits for a task queued after it
+            prof_dict = self.profiles.get() if self.speaker_id_mode == "segment" else {}
+            identification = None
+            if prof_dict:
+                identification = self.transcription_pool.submit(self.identify_segment, recording, prof_dict,
+                                                                [unknown_speaker_id], segment)
+            self.turn_tasks.submit(self.speech_and_speaker_recognition, recording, wav_duration, segment, offset,
+                                   identification)
         else:
-            self.t1 = threading.Thread(target=self.speech_recognition, args=(filename,))
-            self.t1.start()
+            self.turn_tasks.submit(self.speech_recognition, recording, segment)
+
+    # In streaming mode the audio has already been sent to the recognizer: only the speaker is identified here
+    def write_streaming(self, recording, segment):
+        segment_id = segment["id"]
+        if self.archive_dir:
+            self.archive(recording, segment_id)
+        self.tracer.event("buffer_ready", segment=segment_id)
+        if self.speaker_id_mode == "turn":
+            self.add_turn_audio(recording)
+            prof_dict = {}
+        else:
+            prof_dict = self.profiles.get()
+        if prof_dict:
+            self.turn_tasks.submit(self.identify_segment, recording, prof_dict, segment["speaker"], segment_id)
+        print('*** Recording completed. Return to listening ***')
+
+    # Called (from another thread) when the client disconnects: the turn being recorded is abandoned, so that its
+    # messages are not sent to the next client
+    def abort_turn(self):
+        self.client_gone.set()
+
+    # Stops the capture and waits for the tasks of the abandoned turn, without sending anything
+    def abandon_turn(self):
+        print("*** Client disconnected: turn abandoned ***")
+        self.capture.stop()
+        self.protocol = None
+        with self.stream_condition:
+            self.stream_segments = []
+            self.stream_sentences = []
+        self.turn_tasks.join()
+
+    # Gets ready to listen to a client that has just connected
+    def prepare_listening(self):
+        self.client_gone.clear()
+        if self.streaming and (self.stream_recognizer is None or self.stream_canceled):
+            self.start_streaming()
+        elif not self.streaming:
+            self.stt_backend.warm_up()
+        self.start_listening()
+        self.vad.calibrate_from(self.capture, self.prev_input)
+        print("*** Listening ***")
+
+    # Listens until the user says something, then stops the capture and sends the ack and the dialogue turn to the
+    # client with the given protocol. The capture is started again when the client is ready (see resume_listening)
+    def converse_turn(self, protocol):
+        self.protocol = protocol
+        while True:
+            self.new_turn()
+            self.listen_turn()
+            if self.client_gone.is_set():
+                self.abandon_turn()
+                return
+            two_secs_silence = time.time()
+            self.tracer.event("final_silence", turn=self.turn_id, silence=self.turn_final_silence)
+            acknowledged = False
+            if self.streaming:
+                self.finish_streaming_turn()
+            elif len(self.turn_tasks):
+                # If a segment already contains text, the user has said something: send the ack right away
+                if self.partial_text():
+                    self.capture.stop()
+                    protocol.ack(self.turn_id)
+                    self.tracer.event("ack_sent", turn=self.turn_id, early=True)
+                    acknowledged = True
+                print("*** Waiting for every segment of the turn to be transcribed ***", self.pool_stats())
+                self.finish_turn()
+            if self.client_gone.is_set():
+                self.abandon_turn()
+                return
+            if self.dialogue_turn.get_text() not in ["", " "]:
+                if not acknowledged:
+                    self.capture.stop()
+                    # as soon as the user has finished talking, send an ack to the server
+                    protocol.ack(self.turn_id)
+                    self.tracer.event("ack_sent", turn=self.turn_id, early=False)
+                finished_transcription = time.time()
+                final_delay = finished_transcription - two_secs_silence
+                print("# FINAL DELAY:", final_delay)
+                if not self.streaming:
+                    print("# STT BACKEND:", self.stt_backend.stats())
+                print("# CAPTURE:", self.capture.stats())
+                print("Recognized string:", self.dialogue_turn.get_text())
+                xml_string = self.dialogue_turn.to_xml_string()
+                print("*** Sending to client:", xml_string)
+                # Useless to surround with a try - except because send does not care
+                protocol.final(self.turn_id, xml_string, self.dialogue_turn.get_text())
+                self.tracer.event("xml_sent", turn=self.turn_id, final_delay=final_delay)
+                return
+
+    # Handles the message sent by the client after a dialogue turn: returns False if the client has disconnected
+    def resume_listening(self, client_msg):
+        self.tracer.event("client_ready", turn=self.turn_id)
+        if client_msg == "":
+            print("*** Client disconnected from socket! ***")
+            self.stop_streaming()
+            return False
+        # Empty the dialogue turn in case in the meanwhile a thread has written something
+        self.dialogue_turn = DialogueTurn()
+        self.start_listening()
+        print("*** Listening ***")
+        return True
 
     def listen_continuous(self, server_recorder_socket):
         while True:
             print("*** Waiting for the client to connect ***")
             connection, address = server_recorder_socket.accept()
             print("*** Waiting for client to be ready ***")
-            connection.recv(256).decode('utf-8')
-            self.stream.start_stream()
-            print("*** Listening ***")
-
+            # The first message of the client chooses the protocol
+            protocol = open_protocol(connection.recv(256), connection.sendall)
+            protocol.receive(connection)
+            self.prepare_listening()
             while True:
-                self.dialogue_turn = DialogueTurn()
-                current = time.time()
-                end = time.time() + final_silence_time
-                print("init current = ", current, " end = ", end)
-                while current <= end:
-                    audio_input = self.stream.read(chunk, exception_on_overflow=False)
-                    rms_val = self.rms(audio_input)
-                    if rms_val > rms_threshold:
-                        self.record()
-                        end = time.time() + final_silence_time
-                    else:
-                        self.prev_input.append(audio_input)
-                        if len(self.prev_input) > self.max_chunks:
-                            self.prev_input = self.prev_input[1:]
-                        current = time.time()
-                if self.dialogue_turn.get_text() not in ["", " "]:
-                    two_secs_silence = time.time()
-                    self.stream.stop_stream()
-                    # as soon as the user has finished talking, send an ack to the server
-                    connection.send("user finished talking".encode('utf-8'))
-                    print("*** Waiting for last thread to finish transcription ***")
-                    self.t1.join()
-                    finished_transcription = time.time()
-                    # TODO: write this time in log file
-                    final_delay = finished_transcription - two_secs_silence
-                    print("# FINAL DELAY:", final_delay)
-                    print("Recognized string:", self.dialogue_turn.get_text())
-                    xml_string = self.dialogue_turn.to_xml_string()
-                    print("*** Sending to client:", xml_string)
-                    # Useless to surround with a try - except because send does not care
-                    connection.send(xml_string.encode('utf-8'))
-                    print("*** Waiting for client to be ready ***")
-                    client_msg = connection.recv(256).decode('utf-8')
-                    if client_msg == "":
-                        print("*** Client disconnected from socket! ***")
-                        break
-                    # Empty the dialogue turn in case in the meanwhile a thread has written something
-                    self.dialogue_turn = DialogueTurn()
-                    self.stream.start_stream()
-                    print("*** Listening ***")
+                self.converse_turn(protocol)
+                print("*** Waiting for client to be ready ***")
+                if not self.resume_listening(protocol.receive(connection)):
+                    break
 
     def listen_wait(self, server_recorder_socket):
         while True:
@@ -240,76 +700,61 @@ class Recorder:
             connection, address = server_recorder_socket.accept()
             print("*** Waiting for client to be ready ***")
             connection.recv(256).decode('utf-8')
-            self.stream.start_stream()
+            self.stt_backend.warm_up()
+            self.start_listening()
+            self.vad.calibrate_from(self.capture, self.prev_input)
             print("*** Listening ***")
             sentence_type = ""
 
             while True:
-                self.dialogue_turn = DialogueTurn()
-                current = time.time()
-                end = time.time() + final_silence_time
+                self.new_turn()
                 if sentence_type == "w":
-                    while True:
-                        if any(elem in self.dialogue_turn.get_text() for elem in exit_keywords):
-                            break
-                        audio_input = self.stream.read(chunk, exception_on_overflow=False)
-                        rms_val = self.rms(audio_input)
-                        if rms_val > rms_threshold:
-                            self.record()
-                        else:
-                            self.prev_input.append(audio_input)
-                            if len(self.prev_input) > self.max_chunks:
-                                self.prev_input = self.prev_input[1:]
+                    # The turn ends only when the passphrase is recognized
+                    self.listen_turn(stop=lambda: any(elem in self.partial_text() for elem in exit_keywords))
                 else:
-                    while current <= end:
-                        audio_input = self.stream.read(chunk, exception_on_overflow=False)
-                        rms_val = self.rms(audio_input)
-                        if rms_val > rms_threshold:
-                            end = time.time() + final_silence_time
-                            self.record()
-                        else:
-                            self.prev_input.append(audio_input)
-                            if len(self.prev_input) > self.max_chunks:
-                                self.prev_input = self.prev_input[1:]
-                            current = time.time()
+                    self.listen_turn()
+                self.tracer.event("final_silence", turn=self.turn_id)
+                self.finish_turn()
                 if self.dialogue_turn.get_text() not in ["", " "]:
-                    self.stream.stop_stream()
+                    self.capture.stop()
                     print("Recognized string:", self.dialogue_turn.get_text())
                     xml_string = self.dialogue_turn.to_xml_string()
                     print("*** Sending to client:", xml_string)
                     # Useless to surround with a try - except because send does not care
                     connection.send(xml_string.encode('utf-8'))
+                    self.tracer.event("xml_sent", turn=self.turn_id)
                     print("*** Waiting for client to be ready ***")
                     sentence_type = connection.recv(256).decode('utf-8')
+                    self.tracer.event("client_ready", turn=self.turn_id)
                     if sentence_type == "":
                         print("*** Client disconnected from socket! ***")
                         break
                     # Empty the dialogue turn in case in the meanwhile a thread has written something
                     self.dialogue_turn = DialogueTurn()
-                    self.stream.start_stream()
+                    self.start_listening()
                     print("*** Listening ***")
 
     def listen_once(self):
         self.mode = "once"
         print("*** Listening ***")
         self.recognized_text = ""
-        self.stream.start_stream()
+        self.stt_backend.warm_up()
+        self.start_listening()
+        self.vad.calibrate_from(self.capture, self.prev_input)
         while True:
-            current = time.time()
-            end = time.time() + final_silence_time
-            while current <= end:
-                audio_input = self.stream.read(chunk, exception_on_overflow=False)
-                rms_val = self.rms(audio_input)
-                if rms_val > rms_threshold:
-                    end = time.time() + final_silence_time
-                    self.record()
-                else:
-                    self.prev_input.append(audio_input)
-                    if len(self.prev_input) > self.max_chunks:
-                        self.prev_input = self.prev_input[1:]
-                    current = time.time()
+            self.turn_id = next(self.turn_counter)
+            self.turn_tasks = self.transcription_pool.new_turn()
+            self.segmenter.new_turn()
+            if self.endpointer is not None:
+                self.endpointer.new_turn()
+            self.listen_turn()
+            self.tracer.event("final_silence", turn=self.turn_id)
+            for sentence in self.turn_tasks.join():
+                if sentence is not None:
+                    self.recognized_text = self.recognized_text + " " + sentence
+            self.tracer.event("join_complete", turn=self.turn_id)
             if self.recognized_text != "":
-                self.stream.stop_stream()
+                self.capture.stop()
                 self.recognized_text = self.recognized_text.strip()
                 print("Recognized string:", self.recognized_text)
                 return self.recognized_text
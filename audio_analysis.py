@@ -0,0 +1,116 @@
+"""
+Authors:     Lucrezia Grassi (concept, design and code writing),
+             Carmine Tommaso Recchiuto (concept and design),
+             Antonio Sgorbissa (concept and design)
+Email:       lucrezia.grassi@edu.unige.it
+Affiliation: RICE, DIBRIS, University of Genoa, Italy
+
+This file contains the methods used to analyse the audio frames acquired from the microphone.
+The frames are the raw 16 bit PCM buffers returned by PyAudio and are viewed as NumPy arrays without copying them.
+All the analysis methods accept either a single frame or a batch of frames (a 2D array with one frame per row).
+It also contains the helper used to wrap PCM data in an in-memory WAV container.
+"""
+import numpy as np
+import wave
+import io
+
+short_normalize = (1.0 / 32768.0)
+# Value returned by dbfs() for digital silence, to avoid log10(0)
+min_dbfs = -120.0
+# Range of the pitch of the voice (in Hz) and minimum normalized autocorrelation of a voiced frame
+min_pitch = 70
+max_pitch = 400
+voicing_threshold = 0.4
+
+
+# Returns a read-only int16 view of the PyAudio buffer (no copy is performed)
+def samples(frame):
+    if isinstance(frame, np.ndarray):
+        return frame
+    return np.frombuffer(frame, dtype=np.int16)
+
+
+# Splits a buffer containing several consecutive frames into a 2D array with one frame of frame_size samples per row.
+# Trailing samples that do not fill a whole frame are discarded.
+def frames(buffer, frame_size):
+    s = samples(buffer)
+    n_frames = len(s) // frame_size
+    return s[:n_frames * frame_size].reshape(n_frames, frame_size)
+
+
+# Mean of the squared normalized samples along the last axis, computed in float32 to keep the idle loop cheap
+def _mean_square(s):
+    s = s.astype(np.float32) * np.float32(short_normalize)
+    return np.einsum('...i,...i->...', s, s) / s.shape[-1]
+
+
+# Root mean square of the frame(s), scaled by 1000 as the thresholds used by the recorders
+def rms(frame):
+    s = samples(frame)
+    if s.shape[-1] == 0:
+        return 0.0 if s.ndim == 1 else np.zeros(s.shape[0], dtype=np.float32)
+    value = np.sqrt(_mean_square(s)) * 1000
+    return float(value) if s.ndim == 1 else value
+
+
+# Absolute peak of the frame(s), normalized between 0 and 1
+def peak(frame):
+    s = samples(frame)
+    if s.shape[-1] == 0:
+        return 0.0 if s.ndim == 1 else np.zeros(s.shape[0], dtype=np.float32)
+    # Work in int32 so that abs(-32768) does not overflow
+    value = np.abs(s.astype(np.int32)).max(axis=-1) * short_normalize
+    return float(value) if s.ndim == 1 else value
+
+
+# Level of the frame(s) in dB relative to full scale
+def dbfs(frame):
+    s = samples(frame)
+    if s.shape[-1] == 0:
+        return min_dbfs if s.ndim == 1 else np.full(s.shape[0], min_dbfs, dtype=np.float32)
+    mean_square = _mean_square(s)
+    with np.errstate(divide='ignore'):
+        value = np.maximum(10 * np.log10(mean_square), min_dbfs)
+    return float(value) if s.ndim == 1 else value
+
+
+# Fraction of consecutive samples in the frame(s) that change sign
+def zero_crossing_rate(frame):
+    s = samples(frame)
+    if s.shape[-1] < 2:
+        return 0.0 if s.ndim == 1 else np.zeros(s.shape[0], dtype=np.float32)
+    negative = np.signbit(s)
+    value = np.count_nonzero(negative[..., 1:] != negative[..., :-1], axis=-1) / (s.shape[-1] - 1)
+    return float(value) if s.ndim == 1 else value.astype(np.float32)
+
+
+# Fundamental frequency (in Hz) of the frame(s), estimated from the peak of the autocorrelation in the range of the
+# voice. The frames without a clear periodicity (unvoiced or silent) have pitch 0
+def pitch(frame, rate):
+    s = samples(frame)
+    batch = np.atleast_2d(s).astype(np.float32)
+    n = batch.shape[-1]
+    min_lag = int(rate / max_pitch)
+    max_lag = min(int(rate / min_pitch), n - 1)
+    if max_lag <= min_lag:
+        return 0.0 if s.ndim == 1 else np.zeros(batch.shape[0], dtype=np.float32)
+    batch = batch - batch.mean(axis=-1, keepdims=True)
+    # Autocorrelation computed with the FFT, zero padded so that it is not circular
+    n_fft = 1 << (2 * n - 1).bit_length()
+    spectrum = np.fft.rfft(batch, n_fft)
+    acf = np.fft.irfft(spectrum.real ** 2 + spectrum.imag ** 2, n_fft)[:, :max_lag + 1]
+    lags = np.argmax(acf[:, min_lag:], axis=1) + min_lag
+    strength = acf[np.arange(len(lags)), lags] / (acf[:, 0] + 1e-10)
+    value = np.where(strength >= voicing_threshold, rate / lags, 0.0).astype(np.float32)
+    return float(value[0]) if s.ndim == 1 else value
+
+
+# Wraps 16 bit PCM data in a WAV container kept in memory, ready to be uploaded without touching the disk
+def to_wav_bytes(pcm, rate, channels=1):
+    buffer = io.BytesIO()
+    with wave.open(buffer, 'wb') as wf:
+        wf.setnchannels(channels)
+        wf.setsampwidth(2)
+        wf.setframerate(rate)
+        wf.writeframes(pcm)
+    return buffer.getvalue()
@@ -0,0 +1,123 @@
+"""
+Authors:     Lucrezia Grassi (concept, design and code writing),
+             Carmine Tommaso Recchiuto (concept and design),
+             Antonio Sgorbissa (concept and design)
+Email:       lucrezia.grassi@edu.unige.it
+Affiliation: RICE, DIBRIS, University of Genoa, Italy
+
+This file contains the capture layer used by the recorders.
+The PyAudio stream is opened in callback mode: PortAudio delivers every chunk on its own thread, and the callback only
+appends it to a deque (append and popleft are atomic, so no lock is taken on the audio thread).
+The recorder consumes the chunks with read(), so a slow iteration of its loop (writing a segment, sending data on the
+socket, ...) delays the processing of the audio but does not make the capture lose it.
+If the device cannot capture at the rate requested by the recorder, it is opened at its default rate and the chunks
+are resampled when they are read.
+"""
+from resampler import Resampler
+import collections
+import threading
+import pyaudio
+
+# Seconds of audio that can be queued before the oldest chunks are dropped
+max_queued_time = 10
+
+
+class AudioCapture:
+    # rate and chunk are the sample rate and the number of samples of the chunks returned by read()
+    def __init__(self, p, audio_format, channels, rate, chunk, input_device_index=None):
+        self.init_queue(rate, self.device_sample_rate(p, audio_format, channels, rate, input_device_index), chunk)
+        self.stream = p.open(format=audio_format, channels=channels, rate=self.device_rate, input=True,
+                             frames_per_buffer=self.chunk, start=False, input_device_index=input_device_index,
+                             stream_callback=self.callback)
+
+    # Prepares the queue of the chunks delivered at device_rate and read at rate (also used by the captures that do not
+    # read a device, e.g. the replay of a file)
+    def init_queue(self, rate, device_rate, chunk):
+        self.rate = rate
+        self.device_rate = device_rate
+        if self.device_rate == rate:
+            self.resampler = None
+        else:
+            print("Capturing at", self.device_rate, "Hz and resampling to", rate, "Hz")
+            self.resampler = Resampler(self.device_rate, rate)
+        # Keep the duration of the chunks independent of the rate of the device
+        self.chunk = int(round(chunk * self.device_rate / rate))
+        max_chunks = int(max_queued_time * self.device_rate / self.chunk)
+        self.queue = collections.deque(maxlen=max_chunks)
+        self.data_ready = threading.Event()
+        # Counters of the problems reported by PortAudio and of the chunks dropped because the queue was full
+        self.overflows = 0
+        self.underruns = 0
+        self.dropped_chunks = 0
+        self.captured_chunks = 0
+
+    # Returns the requested rate if the device supports it natively, otherwise the default rate of the device
+    @staticmethod
+    def device_sample_rate(p, audio_format, channels, rate, input_device_index):
+        # The index of the default device is needed, as PyAudio does not check a format without an input device
+        if input_device_index is None:
+            info = p.get_default_input_device_info()
+        else:
+            info = p.get_device_info_by_index(input_device_index)
+        try:
+            if p.is_format_supported(rate, input_device=info["index"], input_channels=channels,
+                                     input_format=audio_format):
+                return rate
+        except ValueError:
+            pass
+        return int(info["defaultSampleRate"])
+
+    # Called by PortAudio on its own thread for every captured chunk
+    def callback(self, in_data, frame_count, time_info, status):
+        if status & pyaudio.paInputOverflow:
+            self.overflows += 1
+        if status & pyaudio.paInputUnderflow:
+            self.underruns += 1
+        if len(self.queue) == self.queue.maxlen:
+            self.dropped_chunks += 1
+        self.queue.append(in_data)
+        self.captured_chunks += 1
+        self.data_ready.set()
+        return None, pyaudio.paContinue
+
+    # Returns the oldest chunk that has not been read yet (resampled if needed), waiting for it if necessary
+    def read(self):
+        while True:
+            try:
+                data = self.queue.popleft()
+            except IndexError:
+                data = None
+            if data is not None:
+                if self.resampler is not None:
+                    return self.resampler.process(data)
+                return data
+            # Clear the event before checking the queue again, so that a chunk appended in between is not missed
+            self.data_ready.clear()
+            if not self.queue:
+                self.wait_for_data()
+
+    # Waits until a chunk is appended to the queue
+    def wait_for_data(self):
+        self.data_ready.wait()
+
+    # Number of chunks captured but not read yet
+    def backlog(self):
+        return len(self.queue)
+
+    # The audio captured while the stream was stopped (or not yet read) is discarded
+    def start(self):
+        self.queue.clear()
+        if self.resampler is not None:
+            self.resampler.reset()
+        self.stream.start_stream()
+
+    def stop(self):
+        self.stream.stop_stream()
+
+    def stats(self):
+        return {"captured": self.captured_chunks, "backlog": len(self.queue), "dropped": self.dropped_chunks,
+                "overflows": self.overflows, "underruns": self.underruns}
+
+    def close(self):
+        self.stream.stop_stream()
+        self.stream.close()
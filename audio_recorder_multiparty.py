@@ -9,9 +9,13 @@ This file contains a script that acquires data from the microphone everytime the
 The audio is split each t seconds, and it is transcribed using microsoft APIs.
 After s seconds of silence, the whole sentence is transcribed, tagged and sent to the client.
 """
-from Recorder import Recorder
+from Recorder import Recorder, rate, channels
+from speaker_backends import get_backend
+from stt_backends import get_stt_backend
+from metrics import start_metrics_server
 import argparse
 import socket
+import os
 
 
 if __name__ == '__main__':
@@ -22,6 +26,18 @@ if __name__ == '__main__':
     parser = argparse.ArgumentParser(description=text)
     # Add long and short argument
     parser.add_argument("--language", "-l", help="set the language of the audio recorder to en or it")
+    parser.add_argument("--archive", "-a", help="folder in which a copy of each recorded segment is saved as WAV")
+    parser.add_argument("--trace", "-T", help="JSONL file in which the latency of each stage of the turns is traced")
+    parser.add_argument("--metrics-port", "-M", type=int, help="port on which the metrics are published over HTTP")
+    parser.add_argument("--streaming", "-s", action="store_true",
+                        help="send the audio to the recognizer while the user is talking")
+    parser.add_argument("--turn-speaker", "-t", action="store_true",
+                        help="identify the speaker once per turn instead of once per segment")
+    parser.add_argument("--speaker-backend", "-b", choices=["azure", "local"], default="azure",
+                        help="identify the speakers with Microsoft APIs (azure) or offline (local)")
+    parser.add_argument("--stt-backend", "-r", choices=["azure", "google", "local"], default="azure",
+                        help="transcribe the segments with Microsoft APIs (azure), Google APIs (google) or with "
+                             "scripted transcripts (local)")
     # Read arguments from the command line
     args = parser.parse_args()
     if not args.language:
@@ -42,5 +58,15 @@ if __name__ == '__main__':
     server_recorder_socket.bind(("0.0.0.0", 9090))
     server_recorder_socket.listen(1)
 
-    a = Recorder(language)
+    if args.archive:
+        os.makedirs(args.archive, exist_ok=True)
+        print("The recorded segments will be archived in", args.archive)
+
+    if args.metrics_port:
+        start_metrics_server(args.metrics_port)
+
+    a = Recorder(language, archive_dir=args.archive, streaming=args.streaming,
+                 speaker_id_mode="turn" if args.turn_speaker else "segment",
+                 speaker_backend=get_backend(args.speaker_backend),
+                 stt_backend=get_stt_backend(args.stt_backend, language, rate, channels), trace_file=args.trace)
     a.listen_continuous(server_recorder_socket)
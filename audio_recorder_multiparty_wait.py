@@ -10,8 +10,10 @@ The audio is split each t seconds, and it is transcribed using microsoft APIs.
 Once a passphrase is recognized the whole text is transcribed, tagged and sent to the client.
 """
 from Recorder import Recorder
+from metrics import start_metrics_server
 import argparse
 import socket
+import os
 
 
 if __name__ == '__main__':
@@ -22,6 +24,9 @@ if __name__ == '__main__':
     parser = argparse.ArgumentParser(description=text)
     # Add long and short argument
     parser.add_argument("--language", "-l", help="set the language of the audio recorder to en or it")
+    parser.add_argument("--archive", "-a", help="folder in which a copy of each recorded segment is saved as WAV")
+    parser.add_argument("--trace", "-T", help="JSONL file in which the latency of each stage of the turns is traced")
+    parser.add_argument("--metrics-port", "-M", type=int, help="port on which the metrics are published over HTTP")
     # Read arguments from the command line
     args = parser.parse_args()
     if not args.language:
@@ -40,5 +45,12 @@ if __name__ == '__main__':
     server_recorder_socket.bind(("0.0.0.0", 9090))
     server_recorder_socket.listen(1)
 
-    a = Recorder(language)
+    if args.archive:
+        os.makedirs(args.archive, exist_ok=True)
+        print("The recorded segments will be archived in", args.archive)
+
+    if args.metrics_port:
+        start_metrics_server(args.metrics_port)
+
+    a = Recorder(language, archive_dir=args.archive, trace_file=args.trace)
     a.listen_wait(server_recorder_socket)
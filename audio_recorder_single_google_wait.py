@@ -9,17 +9,16 @@ This file contains a script that acquires data from the microphone everytime the
 The audio is split each t seconds, and it is transcribed using google APIs.
 Once a passphrase is recognized the whole text is transcribed and sent to the client.
 """
-from google.cloud import speech
+from stt_backends import GoogleSttBackend
 import threading
 import pyaudio
 import socket
-import struct
-import math
-import wave
+import audio_analysis
+from vad import AdaptiveVad, SpeechGate
+from audio_capture import AudioCapture
+from ring_buffer import RingBuffer
 import time
-import gc
 import os
-import io
 
 os.environ["GOOGLE_APPLICATION_CREDENTIALS"] = "caresses-nlp-3b12fdd574b1.json"
 
@@ -27,7 +26,6 @@ os.environ["GOOGLE_APPLICATION_CREDENTIALS"] = "caresses-nlp-3b12fdd574b1.json"
 # SUBSCRIPTION_KEY = ""
 
 rms_threshold = 60
-short_normalize = (1.0 / 32768.0)
 chunk = 1024
 audio_format = pyaudio.paInt16
 channels = 1
@@ -35,6 +33,9 @@ rate = 44100
 s_width = 2
 split_silence_time = 0.5
 final_silence_time = 1
+# Seconds of audio preceding the noise detection that are kept and prepended to each segment
+pre_roll_time = 0.5
+language = "it-IT"
 exit_keywords = ["passo e chiudo", "cosa ne pensi"]
 
 # Create the socket - server side: waits for the client to connect
@@ -44,74 +45,43 @@ server_recorder_socket.bind(("0.0.0.0", 9090))
 server_recorder_socket.listen(1)
 
 
-def google_sender(speech_file):
-    client = speech.SpeechClient()
-
-    with io.open(speech_file, "rb") as audio_file:
-        content = audio_file.read()
-
-    audio = speech.RecognitionAudio(content=content)
-    config = speech.RecognitionConfig(
-        encoding=speech.RecognitionConfig.AudioEncoding.LINEAR16,
-        language_code="it-IT",
-    )
-
-    response = client.recognize(config=config, audio=audio)
-
-    # Each result is for a consecutive portion of the audio. Iterate through
-    # them to get the transcripts for the entire audio file.
-    for result in response.results:
-        # The first alternative is the most likely one for this portion.
-        return result.alternatives[0].transcript
-
-
 class Recorder:
     def __init__(self):
         self.p = pyaudio.PyAudio()
-        self.stream = self.p.open(format=audio_format, channels=channels, rate=rate, input=True, output=True,
-                                  frames_per_buffer=chunk)
-        self.prev_input = []
-        self.max_chunks = 20
+        self.capture = AudioCapture(self.p, audio_format, channels, rate, chunk)
+        # Audio heard just before the noise is detected, prepended to every segment
+        self.prev_input = RingBuffer(int(pre_roll_time * rate))
+        # Voice activity detector following the noise floor, rms_threshold is the minimum threshold
+        self.vad = AdaptiveVad(rms_threshold, chunk / rate)
+        # Spectral check that rejects the segments without speech before they are transcribed
+        self.speech_gate = SpeechGate(rate)
         self.string_to_send = ""
+        self.stt_backend = GoogleSttBackend(language, rate, channels)
 
-    def transcribe_file(self, wav_filename):
-        result = google_sender(wav_filename)
-        print(result)
-        if result:
-            self.string_to_send = self.string_to_send + " " + result
+    def transcribe(self, recording):
+        text = self.stt_backend.transcribe(recording)
+        print(text)
+        if text:
+            self.string_to_send = self.string_to_send + " " + text
         else:
             print("*** Not able to perform speech to text ***")
-        gc.collect()
-        # Delete the original wav file without final silence
-        if os.path.exists(wav_filename):
-            os.remove(wav_filename)
 
     @staticmethod
     def rms(frame):
-        count = len(frame) / s_width
-        frmt = "%dh" % count
-        shorts = struct.unpack(frmt, frame)
-
-        sum_squares = 0.0
-        for sample in shorts:
-            n = sample * short_normalize
-            sum_squares += n * n
-        rms = math.pow(sum_squares / count, 0.5)
-        return rms * 1000
+        return audio_analysis.rms(frame)
 
     def record(self):
         print('*** Noise detected: start recording ***')
         rec = []
         if self.prev_input:
-            for c in self.prev_input:
-                rec.append(c)
+            rec.append(self.prev_input.read())
 
         current = time.time()
         end = time.time() + split_silence_time
         timeout = time.time() + 30
         while current <= end:
-            data = self.stream.read(chunk)
-            if self.rms(data) >= rms_threshold:
+            data = self.capture.read()
+            if self.vad.is_speech(data, active=True):
                 end = time.time() + split_silence_time
             current = time.time()
             rec.append(data)
@@ -119,22 +89,17 @@ class Recorder:
             if time.time() > timeout:
                 print("Audio reached 30 seconds - stop recording")
                 break
-        self.prev_input = []
-        self.write(b''.join(rec))
+        self.prev_input.clear()
+        recording = self.speech_gate.filter(b''.join(rec))
+        if recording is None:
+            print('*** No speech in the recording: segment discarded. Return to listening ***')
+            return
+        self.write(recording)
 
     def write(self, recording):
-        date_time = time.strftime("%Y%m%d-%H%M%S")
-        filename = os.path.join(os.getcwd(), '{}.wav'.format(date_time))
-        wf = wave.open(filename, 'wb')
-        wf.setnchannels(channels)
-        wf.setsampwidth(self.p.get_sample_size(audio_format))
-        wf.setframerate(rate)
-        wf.writeframes(recording)
-        wf.close()
-        # print('Written to file: {}'.format(filename))
-        t1 = threading.Thread(target=self.transcribe_file, args=(format(filename),))
+        t1 = threading.Thread(target=self.transcribe, args=(recording,))
         t1.start()
-        print('*** Recording saved. Return to listening ***')
+        print('*** Recording completed. Return to listening ***')
 
     def listen(self):
         while True:
@@ -142,7 +107,8 @@ class Recorder:
             connection, address = server_recorder_socket.accept()
             print("*** Waiting for client to be ready ***")
             connection.recv(1024).decode('utf-8')
-            self.stream.start_stream()
+            self.capture.start()
+            self.vad.calibrate_from(self.capture, self.prev_input)
             print("*** Listening ***")
             sentence_type = ""
 
@@ -153,28 +119,22 @@ class Recorder:
                     while True:
                         if any(elem in self.string_to_send.lower() for elem in exit_keywords):
                             break
-                        audio_input = self.stream.read(chunk, exception_on_overflow=False)
-                        rms_val = self.rms(audio_input)
-                        if rms_val > rms_threshold:
+                        audio_input = self.capture.read()
+                        if self.vad.is_speech(audio_input):
                             self.record()
                         else:
-                            self.prev_input.append(audio_input)
-                            if len(self.prev_input) > self.max_chunks:
-                                self.prev_input = self.prev_input[1:]
+                            self.prev_input.write(audio_input)
                 else:
                     while current <= end:
-                        audio_input = self.stream.read(chunk, exception_on_overflow=False)
-                        rms_val = self.rms(audio_input)
-                        if rms_val > rms_threshold:
+                        audio_input = self.capture.read()
+                        if self.vad.is_speech(audio_input):
                             end = time.time() + final_silence_time
                             self.record()
                         else:
-                            self.prev_input.append(audio_input)
-                            if len(self.prev_input) > self.max_chunks:
-                                self.prev_input = self.prev_input[1:]
+                            self.prev_input.write(audio_input)
                             current = time.time()
                 if self.string_to_send:
-                    self.stream.stop_stream()
+                    self.capture.stop()
                     self.string_to_send = self.string_to_send.strip()
                     print("*** Sending to client:", self.string_to_send)
                     # Useless to surround with a try - except because send does not care
@@ -186,7 +146,7 @@ class Recorder:
                         break
                     # Empty the string in case a thread has written something in the meanwhile
                     self.string_to_send = ""
-                    self.stream.start_stream()
+                    self.capture.start()
                     print("*** Listening ***")
 
 
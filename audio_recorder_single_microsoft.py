@@ -9,21 +9,19 @@ This file contains a script that acquires data from the microphone everytime the
 The audio is split each t seconds, and it is transcribed using microsoft APIs.
 After s seconds of silence, the whole sentence is transcribed and sent to the client.
 """
-import gc
-import azure.cognitiveservices.speech as speechsdk
+from stt_backends import AzureSttBackend
 import threading
 import pyaudio
 import socket
-import struct
-import math
-import wave
+import audio_analysis
+from vad import AdaptiveVad, SpeechGate
+from audio_capture import AudioCapture
+from ring_buffer import RingBuffer
 import time
-import os
 import argparse
 
 language = "it-IT"
 rms_threshold = 60
-short_normalize = (1.0 / 32768.0)
 chunk = 1024
 audio_format = pyaudio.paInt16
 channels = 1
@@ -31,66 +29,48 @@ rate = 44100
 s_width = 2
 split_silence_time = 0.5
 final_silence_time = 1
+# Seconds of audio preceding the noise detection that are kept and prepended to each segment
+pre_roll_time = 0.5
 
 
 class Recorder:
     def __init__(self, lang):
         self.p = pyaudio.PyAudio()
-        self.stream = self.p.open(format=audio_format, channels=channels, rate=rate, input=True, output=True,
-                                  frames_per_buffer=chunk)
-        self.prev_input = []
-        self.max_chunks = 20
+        self.capture = AudioCapture(self.p, audio_format, channels, rate, chunk)
+        # Audio heard just before the noise is detected, prepended to every segment
+        self.prev_input = RingBuffer(int(pre_roll_time * rate))
+        # Voice activity detector following the noise floor, rms_threshold is the minimum threshold
+        self.vad = AdaptiveVad(rms_threshold, chunk / rate)
+        # Spectral check that rejects the segments without speech before they are transcribed
+        self.speech_gate = SpeechGate(rate)
         self.string_to_send = ""
-        self.speech_config = speechsdk.SpeechConfig(subscription=os.environ["COGNITIVE_SERVICE_KEY"], region="westeurope",
-                                                    speech_recognition_language=lang)
-
-    def microsoft_sender(self, wav_filename):
-        audio_input = speechsdk.AudioConfig(filename=wav_filename)
-        speech_recognizer = speechsdk.SpeechRecognizer(speech_config=self.speech_config, language=language,
-                                                       audio_config=audio_input)
-        result = speech_recognizer.recognize_once_async().get()
-        del speech_recognizer
-        return result
-
-    def transcribe_file(self, wav_filename):
-        result = self.microsoft_sender(wav_filename)
-        print(result.text)
-        if result.text:
-            self.string_to_send = result.text
+        self.stt_backend = AzureSttBackend(lang, rate, channels)
+
+    def transcribe(self, recording):
+        text = self.stt_backend.transcribe(recording)
+        print(text)
+        if text:
+            self.string_to_send = text
         else:
             print("*** Not able to perform speech to text ***")
-        gc.collect()
-        # Delete the original wav file without final silence
-        if os.path.exists(wav_filename):
-            os.remove(wav_filename)
 
     @staticmethod
     def rms(frame):
-        count = len(frame) / s_width
-        frmt = "%dh" % count
-        shorts = struct.unpack(frmt, frame)
-
-        sum_squares = 0.0
-        for sample in shorts:
-            n = sample * short_normalize
-            sum_squares += n * n
-        rms = math.pow(sum_squares / count, 0.5)
-        return rms * 1000
+        return audio_analysis.rms(frame)
 
     def record(self):
         print('*** Noise detected: start recording ***')
         rec = []
         if self.prev_input:
-            for c in self.prev_input:
-                rec.append(c)
+            rec.append(self.prev_input.read())
 
         start_time = time.time()
         current = time.time()
         end = time.time() + split_silence_time
         timeout = time.time() + 30
         while current <= end:
-            data = self.stream.read(chunk)
-            if self.rms(data) >= rms_threshold:
+            data = self.capture.read()
+            if self.vad.is_speech(data, active=True):
                 end = time.time() + split_silence_time
             current = time.time()
             rec.append(data)
@@ -101,22 +81,17 @@ class Recorder:
         end_time = time.time()
         wav_duration = end_time - start_time
 
-        self.prev_input = []
-        self.write(b''.join(rec))
+        self.prev_input.clear()
+        recording = self.speech_gate.filter(b''.join(rec))
+        if recording is None:
+            print('*** No speech in the recording: segment discarded. Return to listening ***')
+            return
+        self.write(recording)
 
     def write(self, recording):
-        date_time = time.strftime("%Y%m%d-%H%M%S")
-        filename = os.path.join(os.getcwd(), '{}.wav'.format(date_time))
-        wf = wave.open(filename, 'wb')
-        wf.setnchannels(channels)
-        wf.setsampwidth(self.p.get_sample_size(audio_format))
-        wf.setframerate(rate)
-        wf.writeframes(recording)
-        wf.close()
-        # print('Written to file: {}'.format(filename))
-        t1 = threading.Thread(target=self.transcribe_file, args=(format(filename),))
+        t1 = threading.Thread(target=self.transcribe, args=(recording,))
         t1.start()
-        print('*** Recording saved. Return to listening ***')
+        print('*** Recording completed. Return to listening ***')
 
     def listen(self):
         while True:
@@ -125,25 +100,24 @@ class Recorder:
             print("*** Waiting for client to be ready ***")
             connection.recv(1024).decode('utf-8')
             self.string_to_send = ""
-            self.stream.start_stream()
+            self.stt_backend.warm_up()
+            self.capture.start()
+            self.vad.calibrate_from(self.capture, self.prev_input)
             print("*** Listening ***")
 
             while True:
                 current = time.time()
                 end = time.time() + final_silence_time
                 while current <= end:
-                    audio_input = self.stream.read(chunk, exception_on_overflow=False)
-                    rms_val = self.rms(audio_input)
-                    if rms_val > rms_threshold:
+                    audio_input = self.capture.read()
+                    if self.vad.is_speech(audio_input):
                         end = time.time() + final_silence_time
                         self.record()
                     else:
-                        self.prev_input.append(audio_input)
-                        if len(self.prev_input) > self.max_chunks:
-                            self.prev_input = self.prev_input[1:]
+                        self.prev_input.write(audio_input)
                         current = time.time()
                 if self.string_to_send:
-                    self.stream.stop_stream()
+                    self.capture.stop()
                     self.string_to_send = self.string_to_send.strip()
                     print("*** Sending to client:", self.string_to_send)
                     # Useless to surround with a try - except because send does not care
@@ -155,7 +129,7 @@ class Recorder:
                         break
                     # Empty the string in case a thread has written something in the meanwhile
                     self.string_to_send = ""
-                    self.stream.start_stream()
+                    self.capture.start()
                     print("*** Listening ***")
 
 
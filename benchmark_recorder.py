@@ -0,0 +1,289 @@
+"""
+Authors:     Lucrezia Grassi (concept, design and code writing),
+             Carmine Tommaso Recchiuto (concept and design),
+             Antonio Sgorbissa (concept and design)
+Email:       lucrezia.grassi@edu.unige.it
+Affiliation: RICE, DIBRIS, University of Genoa, Italy
+
+This file contains a script that measures the performance of the Recorder without a microphone and without the APIs.
+Recorded WAV conversations are replayed through listen_continuous, listen_wait or listen_once:
+- the microphone is replaced by FileCapture, that delivers the chunks of the files at real or accelerated speed;
+- the segments are transcribed and identified by the scripted backends, with a configurable latency;
+- the client is replaced by a fake socket that answers as soon as it receives a turn.
+At the end the script reports the end of turn latency, the CPU time per second of audio, the dropped chunks, the API
+calls per turn and the peak memory, so that the results of two releases can be compared.
+
+Example:
+    python benchmark_recorder.py conversation.wav -m continuous -x 2 --stt-latency 0.4 -o results.json
+"""
+from speaker_backends import ScriptedSpeakerBackend
+from stt_backends import ScriptedSttBackend
+from profile_registry import ProfileRegistry
+from audio_capture import AudioCapture
+from resampler import Resampler
+from client_protocol import ack_message
+import Recorder as recorder
+import numpy as np
+import statistics
+import tracemalloc
+import threading
+import argparse
+import tempfile
+import audio_analysis
+import wave
+import json
+import time
+import os
+
+# Seconds of silence appended to the replayed audio, so that the last turn can end
+tail_silence_time = 2 * recorder.final_silence_time + 1
+
+
+# Raised by FileCapture when all the audio has been read, to stop the listening loop of the Recorder
+class ReplayFinished(Exception):
+    pass
+
+
+# Returns the audio of the WAV files as 16 bit mono PCM at the given rate
+def load_wavs(filenames, rate):
+    pcm = []
+    for filename in filenames:
+        with wave.open(filename, 'rb') as wf:
+            if wf.getsampwidth() != 2:
+                raise ValueError(filename + " is not a 16 bit WAV file")
+            data = np.frombuffer(wf.readframes(wf.getnframes()), dtype=np.int16)
+            # Only the first channel is kept
+            data = data[::wf.getnchannels()].tobytes()
+            if wf.getframerate() != rate:
+                data = Resampler(wf.getframerate(), rate).process(data)
+            pcm.append(data)
+    return b''.join(pcm)
+
+
+# Capture that delivers the audio of a file at real (or accelerated) speed instead of reading the microphone.
+# As with the microphone, the chunks are appended to the queue by another thread and nothing is delivered while the
+# capture is stopped (the replay is paused instead of losing the audio).
+class FileCapture(AudioCapture):
+    def __init__(self, pcm, rate, chunk, speed=1.0, rms_threshold=recorder.rms_threshold):
+        self.init_queue(rate, rate, chunk)
+        self.speed = speed
+        self.rms_threshold = rms_threshold
+        self.pcm = pcm + bytes(int(tail_silence_time * rate) * 2)
+        self.running = threading.Event()
+        self.exhausted = False
+        # Wall clock time at which the last chunk with speech has been read
+        self.last_voice_time = None
+        self.feeder = threading.Thread(target=self.feed, daemon=True)
+        self.feeder.start()
+
+    def feed(self):
+        chunk_bytes = self.chunk * 2
+        period = self.chunk / self.rate / self.speed
+        next_time = time.perf_counter()
+        for start in range(0, len(self.pcm), chunk_bytes):
+            if not self.running.is_set():
+                self.running.wait()
+                next_time = time.perf_counter()
+            data = self.pcm[start:start + chunk_bytes]
+            if len(data) < chunk_bytes:
+                data += bytes(chunk_bytes - len(data))
+            self.callback(data, self.chunk, None, 0)
+            next_time += period
+            delay = next_time - time.perf_counter()
+            if delay > 0:
+                time.sleep(delay)
+        self.exhausted = True
+        self.data_ready.set()
+
+    def read(self):
+        data = super().read()
+        if audio_analysis.rms(data) >= self.rms_threshold:
+            self.last_voice_time = time.time()
+        return data
+
+    # Once all the audio has been delivered, there is nothing to wait for
+    def wait_for_data(self):
+        if self.exhausted:
+            raise ReplayFinished()
+        self.data_ready.wait()
+
+    def start(self):
+        self.queue.clear()
+        self.running.set()
+
+    def stop(self):
+        self.running.clear()
+
+    def close(self):
+        self.running.clear()
+
+    # Seconds of audio delivered so far
+    def replayed_time(self):
+        return self.captured_chunks * self.chunk / self.rate
+
+
+# Client connected to the Recorder: it records the turns received and answers immediately
+class FakeConnection:
+    def __init__(self, benchmark, reply):
+        self.benchmark = benchmark
+        self.reply = reply
+
+    def send(self, data):
+        message = data.decode('utf-8')
+        if message != ack_message:
+            self.benchmark.add_turn(message)
+        return len(data)
+
+    def sendall(self, data):
+        self.send(data)
+
+    def recv(self, size):
+        return self.reply.encode('utf-8')[:size]
+
+
+# Server socket on which the Recorder waits for the client: the fake client connects only once
+class FakeServerSocket:
+    def __init__(self, connection):
+        self.connection = connection
+        self.accepted = False
+
+    def accept(self):
+        if self.accepted:
+            raise ReplayFinished()
+        self.accepted = True
+        return self.connection, ("benchmark", 0)
+
+
+class Benchmark:
+    def __init__(self, pcm, mode="continuous", speed=1.0, stt_latency=0.3, speaker_latency=0.3, transcripts=None,
+                 speaker_id_mode="segment", n_profiles=2, reply="ready", trace_memory=True, trace_file=None,
+                 voice_threshold=recorder.rms_threshold, endpointing=True):
+        self.mode = mode
+        self.speed = speed
+        self.trace_memory = trace_memory
+        self.turns = []
+        self.lock = threading.Lock()
+        self.capture = FileCapture(pcm, recorder.rate, recorder.chunk, speed, voice_threshold)
+        self.stt_backend = ScriptedSttBackend("en-GB", recorder.rate, recorder.channels, transcripts=transcripts,
+                                              latency=stt_latency)
+        self.speaker_backend = ScriptedSpeakerBackend(latency=speaker_latency)
+        self.recorder = recorder.Recorder("en-GB", speaker_id_mode=speaker_id_mode, stt_backend=self.stt_backend,
+                                          speaker_backend=self.speaker_backend, capture=self.capture,
+                                          trace_file=trace_file, endpointing=endpointing)
+        # The silences are measured in samples by the segmenter, only the timeout of the streaming recognizer is
+        # measured on the wall clock and must be shortened when the audio is replayed faster
+        self.recorder.streaming_timeout = recorder.streaming_timeout / speed
+        self.profiles_dir = tempfile.TemporaryDirectory()
+        self.recorder.profiles = ProfileRegistry(os.path.join(self.profiles_dir.name, "profiles.json"))
+        for i in range(n_profiles):
+            self.recorder.profiles.add("{:08d}-0000-0000-0000-000000000000".format(i + 1), "speaker{}".format(i + 1))
+        self.connection = FakeConnection(self, reply)
+        self.calls = (0, 0)
+
+    # Called when the Recorder sends a turn to the client
+    def add_turn(self, message):
+        now = time.time()
+        stt_calls = self.stt_backend.stats()["requests"]
+        speaker_calls = self.speaker_backend.requests
+        with self.lock:
+            latency = now - self.capture.last_voice_time if self.capture.last_voice_time else None
+            self.turns.append({"latency": latency, "final_silence": self.recorder.turn_final_silence,
+                               "stt_calls": stt_calls - self.calls[0],
+                               "speaker_calls": speaker_calls - self.calls[1], "text": message})
+            self.calls = (stt_calls, speaker_calls)
+
+    def run(self):
+        if self.trace_memory:
+            tracemalloc.start()
+        start_cpu = time.process_time()
+        start_time = time.time()
+        try:
+            if self.mode == "once":
+                while True:
+                    self.add_turn(self.recorder.listen_once())
+            elif self.mode == "wait":
+                self.recorder.listen_wait(FakeServerSocket(self.connection))
+            else:
+                self.recorder.listen_continuous(FakeServerSocket(self.connection))
+        except ReplayFinished:
+            pass
+        cpu_time = time.process_time() - start_cpu
+        wall_time = time.time() - start_time
+        peak_memory = tracemalloc.get_traced_memory()[1] if self.trace_memory else None
+        if self.trace_memory:
+            tracemalloc.stop()
+        self.recorder.transcription_pool.shutdown()
+        self.recorder.tracer.close()
+        self.profiles_dir.cleanup()
+        return self.report(cpu_time, wall_time, peak_memory)
+
+    def report(self, cpu_time, wall_time, peak_memory):
+        audio_time = self.capture.replayed_time()
+        latencies = [turn["latency"] for turn in self.turns if turn["latency"] is not None]
+        # Silence (in seconds of replayed audio) after the last voice before the turn was closed
+        silences = [recorder.split_silence_time + turn["final_silence"] for turn in self.turns
+                    if turn["latency"] is not None]
+        n_turns = len(self.turns)
+        capture_stats = self.capture.stats()
+        results = {"mode": self.mode, "speed": self.speed, "turns": n_turns, "audio_time": audio_time,
+                   "wall_time": wall_time, "cpu_per_audio_second": cpu_time / audio_time if audio_time else 0.0,
+                   "dropped_chunks": capture_stats["dropped"], "overflows": capture_stats["overflows"],
+                   "stt_calls_per_turn": self.stt_backend.stats()["requests"] / n_turns if n_turns else 0.0,
+                   "speaker_calls_per_turn": self.speaker_backend.requests / n_turns if n_turns else 0.0,
+                   "peak_memory_mb": peak_memory / 2 ** 20 if peak_memory is not None else None}
+        if latencies:
+            latencies.sort()
+            results.update({"mean_latency": statistics.mean(latencies), "median_latency": statistics.median(latencies),
+                            "p95_latency": latencies[min(int(0.95 * len(latencies)), len(latencies) - 1)],
+                            "max_latency": latencies[-1],
+                            "mean_final_silence": statistics.mean(silences) - recorder.split_silence_time,
+                            # Same measure as the FINAL DELAY printed by the Recorder: the time after the final
+                            # silence has elapsed
+                            "mean_final_delay": statistics.mean(latencies) - statistics.mean(silences) / self.speed})
+        results["turn_details"] = self.turns
+        return results
+
+
+if __name__ == '__main__':
+    # Define the program description
+    text = 'This is the script for benchmarking the recorder by replaying recorded conversations.'
+    # Initiate the parser with a description
+    parser = argparse.ArgumentParser(description=text)
+    parser.add_argument("wav_files", nargs="+", help="WAV files replayed in order as a single conversation")
+    parser.add_argument("--mode", "-m", choices=["continuous", "wait", "once"], default="continuous",
+                        help="listening mode of the recorder")
+    parser.add_argument("--speed", "-x", type=float, default=1.0, help="replay speed (1 is real time)")
+    parser.add_argument("--stt-latency", type=float, default=0.3, help="seconds taken by each transcription")
+    parser.add_argument("--speaker-latency", type=float, default=0.3, help="seconds taken by each identification")
+    parser.add_argument("--transcripts", "-t", help="text file with the transcripts returned in order, one per line")
+    parser.add_argument("--turn-speaker", action="store_true",
+                        help="identify the speaker once per turn instead of once per segment")
+    parser.add_argument("--profiles", "-p", type=int, default=2, help="number of enrolled profiles")
+    parser.add_argument("--reply", default="ready", help="message sent by the client after every turn")
+    parser.add_argument("--voice-threshold", type=float, default=recorder.rms_threshold,
+                        help="rms above which the audio is considered speech when measuring the end of turn latency "
+                             "(raise it for recordings with background noise)")
+    parser.add_argument("--fixed-silence", action="store_true",
+                        help="always end the turns after the final silence, without the end of turn detection")
+    parser.add_argument("--no-memory", action="store_true",
+                        help="do not trace the memory (tracing slows down the recorder and increases the CPU time)")
+    parser.add_argument("--output", "-o", help="JSON file in which the results are saved")
+    parser.add_argument("--trace", "-T", help="JSONL file in which the latency of each stage of the turns is traced")
+    args = parser.parse_args()
+
+    transcripts = None
+    if args.transcripts:
+        with open(args.transcripts, 'r', encoding='utf-8') as f:
+            transcripts = [line.strip() for line in f if line.strip()]
+    benchmark = Benchmark(load_wavs(args.wav_files, recorder.rate), mode=args.mode, speed=args.speed,
+                          stt_latency=args.stt_latency, speaker_latency=args.speaker_latency, transcripts=transcripts,
+                          speaker_id_mode="turn" if args.turn_speaker else "segment", n_profiles=args.profiles,
+                          reply=args.reply, trace_memory=not args.no_memory, trace_file=args.trace,
+                          voice_threshold=args.voice_threshold, endpointing=not args.fixed_silence)
+    results = benchmark.run()
+    for key, value in results.items():
+        if key != "turn_details":
+            print("#", key.upper().replace("_", " ") + ":", value)
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(results, f, indent=4)
@@ -0,0 +1,149 @@
+"""
+Authors:     Lucrezia Grassi (concept, design and code writing),
+             Carmine Tommaso Recchiuto (concept and design),
+             Antonio Sgorbissa (concept and design)
+Email:       lucrezia.grassi@edu.unige.it
+Affiliation: RICE, DIBRIS, University of Genoa, Italy
+
+This file contains the protocols spoken by the recorder with its client.
+The legacy protocol sends the ack and the XML of the dialogue turn as bare strings, so a long turn can be split or
+merged with the ack by the socket, and the client has nothing to read until the turn is complete.
+The framed protocol sends each message in a frame with a header containing the magic bytes, the version of the
+protocol, the type of the message and the length of its payload (a JSON object):
+    | "CR" (2 bytes) | version (1 byte) | type (1 byte) | payload length (4 bytes, big endian) | payload |
+Besides the ack and the final turn, the recorder pushes the partial hypotheses of the recognizer (interim, streaming
+mode only) and the sentence of each segment as soon as it is transcribed (piece), so that the client can start
+processing the text of the user before the turn ends. The final message contains the XML of the dialogue turn, as in
+the legacy protocol, which remains the reference for the order of the sentences and the speakers (in the pieces the
+speaker is unknown when it is identified once per turn).
+The client chooses the protocol with its first message: a frame selects the framed protocol, anything else the legacy
+one. The client sends a ready frame ({}) when it is ready to listen, and a bye frame before disconnecting.
+"""
+import collections
+import threading
+import struct
+import json
+
+magic = b"CR"
+protocol_version = 1
+header = struct.Struct("!2sBBI")
+max_payload_size = 1 << 20
+message_types = {"ready": 1, "bye": 2, "ack": 3, "interim": 4, "piece": 5, "final": 6}
+message_names = {code: name for name, code in message_types.items()}
+ack_message = "user finished talking"
+
+
+class ProtocolError(Exception):
+    pass
+
+
+# Returns the frame of a message of the given type with the given fields
+def encode_message(kind, **fields):
+    payload = json.dumps(fields).encode('utf-8')
+    return header.pack(magic, protocol_version, message_types[kind], len(payload)) + payload
+
+
+# Splits the data received from the socket in messages, keeping the incomplete frames until the rest arrives
+class FrameReader:
+    def __init__(self):
+        self.buffer = bytearray()
+
+    # Returns the list of (type, fields) of the messages completed by data
+    def feed(self, data):
+        self.buffer.extend(data)
+        messages = []
+        while len(self.buffer) >= header.size:
+            frame_magic, version, code, length = header.unpack_from(self.buffer)
+            if frame_magic != magic:
+                raise ProtocolError("Not a frame of the recorder protocol")
+            if version != protocol_version:
+                raise ProtocolError("Unsupported protocol version " + str(version))
+            if code not in message_names:
+                raise ProtocolError("Unknown message type " + str(code))
+            if length > max_payload_size:
+                raise ProtocolError("Message too long: " + str(length) + " bytes")
+            if len(self.buffer) < header.size + length:
+                break
+            payload = bytes(self.buffer[header.size:header.size + length])
+            del self.buffer[:header.size + length]
+            messages.append((message_names[code], json.loads(payload.decode('utf-8')) if payload else {}))
+        return messages
+
+
+class LegacyProtocol:
+    name = "legacy"
+
+    # send is the function sending bytes to the client (e.g. the sendall of the connection)
+    def __init__(self, send):
+        self.send = send
+        # Lock taken to send a message, as the pieces are sent by the transcription threads
+        self.lock = threading.Lock()
+        # Messages received from the client and not read yet ("" when the client disconnects)
+        self.pending = collections.deque()
+
+    # Returns the messages contained in the data received from the client
+    def parse(self, data):
+        return [data.decode('utf-8')]
+
+    def feed(self, data):
+        self.pending.extend(self.parse(data))
+
+    # Returns the next message of the client, reading it from the connection if needed ("" if it disconnects)
+    def receive(self, connection):
+        while not self.pending:
+            data = connection.recv(256)
+            if not data:
+                return ""
+            self.feed(data)
+        return self.pending.popleft()
+
+    def send_bytes(self, data):
+        with self.lock:
+            self.send(data)
+
+    def ack(self, turn):
+        self.send_bytes(ack_message.encode('utf-8'))
+
+    # The legacy client only receives the complete turn
+    def interim(self, turn, text):
+        pass
+
+    def piece(self, turn, segment, speaker, text, duration, offset=None):
+        pass
+
+    def final(self, turn, xml_string, text):
+        self.send_bytes(xml_string.encode('utf-8'))
+
+
+class FramedProtocol(LegacyProtocol):
+    name = "framed"
+
+    def __init__(self, send):
+        super().__init__(send)
+        self.reader = FrameReader()
+
+    # The bye message is returned as "", as if the client had disconnected
+    def parse(self, data):
+        return ["" if kind == "bye" else kind for kind, fields in self.reader.feed(data)]
+
+    def ack(self, turn):
+        self.send_bytes(encode_message("ack", turn=turn))
+
+    def interim(self, turn, text):
+        self.send_bytes(encode_message("interim", turn=turn, text=text))
+
+    # offset is the time of the segment (or of the sentence, in streaming mode) from the start of the turn
+    def piece(self, turn, segment, speaker, text, duration, offset=None):
+        self.send_bytes(encode_message("piece", turn=turn, segment=segment, speaker=speaker, text=text,
+                                       duration=duration, offset=offset))
+
+    def final(self, turn, xml_string, text):
+        self.send_bytes(encode_message("final", turn=turn, xml=xml_string, text=text))
+
+
+# Returns the protocol chosen by the client with the first data it has sent, which is read as its first message
+def open_protocol(data, send):
+    protocol = FramedProtocol(send) if data[:len(magic)] == magic else LegacyProtocol(send)
+    protocol.feed(data)
+    print("*** Client protocol:", protocol.name, "***")
+    return protocol
@@ -1,20 +1,24 @@
 import os
 import shutil
-import json
+import asyncio
 
-from speaker_recognition_util import delete_profile
+from speaker_recognition_async import SpeakerRecognitionClient
+from profile_registry import ProfileRegistry
 
-prof_dict = {}
-if os.path.isfile("profiles.json"):
-    with open('profiles.json', 'r', encoding='utf-8') as f:
-        prof_dict = json.load(f)
-else:
+
+async def delete_all(prof_ids):
+    async with SpeakerRecognitionClient() as client:
+        await asyncio.gather(*(client.delete_profile(prof_id) for prof_id in prof_ids))
+
+
+profiles = ProfileRegistry()
+prof_dict = profiles.get()
+if not prof_dict:
     print("There are no profiles to delete!")
     exit(0)
 
-# Delete profiles from Microsoft
-for prof_id in prof_dict.keys():
-    delete_profile(prof_id)
+# Delete profiles from Microsoft (concurrently)
+asyncio.run(delete_all(prof_dict.keys()))
 
 # Delete folders with audio recordings related to the profiles
 for elem in os.listdir():
@@ -22,5 +26,5 @@ for elem in os.listdir():
         shutil.rmtree(elem)
 
 # Remove the profiles file
-os.remove("profiles.json")
+profiles.clear()
 
@@ -0,0 +1,133 @@
+"""
+Authors:     Lucrezia Grassi (concept, design and code writing),
+             Carmine Tommaso Recchiuto (concept and design),
+             Antonio Sgorbissa (concept and design)
+Email:       lucrezia.grassi@edu.unige.it
+Affiliation: RICE, DIBRIS, University of Genoa, Italy
+
+This file contains the end of turn detector used by the Recorder to decide how much silence ends a turn.
+Instead of always waiting final_silence_time seconds after the last segment, the detector estimates how confident it
+is that the user has finished talking, and shortens the silence (down to min_final_silence_time) when it is confident
+or lengthens it (up to max_final_silence_time) when the user is probably pausing in the middle of a sentence.
+The confidence combines:
+- the prosody at the end of the last segment: the pitch and the energy fall at the end of a sentence, and the pitch
+  rises at the end of a yes/no question;
+- the transcripts of the turn received so far: a passphrase (exit_keywords) ends the turn, a question or a complete
+  sentence make the end more likely, a conjunction, an article or a preposition as last word make it unlikely.
+As the transcripts arrive while the silence is being counted, the silence needed is recomputed for every chunk.
+"""
+import audio_analysis
+import numpy as np
+
+# Bounds of the silence (in seconds) needed to end the turn after the last segment
+min_final_silence_time = 0.5
+max_final_silence_time = 3.5
+# Duration of the frames in which the pitch is estimated, and of the end of the segment compared with the rest
+prosody_frame_time = 0.04
+tail_time = 0.4
+# Only the frames at most this many dB below the loudest frame are considered speech
+prosody_dynamic_range = 25
+# Changes of pitch (in semitones) and fall of energy (in dB) at the end of the segment that are considered cues
+min_pitch_fall = 2.0
+min_pitch_rise = 2.0
+min_energy_fall = 6.0
+# Number of words of a turn that looks like a complete sentence
+min_sentence_words = 3
+# Weights of the cues in the confidence, between -1 (surely not finished) and 1 (surely finished)
+pitch_fall_weight = 0.3
+pitch_rise_weight = 0.2
+energy_fall_weight = 0.2
+question_weight = 0.4
+sentence_weight = 0.2
+continuation_weight = -0.6
+# Words that start a question, and words after which a sentence is not finished, for each language
+question_words = {
+    "en": {"what", "where", "when", "who", "whom", "whose", "which", "why", "how", "do", "does", "did", "is", "are",
+           "was", "were", "can", "could", "will", "would", "shall", "should", "may", "have", "has"},
+    "it": {"cosa", "che", "chi", "come", "dove", "quando", "quanto", "quanti", "quanta", "quante", "quale", "quali",
+           "perché", "perchè", "perche"},
+}
+continuation_words = {
+    "en": {"and", "or", "but", "so", "because", "if", "that", "then", "the", "a", "an", "to", "of", "in", "on", "at",
+           "for", "with", "my", "your", "is", "are", "i", "um", "uh", "er", "like"},
+    "it": {"e", "o", "ma", "però", "perché", "perchè", "che", "se", "quindi", "il", "lo", "la", "i", "gli", "le",
+           "un", "uno", "una", "di", "a", "da", "in", "con", "su", "per", "tra", "fra", "mio", "mia", "tuo", "tua",
+           "ehm", "cioè"},
+}
+
+
+class Endpointer:
+    # final_silence_time is the silence waited when there are no cues, exit_keywords the phrases that end the turn
+    def __init__(self, lang, rate, final_silence_time, exit_keywords=(), min_final_silence=min_final_silence_time,
+                 max_final_silence=max_final_silence_time):
+        language = lang.split("-")[0]
+        self.question_words = question_words.get(language, set())
+        self.continuation_words = continuation_words.get(language, set())
+        self.exit_keywords = list(exit_keywords)
+        self.rate = rate
+        self.frame_size = int(prosody_frame_time * rate)
+        self.final_silence_time = final_silence_time
+        self.min_final_silence = min(min_final_silence, final_silence_time)
+        self.max_final_silence = max(max_final_silence, final_silence_time)
+        self.new_turn()
+
+    # Forgets the cues of the previous turn
+    def new_turn(self):
+        self.pitch_change = 0.0
+        self.energy_fall = 0.0
+
+    # Measures the prosody at the end of the last segment of the turn
+    def end_segment(self, pcm):
+        self.pitch_change, self.energy_fall = self.prosody(pcm)
+
+    # Returns the change of pitch (in semitones, negative if it falls) and the fall of energy (in dB) of the last
+    # tail_time seconds of speech of the segment with respect to the rest of it
+    def prosody(self, pcm):
+        frames = audio_analysis.frames(pcm, self.frame_size)
+        if len(frames) == 0:
+            return 0.0, 0.0
+        level = audio_analysis.dbfs(frames)
+        speech = np.flatnonzero(level >= level.max() - prosody_dynamic_range)
+        tail_frames = max(int(tail_time / prosody_frame_time), 1)
+        if len(speech) <= tail_frames:
+            return 0.0, 0.0
+        # The trailing silence of the segment is not part of the tail
+        body, tail = speech[:-tail_frames], speech[-tail_frames:]
+        energy_fall = float(np.median(level[body]) - np.mean(level[tail]))
+        pitch = audio_analysis.pitch(frames[speech], self.rate)
+        body_pitch, tail_pitch = pitch[:-tail_frames], pitch[-tail_frames:]
+        body_pitch, tail_pitch = body_pitch[body_pitch > 0], tail_pitch[tail_pitch > 0]
+        if len(body_pitch) == 0 or len(tail_pitch) == 0:
+            return 0.0, energy_fall
+        pitch_change = float(12 * np.log2(np.median(tail_pitch) / np.median(body_pitch)))
+        return pitch_change, energy_fall
+
+    # Returns the confidence (between -1 and 1) that the user has finished talking, given the text of the turn
+    def confidence(self, text):
+        words = text.split()
+        if any(keyword in text for keyword in self.exit_keywords):
+            return 1.0
+        value = 0.0
+        if self.pitch_change <= -min_pitch_fall:
+            value += pitch_fall_weight
+        elif self.pitch_change >= min_pitch_rise:
+            value += pitch_rise_weight
+        if self.energy_fall >= min_energy_fall:
+            value += energy_fall_weight
+        if not words:
+            # The transcript usually arrives within a second: until then the prosody alone shortens the silence less
+            return value / 2
+        if words[-1] in self.continuation_words:
+            value += continuation_weight
+        elif words[0] in self.question_words:
+            value += question_weight
+        elif len(words) >= min_sentence_words:
+            value += sentence_weight
+        return max(min(value, 1.0), -1.0)
+
+    # Returns the seconds of silence after the last segment needed to end the turn
+    def final_silence(self, text):
+        confidence = self.confidence(text)
+        if confidence >= 0:
+            return self.final_silence_time - confidence * (self.final_silence_time - self.min_final_silence)
+        return self.final_silence_time - confidence * (self.max_final_silence - self.final_silence_time)
@@ -0,0 +1,121 @@
+"""
+Authors:     Lucrezia Grassi (concept, design and code writing),
+             Carmine Tommaso Recchiuto (concept and design),
+             Antonio Sgorbissa (concept and design)
+Email:       lucrezia.grassi@edu.unige.it
+Affiliation: RICE, DIBRIS, University of Genoa, Italy
+
+This file contains the tracer that records when each stage of a turn happens, to find out where the time goes between
+the end of the speech and the answer sent to the client.
+Every event is a JSON line with the time, the stage, and the turn and/or the segment it refers to (the segment ids are
+unique, and the noise_onset event of a segment also contains its turn). The events are put in a queue and written by a
+background thread, so the recorder never waits for the disk; if the queue is full the events are dropped and counted.
+Running this file summarizes a trace:
+    python latency_tracer.py trace.jsonl
+"""
+import statistics
+import threading
+import argparse
+import queue
+import json
+import time
+
+max_queued_events = 10000
+# Events written together by the background thread before flushing the file
+max_batch_size = 256
+# Durations reported by the summary: name -> (level, start stage, end stage)
+intervals = {
+    "segment capture": ("segment", "noise_onset", "segment_end"),
+    "segment queued": ("segment", "buffer_ready", "stt_start"),
+    "speech to text": ("segment", "stt_start", "stt_end"),
+    "speaker identification": ("segment", "speaker_id_start", "speaker_id_end"),
+    "turn speaker identification": ("turn", "speaker_id_start", "speaker_id_end"),
+    "final silence to join": ("turn", "final_silence", "join_complete"),
+    "join to xml sent": ("turn", "join_complete", "xml_sent"),
+    "final silence to xml sent": ("turn", "final_silence", "xml_sent"),
+    "client answer": ("turn", "xml_sent", "client_ready"),
+}
+
+
+class LatencyTracer:
+    # If filename is None the tracer is disabled and the events are ignored
+    def __init__(self, filename=None, max_queued=max_queued_events):
+        self.filename = filename
+        self.enabled = filename is not None
+        self.dropped_events = 0
+        self.queue = queue.Queue(maxsize=max_queued)
+        self.writer = None
+        if self.enabled:
+            self.writer = threading.Thread(target=self.write_events, daemon=True)
+            self.writer.start()
+
+    # Records that a stage has been reached now; fields are added to the record
+    def event(self, stage, turn=None, segment=None, **fields):
+        if not self.enabled:
+            return
+        record = {"time": time.time(), "stage": stage}
+        if turn is not None:
+            record["turn"] = turn
+        if segment is not None:
+            record["segment"] = segment
+        record.update(fields)
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped_events += 1
+
+    def write_events(self):
+        with open(self.filename, 'a', encoding='utf-8') as f:
+            while True:
+                batch = [self.queue.get()]
+                while len(batch) < max_batch_size:
+                    try:
+                        batch.append(self.queue.get_nowait())
+                    except queue.Empty:
+                        break
+                closing = None in batch
+                f.writelines(json.dumps(record) + "\n" for record in batch if record is not None)
+                f.flush()
+                if closing:
+                    return
+
+    # Writes the events still in the queue and stops the background thread
+    def close(self):
+        if self.writer is not None:
+            self.enabled = False
+            self.queue.put(None)
+            self.writer.join()
+            self.writer = None
+
+
+# Returns the statistics of the durations between the stages of the turns and segments of a trace
+def summarize(filename):
+    stages = {"turn": {}, "segment": {}}
+    with open(filename, 'r', encoding='utf-8') as f:
+        for line in f:
+            record = json.loads(line)
+            level = "segment" if "segment" in record else "turn"
+            # The first time a stage is reached is kept (e.g. the first ack of the turn)
+            stages[level].setdefault(record[level], {}).setdefault(record["stage"], record["time"])
+    summary = {}
+    for name, (level, start, end) in intervals.items():
+        durations = sorted(times[end] - times[start] for times in stages[level].values()
+                           if start in times and end in times)
+        if durations:
+            summary[name] = {"count": len(durations), "mean": statistics.mean(durations),
+                             "median": statistics.median(durations),
+                             "p95": durations[min(int(0.95 * len(durations)), len(durations) - 1)],
+                             "max": durations[-1]}
+    return summary
+
+
+if __name__ == '__main__':
+    # Define the program description
+    text = 'This is the script for summarizing the latency traces of the recorder.'
+    # Initiate the parser with a description
+    parser = argparse.ArgumentParser(description=text)
+    parser.add_argument("trace", help="JSONL file written by the recorder")
+    args = parser.parse_args()
+    for name, stats in summarize(args.trace).items():
+        print("# {}: count {count}, mean {mean:.3f} s, median {median:.3f} s, p95 {p95:.3f} s, max {max:.3f} s"
+              .format(name.upper(), **stats))
@@ -0,0 +1,189 @@
+"""
+Authors:     Lucrezia Grassi (concept, design and code writing),
+             Carmine Tommaso Recchiuto (concept and design),
+             Antonio Sgorbissa (concept and design)
+Email:       lucrezia.grassi@edu.unige.it
+Affiliation: RICE, DIBRIS, University of Genoa, Italy
+
+This file contains the metrics published by the services, in the Prometheus text format.
+The modules declare their counters, gauges and histograms in the shared registry when they are imported, and a service
+calls start_metrics_server to publish them on http://<host>:<port>/metrics from a background thread.
+A counter or a gauge can also be read from a function when it is scraped (e.g. the chunks captured by AudioCapture),
+so that the values already counted elsewhere are not counted twice.
+The same metric can be declared with different labels (e.g. one session of the recorder server each): every set of
+labels is a separate series, published under the same name.
+"""
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import threading
+import math
+
+latency_buckets = (0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+
+# Returns the labels in the Prometheus format, e.g. {session="robot1"}, or "" if there are none
+def format_labels(labels):
+    if not labels:
+        return ""
+    return "{" + ",".join(key + '="' + str(value).replace('\\', '\\\\').replace('"', '\\"') + '"'
+                          for key, value in sorted(labels.items())) + "}"
+
+
+def format_value(value):
+    if value == math.inf:
+        return "+Inf"
+    return repr(float(value))
+
+
+class Counter:
+    type = "counter"
+
+    def __init__(self, name, help_text, fn=None, labels=None):
+        self.name = name
+        self.help_text = help_text
+        self.fn = fn
+        self.labels = format_labels(labels)
+        self.lock = threading.Lock()
+        self.value = 0
+
+    def inc(self, amount=1):
+        with self.lock:
+            self.value += amount
+
+    def get(self):
+        if self.fn is not None:
+            return self.fn()
+        with self.lock:
+            return self.value
+
+    def samples(self):
+        return [(self.name + self.labels, self.get())]
+
+
+class Gauge(Counter):
+    type = "gauge"
+
+    def set(self, value):
+        with self.lock:
+            self.value = value
+
+    def dec(self, amount=1):
+        self.inc(-amount)
+
+
+class Histogram:
+    type = "histogram"
+
+    def __init__(self, name, help_text, buckets=latency_buckets, labels=None):
+        self.name = name
+        self.help_text = help_text
+        self.label_values = dict(labels or {})
+        self.labels = format_labels(labels)
+        self.buckets = tuple(buckets) + (math.inf,)
+        self.lock = threading.Lock()
+        self.counts = [0] * len(self.buckets)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        with self.lock:
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    self.counts[i] += 1
+                    break
+            self.sum += value
+            self.count += 1
+
+    def samples(self):
+        with self.lock:
+            counts, total, count = list(self.counts), self.sum, self.count
+        samples = []
+        cumulative = 0
+        for bound, n in zip(self.buckets, counts):
+            cumulative += n
+            labels = format_labels(dict(self.label_values, le=format_value(bound)))
+            samples.append((self.name + "_bucket" + labels, cumulative))
+        samples.append((self.name + "_sum" + self.labels, total))
+        samples.append((self.name + "_count" + self.labels, count))
+        return samples
+
+
+class MetricsRegistry:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.metrics = {}
+
+    # Returns the metric with the given name and labels, creating it if needed. If fn is given, the value is read from
+    # it (the function of a metric declared again with the same labels, e.g. by a new Recorder, replaces the previous
+    # one)
+    def get_or_create(self, cls, name, help_text, **kwargs):
+        fn = kwargs.pop("fn", None)
+        key = name + format_labels(kwargs.get("labels"))
+        with self.lock:
+            metric = self.metrics.get(key)
+            if metric is None:
+                metric = cls(name, help_text, **kwargs)
+                self.metrics[key] = metric
+            if fn is not None:
+                metric.fn = fn
+            return metric
+
+    def counter(self, name, help_text, fn=None, labels=None):
+        return self.get_or_create(Counter, name, help_text, fn=fn, labels=labels)
+
+    def gauge(self, name, help_text, fn=None, labels=None):
+        return self.get_or_create(Gauge, name, help_text, fn=fn, labels=labels)
+
+    def histogram(self, name, help_text, buckets=latency_buckets, labels=None):
+        return self.get_or_create(Histogram, name, help_text, buckets=buckets, labels=labels)
+
+    # Returns the metrics in the Prometheus text exposition format
+    def render(self):
+        with self.lock:
+            metrics = list(self.metrics.values())
+        lines = []
+        described = set()
+        # The series of the same metric are published together, after a single description
+        metrics.sort(key=lambda metric: metric.name)
+        for metric in metrics:
+            try:
+                samples = metric.samples()
+            except Exception as e:
+                # A metric that cannot be read must not prevent the others from being published
+                print("Not able to read metric", metric.name, "-", e)
+                continue
+            if metric.name not in described:
+                described.add(metric.name)
+                lines.append("# HELP " + metric.name + " " + metric.help_text)
+                lines.append("# TYPE " + metric.name + " " + metric.type)
+            lines.extend(name + " " + format_value(value) for name, value in samples)
+        return "\n".join(lines) + "\n"
+
+
+# Registry shared by all the modules of a service
+registry = MetricsRegistry()
+
+
+class MetricsHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path.split("?")[0] != "/metrics":
+            self.send_error(404)
+            return
+        body = self.server.registry.render().encode('utf-8')
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+# Publishes the metrics of the registry on the given port, from a background thread
+def start_metrics_server(port, registry=registry):
+    server = ThreadingHTTPServer(("0.0.0.0", port), MetricsHandler)
+    server.daemon_threads = True
+    server.registry = registry
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    print("*** Metrics published on port", port, "***")
+    return server
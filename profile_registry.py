@@ -0,0 +1,108 @@
+"""
+Authors:     Lucrezia Grassi (concept, design and code writing),
+             Carmine Tommaso Recchiuto (concept and design),
+             Antonio Sgorbissa (concept and design)
+Email:       lucrezia.grassi@edu.unige.it
+Affiliation: RICE, DIBRIS, University of Genoa, Italy
+
+This file contains the registry of the enrolled profiles, shared by the recorder and the registration services.
+The profiles (profile id -> user name) are kept in memory and the profiles.json file is parsed again only when its
+inode, modification time or size change, so the file is not read for every segment.
+The file is written to a temporary file that is then renamed, so a reader never sees a partially written file (the
+rename also changes the inode, so the other processes always notice the new file).
+"""
+import tempfile
+import stat
+import threading
+import json
+import os
+
+profiles_filename = "profiles.json"
+# Permissions of a new profiles file (the umask is not read, as it can only be read by changing it for every thread)
+new_file_mode = 0o644
+
+
+class ProfileRegistry:
+    def __init__(self, filename=profiles_filename):
+        self.filename = filename
+        self.lock = threading.Lock()
+        self.profiles = {}
+        # Inode, modification time and size of the file when it was last loaded (None if the file does not exist)
+        self.signature = None
+        self.loaded = False
+
+    def file_signature(self):
+        try:
+            st = os.stat(self.filename)
+        except FileNotFoundError:
+            return None
+        return st.st_ino, st.st_mtime_ns, st.st_size
+
+    def reload_if_changed(self):
+        signature = self.file_signature()
+        if self.loaded and signature == self.signature:
+            return
+        if signature is None:
+            self.profiles = {}
+        else:
+            try:
+                with open(self.filename, 'r', encoding='utf-8') as f:
+                    self.profiles = json.load(f)
+            except (OSError, ValueError) as e:
+                # Keep the profiles loaded before, the file will be read again at the next call
+                print("Not able to load", self.filename, "-", e)
+                return
+        self.signature = signature
+        self.loaded = True
+
+    # Returns a copy of the profiles dictionary, reloading the file only if it has changed
+    def get(self):
+        with self.lock:
+            self.reload_if_changed()
+            return dict(self.profiles)
+
+    # Permissions of the profiles file: those of the existing file, or the default ones for a new file
+    def file_mode(self):
+        try:
+            return stat.S_IMODE(os.stat(self.filename).st_mode)
+        except FileNotFoundError:
+            return new_file_mode
+
+    def save(self):
+        directory = os.path.dirname(os.path.abspath(self.filename))
+        fd, tmp_filename = tempfile.mkstemp(dir=directory, prefix=".profiles-", suffix=".json")
+        try:
+            with os.fdopen(fd, 'w', encoding='utf-8') as f:
+                json.dump(self.profiles, f, ensure_ascii=False, indent=4)
+                f.flush()
+                os.fsync(f.fileno())
+            # mkstemp creates the file readable only by its owner
+            os.chmod(tmp_filename, self.file_mode())
+            os.replace(tmp_filename, self.filename)
+        except BaseException:
+            if os.path.exists(tmp_filename):
+                os.remove(tmp_filename)
+            raise
+        self.signature = self.file_signature()
+
+    def add(self, profile_id, name):
+        with self.lock:
+            self.reload_if_changed()
+            self.profiles[profile_id] = name
+            self.save()
+
+    def remove(self, profile_id):
+        with self.lock:
+            self.reload_if_changed()
+            if profile_id in self.profiles:
+                del self.profiles[profile_id]
+                self.save()
+
+    # Deletes the file and all the profiles
+    def clear(self):
+        with self.lock:
+            if os.path.isfile(self.filename):
+                os.remove(self.filename)
+            self.profiles = {}
+            self.signature = None
+            self.loaded = True
@@ -0,0 +1,117 @@
+"""
+Authors:     Lucrezia Grassi (concept, design and code writing),
+             Carmine Tommaso Recchiuto (concept and design),
+             Antonio Sgorbissa (concept and design)
+Email:       lucrezia.grassi@edu.unige.it
+Affiliation: RICE, DIBRIS, University of Genoa, Italy
+
+This file contains the pool of Azure speech recognizers used by the Recorder.
+Each recognizer reads from its own push stream and its connection to the service is opened in advance, so that the
+TLS/websocket handshake is not paid when a segment has to be transcribed.
+A recognizer transcribes a single segment: once it has been used, a new one is connected in the background.
+"""
+import azure.cognitiveservices.speech as speechsdk
+import collections
+import threading
+import time
+
+
+class RecognizerPool:
+    # size is the number of connected recognizers kept ready, max_idle_time the number of seconds after which an
+    # unused connection is considered closed by the service and is replaced
+    def __init__(self, speech_config, rate, channels=1, size=2, max_idle_time=180):
+        self.speech_config = speech_config
+        self.rate = rate
+        self.channels = channels
+        self.size = size
+        self.max_idle_time = max_idle_time
+        self.entries = collections.deque()
+        self.lock = threading.Lock()
+        # Number of recognizers that are being connected in the background
+        self.connecting = 0
+        # Statistics about the handshakes (running totals, as the pool lives as long as the service)
+        self.handshakes = 0
+        self.handshake_time = 0.0
+        self.warm_hits = 0
+        self.cold_misses = 0
+        self.saved_time = 0.0
+
+    def create_entry(self):
+        stream_format = speechsdk.audio.AudioStreamFormat(samples_per_second=self.rate, bits_per_sample=16,
+                                                          channels=self.channels)
+        push_stream = speechsdk.audio.PushAudioInputStream(stream_format=stream_format)
+        audio_input = speechsdk.audio.AudioConfig(stream=push_stream)
+        recognizer = speechsdk.SpeechRecognizer(speech_config=self.speech_config, audio_config=audio_input)
+        connection = speechsdk.Connection.from_recognizer(recognizer)
+        entry = {"recognizer": recognizer, "push_stream": push_stream, "connection": connection,
+                 "connected": threading.Event(), "handshake": None, "opened": time.time()}
+
+        def on_connected(evt):
+            entry["handshake"] = time.time() - entry["opened"]
+            with self.lock:
+                self.handshakes += 1
+                self.handshake_time += entry["handshake"]
+            entry["connected"].set()
+
+        def on_disconnected(evt):
+            entry["connected"].clear()
+
+        connection.connected.connect(on_connected)
+        connection.disconnected.connect(on_disconnected)
+        connection.open(False)
+        return entry
+
+    # Connects new recognizers until the pool is full (called when the client is ready and after every segment)
+    def warm_up(self):
+        with self.lock:
+            missing = self.size - len(self.entries) - self.connecting
+            self.connecting += max(missing, 0)
+        for i in range(missing):
+            threading.Thread(target=self.add_entry, daemon=True).start()
+
+    def add_entry(self):
+        try:
+            entry = self.create_entry()
+            # Wait for the handshake here, so that it is never paid by the thread transcribing a segment
+            entry["connected"].wait(timeout=10)
+            with self.lock:
+                self.entries.append(entry)
+        finally:
+            with self.lock:
+                self.connecting -= 1
+
+    # Returns a connected recognizer if available, otherwise a new one that will connect on first use
+    def acquire(self):
+        with self.lock:
+            while self.entries:
+                entry = self.entries.popleft()
+                if entry["connected"].is_set() and time.time() - entry["opened"] < self.max_idle_time:
+                    self.warm_hits += 1
+                    self.saved_time += entry["handshake"]
+                    return entry
+                entry["connection"].close()
+            self.cold_misses += 1
+        return self.create_entry()
+
+    # Transcribes a single segment of PCM data and returns the result of the recognition
+    def recognize(self, recording):
+        entry = self.acquire()
+        try:
+            entry["push_stream"].write(recording)
+            entry["push_stream"].close()
+            return entry["recognizer"].recognize_once_async().get()
+        finally:
+            # The recognizer is never reused, even if the recognition failed, and the pool is refilled
+            entry["connection"].close()
+            self.warm_up()
+
+    def stats(self):
+        with self.lock:
+            mean_handshake = self.handshake_time / self.handshakes if self.handshakes else 0.0
+            return {"warm_hits": self.warm_hits, "cold_misses": self.cold_misses, "ready": len(self.entries),
+                    "mean_handshake": mean_handshake, "saved_time": self.saved_time}
+
+    def close(self):
+        with self.lock:
+            while self.entries:
+                self.entries.popleft()["connection"].close()
@@ -0,0 +1,238 @@
+"""
+Authors:     Lucrezia Grassi (concept, design and code writing),
+             Carmine Tommaso Recchiuto (concept and design),
+             Antonio Sgorbissa (concept and design)
+Email:       lucrezia.grassi@edu.unige.it
+Affiliation: RICE, DIBRIS, University of Genoa, Italy
+
+This file contains a server that runs several independent recorder sessions in the same process, so that one machine
+can serve several robots in the same room.
+Each session has its own microphone, its own port, its own Recorder (voice activity detector, dialogue turn, ...) and
+its own pool of transcription workers, while the speech to text and the speaker identification backends (and their
+pools of connections) are shared by all the sessions.
+A single thread waits on all the sockets with a selector: it accepts the clients and reads their messages, and passes
+them to the thread of the session, which listens to its microphone and sends the dialogue turns to its client.
+Each session speaks the same protocol as audio_recorder_multiparty.py, e.g. two robots on ports 9090 and 9091:
+    python recorder_server.py -S robot1:9090:USB -S robot2:9091:2
+"""
+from Recorder import Recorder, audio_format, channels, rate, chunk
+from transcription_pool import TranscriptionPool, max_transcription_workers
+from speaker_backends import get_backend
+from stt_backends import get_stt_backend
+from metrics import start_metrics_server
+from audio_capture import AudioCapture
+from client_protocol import open_protocol, ProtocolError
+import functools
+import selectors
+import threading
+import argparse
+import pyaudio
+import socket
+import queue
+import os
+
+default_port = 9090
+# Seconds after which a message that cannot be sent to a client is dropped
+send_timeout = 10
+
+
+# Returns the index of the input device given by index or by (part of its) name, or None for the default device
+def find_device(p, device):
+    if device is None or device == "":
+        return None
+    if device.isdigit():
+        return int(device)
+    for i in range(p.get_device_count()):
+        info = p.get_device_info_by_index(i)
+        if info.get('maxInputChannels') > 0 and device in info.get('name'):
+            return i
+    raise ValueError("No input device matching " + device)
+
+
+class Session:
+    # recorder listens to the microphone of the session, port is the port its client connects to
+    def __init__(self, name, port, recorder):
+        self.name = name
+        self.port = port
+        self.recorder = recorder
+        self.connection = None
+        # Protocol chosen by the client with its first message
+        self.protocol = None
+        self.lock = threading.Lock()
+        # Messages received from the client ("" when it disconnects), read by the thread of the session
+        self.messages = queue.Queue()
+        self.thread = threading.Thread(target=self.run, name=name, daemon=True)
+
+    # Called by the selector thread with the data received from the client
+    def feed(self, data):
+        with self.lock:
+            if self.protocol is None:
+                self.protocol = open_protocol(data, functools.partial(self.send, self.connection))
+            else:
+                self.protocol.feed(data)
+            protocol = self.protocol
+        while protocol.pending:
+            self.messages.put(protocol.pending.popleft())
+
+    # Called by the selector thread when a client connects: only one client per session is accepted
+    def connect(self, connection):
+        with self.lock:
+            if self.connection is not None:
+                return False
+            self.connection = connection
+        return True
+
+    # The turn being recorded for the client is abandoned
+    def disconnect(self):
+        with self.lock:
+            self.connection = None
+            self.protocol = None
+        self.recorder.abort_turn()
+        self.messages.put("")
+
+    # Sends data to the client of the connection, if it is still connected
+    def send(self, connection, data):
+        with self.lock:
+            connected = connection is not None and connection is self.connection
+        if not connected:
+            print("*** [" + self.name + "] Client disconnected: message dropped ***")
+            return
+        try:
+            connection.sendall(data)
+        except OSError as e:
+            print("*** [" + self.name + "] Not able to send to the client:", e, "***")
+
+    def run(self):
+        while True:
+            print("*** [" + self.name + "] Waiting for client to be ready on port", self.port, "***")
+            if self.messages.get() == "":
+                continue
+            with self.lock:
+                protocol = self.protocol
+            if protocol is None:
+                # The client has already disconnected
+                continue
+            self.recorder.prepare_listening()
+            while True:
+                self.recorder.converse_turn(protocol)
+                if not self.recorder.resume_listening(self.messages.get()):
+                    break
+
+
+class RecorderServer:
+    def __init__(self, sessions):
+        self.sessions = sessions
+        self.selector = selectors.DefaultSelector()
+        for session in sessions:
+            server_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+            server_socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+            server_socket.bind(("0.0.0.0", session.port))
+            server_socket.listen(1)
+            server_socket.setblocking(False)
+            self.selector.register(server_socket, selectors.EVENT_READ, (self.accept, session))
+
+    def accept(self, server_socket, session):
+        connection, address = server_socket.accept()
+        if not session.connect(connection):
+            print("*** [" + session.name + "] A client is already connected: connection from", address, "refused ***")
+            connection.close()
+            return
+        print("*** [" + session.name + "] Client connected from", address, "***")
+        # The selector tells when the messages can be read, while the session thread sends with a timeout
+        connection.settimeout(send_timeout)
+        self.selector.register(connection, selectors.EVENT_READ, (self.receive, session))
+
+    def receive(self, connection, session):
+        try:
+            data = connection.recv(256)
+        except (BlockingIOError, InterruptedError, socket.timeout):
+            return
+        except OSError:
+            data = b''
+        if data:
+            try:
+                session.feed(data)
+                return
+            except (ProtocolError, ValueError) as e:
+                print("*** [" + session.name + "] Invalid message from the client:", e, "***")
+        self.selector.unregister(connection)
+        connection.close()
+        session.disconnect()
+
+    def serve_forever(self):
+        for session in self.sessions:
+            session.thread.start()
+        print("*** Serving", len(self.sessions), "sessions ***")
+        while True:
+            for key, mask in self.selector.select():
+                callback, session = key.data
+                callback(key.fileobj, session)
+
+
+if __name__ == '__main__':
+    # Define the program description
+    text = 'This is the service for recording several robots, each with its own microphone and client.'
+    # Initiate the parser with a description
+    parser = argparse.ArgumentParser(description=text)
+    # Add long and short argument
+    parser.add_argument("--session", "-S", action="append", default=[],
+                        help="session given as name:port[:device], where device is the index or part of the name of "
+                             "the microphone (the default microphone if omitted); repeat for each robot")
+    parser.add_argument("--language", "-l", help="set the language of the audio recorder to en or it")
+    parser.add_argument("--archive", "-a", help="folder in which a copy of each recorded segment is saved as WAV "
+                                                "(in a subfolder for each session)")
+    parser.add_argument("--trace", "-T", help="JSONL file in which the latency of each stage of the turns is traced "
+                                              "(the name of the session is appended to the name of the file)")
+    parser.add_argument("--metrics-port", "-M", type=int, help="port on which the metrics are published over HTTP")
+    parser.add_argument("--workers", "-w", type=int, default=max_transcription_workers,
+                        help="transcription workers of each session")
+    parser.add_argument("--streaming", "-s", action="store_true",
+                        help="send the audio to the recognizer while the user is talking")
+    parser.add_argument("--turn-speaker", "-t", action="store_true",
+                        help="identify the speaker once per turn instead of once per segment")
+    parser.add_argument("--speaker-backend", "-b", choices=["azure", "local"], default="azure",
+                        help="identify the speakers with Microsoft APIs (azure) or offline (local)")
+    parser.add_argument("--stt-backend", "-r", choices=["azure", "google", "local"], default="azure",
+                        help="transcribe the segments with Microsoft APIs (azure), Google APIs (google) or with "
+                             "scripted transcripts (local)")
+    # Read arguments from the command line
+    args = parser.parse_args()
+    if args.language == "it":
+        language = "it-IT"
+    elif args.language == "cn":
+        language = "zh-CN"
+    else:
+        language = "en-GB"
+    print("The language of the audio recorder has been set to", language)
+
+    if args.metrics_port:
+        start_metrics_server(args.metrics_port)
+
+    specs = [spec.split(":", 2) for spec in args.session or ["robot:" + str(default_port)]]
+    # The backends, and their pools of connections, are shared by all the sessions
+    speaker_backend = get_backend(args.speaker_backend)
+    # Keep connected as many Azure recognizers as one recorder alone would, for each session
+    stt_kwargs = {"pool_size": 2 * len(specs)} if args.stt_backend == "azure" else {}
+    stt_backend = get_stt_backend(args.stt_backend, language, rate, channels, **stt_kwargs)
+    p = pyaudio.PyAudio()
+    sessions = []
+    for fields in specs:
+        name, port = fields[0], int(fields[1])
+        device = find_device(p, fields[2] if len(fields) > 2 else None)
+        print("Session", name, "on port", port, "with", "device " + str(device) if device is not None else
+              "the default microphone")
+        archive_dir = None
+        if args.archive:
+            archive_dir = os.path.join(args.archive, name)
+            os.makedirs(archive_dir, exist_ok=True)
+        trace_file = None
+        if args.trace:
+            root, ext = os.path.splitext(args.trace)
+            trace_file = root + "-" + name + ext
+        recorder = Recorder(language, archive_dir=archive_dir, streaming=args.streaming,
+                            speaker_id_mode="turn" if args.turn_speaker else "segment",
+                            speaker_backend=speaker_backend, stt_backend=stt_backend,
+                            capture=AudioCapture(p, audio_format, channels, rate, chunk, device),
+                            trace_file=trace_file, transcription_pool=TranscriptionPool(args.workers), session=name)
+        sessions.append(Session(name, port, recorder))
+    RecorderServer(sessions).serve_forever()
@@ -8,19 +8,20 @@ Affiliation: RICE, DIBRIS, University of Genoa, Italy
 This file contains the methods used to register a new user
 """
 from speaker_recognition_util import *
+from profile_registry import ProfileRegistry
+from speaker_backends import get_backend
 import azure.cognitiveservices.speech as speechsdk
 import socket
 import time
 import os
-import json
 import argparse
 
 
 # This method creates a new profile by calling Microsoft APIs, sends it through the socket to the client and returns
 # the corresponding id
-def new_profile_creation(socket_connection):
+def new_profile_creation(socket_connection, backend):
     socket_connection.recv(256).decode('utf-8')
-    prof_id = create_profile()
+    prof_id = backend.create_profile()
     # Create a new folder in which the wav file for the profile enrollment will be saved
     try:
         os.mkdir(prof_id)
@@ -73,7 +74,7 @@ def acquire_user_gender(socket_connection):
     return user_gender
 
 
-def perform_enrollment(socket_connection, prof_id):
+def perform_enrollment(socket_connection, prof_id, backend):
     socket_connection.recv(256).decode('utf-8')
     date_time = time.strftime("%Y%m%d-%H%M%S")
     filename = os.path.join(os.getcwd() + "/" + prof_id, '{}.wav'.format(date_time))
@@ -83,7 +84,7 @@ def perform_enrollment(socket_connection, prof_id):
     # TODO: comment the following line (or delete - only for testing)
     # shutil.copyfile("test_registration.wav", filename)
     # ------------------------------------------------
-    create_enrollment(prof_id, filename)
+    backend.enroll(prof_id, filename)
     socket_connection.send("enrollment_completed".encode('utf-8'))
 
 
@@ -94,6 +95,8 @@ if __name__ == '__main__':
     parser = argparse.ArgumentParser(description=text)
     # Add long and short argument
     parser.add_argument("--language", "-l", help="set the language of the client to it or en")
+    parser.add_argument("--speaker-backend", "-b", choices=["azure", "local"], default="azure",
+                        help="enroll the speakers with Microsoft APIs (azure) or offline (local)")
     # Read arguments from the command line
     args = parser.parse_args()
     if not args.language:
@@ -115,17 +118,14 @@ if __name__ == '__main__':
     server_recorder_socket.bind(("0.0.0.0", 9091))
     server_recorder_socket.listen(1)
 
-    if os.path.isfile("profiles.json"):
-        with open('profiles.json', 'r', encoding='utf-8') as f:
-            profiles_dict = json.load(f)
-    else:
-        profiles_dict = {}
+    profiles = ProfileRegistry()
+    speaker_backend = get_backend(args.speaker_backend)
 
     while True:
         print("*** Waiting for client to connect ***")
         connection, address = server_recorder_socket.accept()
-        # ** STEP 1 ** Create a new profile on the speaker recognition Microsoft API
-        profile_id = new_profile_creation(connection)
+        # ** STEP 1 ** Create a new profile on the speaker recognition Microsoft API (or locally)
+        profile_id = new_profile_creation(connection, speaker_backend)
 
         # ** STEP 2 ** Wait for the client to ask for the transcription of the name of the new profile
         profile_name = acquire_user_name(connection)
@@ -136,9 +136,7 @@ if __name__ == '__main__':
         # ** STEP 5 ** Listen to the audio input for 30 seconds, save it in a wav file inside the folder created above
         # and send it to Microsoft Speaker Recognition APIs for the enrollment of the new profile.
         print("Starting enrollment procedure")
-        perform_enrollment(connection, profile_id)
+        perform_enrollment(connection, profile_id, speaker_backend)
         print(profile_name + "'s enrollment completed!")
-        # Write the information about the new user in the profiles.json file
-        profiles_dict[profile_id] = profile_name
-        with open('profiles.json', 'w', encoding='utf-8') as f:
-            json.dump(profiles_dict, f, ensure_ascii=False, indent=4)
+        # Write the information about the new user in the profiles.json file (atomically)
+        profiles.add(profile_id, profile_name)
@@ -0,0 +1,60 @@
+"""
+Authors:     Lucrezia Grassi (concept, design and code writing),
+             Carmine Tommaso Recchiuto (concept and design),
+             Antonio Sgorbissa (concept and design)
+Email:       lucrezia.grassi@edu.unige.it
+Affiliation: RICE, DIBRIS, University of Genoa, Italy
+
+This file contains the polyphase resampler used to convert the audio captured by the microphone to the rate used by
+the rest of the pipeline (e.g. from 44100 Hz to 16000 Hz).
+The rates are converted by the rational factor up/down: the low-pass filter is split in up phases, and only the output
+samples are computed, each one as the dot product between one phase of the filter and the last input samples.
+The resampler keeps the last input samples between calls, so consecutive chunks can be processed without artifacts.
+"""
+from numpy.lib.stride_tricks import sliding_window_view
+from math import gcd
+import numpy as np
+
+
+class Resampler:
+    # taps_per_phase is the number of input samples used to compute each output sample
+    def __init__(self, in_rate, out_rate, taps_per_phase=32):
+        self.in_rate = in_rate
+        self.out_rate = out_rate
+        divisor = gcd(in_rate, out_rate)
+        self.up = out_rate // divisor
+        self.down = in_rate // divisor
+        self.taps = taps_per_phase
+        # Kaiser-windowed sinc low-pass filter just below the lowest of the two Nyquist frequencies, computed at the
+        # upsampled rate and scaled by up to compensate for the zeros inserted by the upsampling
+        n_taps = self.up * taps_per_phase
+        cutoff = 0.9 / max(self.up, self.down)
+        t = np.arange(n_taps) - (n_taps - 1) / 2
+        h = cutoff * np.sinc(cutoff * t) * np.kaiser(n_taps, 8.0) * self.up
+        # phases[p, k] multiplies the input sample k positions before the current one when the output falls on phase p;
+        # the columns are reversed so that each row can be multiplied by a window of input samples in time order
+        self.phases = np.ascontiguousarray(h.reshape(taps_per_phase, self.up).T[:, ::-1], dtype=np.float32)
+        self.reset()
+
+    # Forgets the previous samples (to be called when the audio stream is interrupted)
+    def reset(self):
+        self.history = np.zeros(self.taps - 1, dtype=np.float32)
+        # Index of the first input sample of the next chunk and index of the next output sample
+        self.in_offset = 0
+        self.next_out = 0
+
+    # Resamples a chunk of 16 bit PCM audio and returns the resampled 16 bit PCM data
+    def process(self, frame):
+        x = np.frombuffer(frame, dtype=np.int16).astype(np.float32)
+        extended = np.concatenate((self.history, x))
+        last_input = self.in_offset + len(x) - 1
+        # Output samples whose position falls within the input received so far
+        n_end = (last_input * self.up + self.up - 1) // self.down + 1
+        positions = np.arange(self.next_out, n_end, dtype=np.int64) * self.down
+        # windows[j] contains the taps input samples ending with the sample in_offset + j
+        windows = sliding_window_view(extended, self.taps)
+        y = np.einsum('nk,nk->n', self.phases[positions % self.up], windows[positions // self.up - self.in_offset])
+        self.next_out = n_end
+        self.in_offset += len(x)
+        self.history = extended[len(extended) - (self.taps - 1):]
+        return np.clip(np.rint(y), -32768, 32767).astype(np.int16).tobytes()
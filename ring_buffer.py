@@ -0,0 +1,52 @@
+"""
+Authors:     Lucrezia Grassi (concept, design and code writing),
+             Carmine Tommaso Recchiuto (concept and design),
+             Antonio Sgorbissa (concept and design)
+Email:       lucrezia.grassi@edu.unige.it
+Affiliation: RICE, DIBRIS, University of Genoa, Italy
+
+This file contains the ring buffer that keeps the audio heard just before the noise is detected (pre-roll).
+The memory is allocated once: every sample is written twice, at its position and at the same position shifted by the
+capacity, so that the last samples can always be read as a single contiguous view without copying them.
+"""
+import numpy as np
+
+
+class RingBuffer:
+    def __init__(self, capacity):
+        # Capacity expressed in samples
+        self.capacity = capacity
+        self.buffer = np.zeros(2 * capacity, dtype=np.int16)
+        self.position = 0
+        self.filled = 0
+
+    # A buffer with no capacity (no pre-roll) drops the frames
+    def write(self, frame):
+        if self.capacity == 0:
+            return
+        samples = np.frombuffer(frame, dtype=np.int16)
+        # Only the last samples of a frame longer than the buffer would be kept
+        if len(samples) > self.capacity:
+            samples = samples[-self.capacity:]
+        n = len(samples)
+        first = min(n, self.capacity - self.position)
+        self.buffer[self.position:self.position + first] = samples[:first]
+        self.buffer[self.position + self.capacity:self.position + self.capacity + first] = samples[:first]
+        if first < n:
+            self.buffer[:n - first] = samples[first:]
+            self.buffer[self.capacity:self.capacity + n - first] = samples[first:]
+        self.position = (self.position + n) % self.capacity
+        self.filled = min(self.filled + n, self.capacity)
+
+    # Returns the samples in the buffer, from the oldest to the newest, as a memoryview on the internal memory.
+    # The view is valid until the next write, so it must be copied (e.g. by b''.join) before writing again.
+    def read(self):
+        end = self.position + self.capacity
+        return memoryview(self.buffer[end - self.filled:end]).cast('B')
+
+    def clear(self):
+        self.position = 0
+        self.filled = 0
+
+    def __len__(self):
+        return self.filled
@@ -0,0 +1,127 @@
+"""
+Authors:     Lucrezia Grassi (concept, design and code writing),
+             Carmine Tommaso Recchiuto (concept and design),
+             Antonio Sgorbissa (concept and design)
+Email:       lucrezia.grassi@edu.unige.it
+Affiliation: RICE, DIBRIS, University of Genoa, Italy
+
+This file contains the segmenter that splits the audio captured by the recorder in segments and turns.
+The segmenter is a state machine fed with the chunks read from the microphone: every silence is measured by counting
+the samples, not by reading the clock, so the segmentation does not change if the loop of the recorder is delayed
+(e.g. while a segment is written) and the same audio is always split in the same way, even when it is replayed faster.
+For each chunk process() returns the events that happened:
+- segment_start, when the voice activity detector hears a voice (the segment begins with the pre-roll audio, but its
+  offset and its duration are measured from the onset of the voice, as the duration of the recordings always was);
+- segment_end, after split_silence_time seconds of silence (or when the segment reaches max_segment_time seconds);
+- turn_end, after final_silence_time seconds of silence following the last segment of the turn (the recorder can change
+  this silence during the turn, see endpointing).
+"""
+import itertools
+
+segment_start = "segment_start"
+segment_end = "segment_end"
+turn_end = "turn_end"
+# Maximum duration of a segment in seconds
+max_segment_time = 30
+s_width = 2
+
+
+class Segment:
+    # start is the position of the first sample (of the pre-roll audio) in the captured audio, pre_roll the number of
+    # samples before the onset of the voice, and offset the distance of the onset from the start of the turn
+    def __init__(self, index, start, offset, chunks, rate, pre_roll=0):
+        self.index = index
+        self.start = start
+        self.offset = offset
+        self.chunks = chunks
+        self.samples = sum(len(data) for data in chunks) // s_width
+        self.rate = rate
+        self.pre_roll = pre_roll
+
+    def append(self, data):
+        self.chunks.append(data)
+        self.samples += len(data) // s_width
+
+    def pcm(self):
+        return b''.join(self.chunks)
+
+    # Seconds from the onset of the voice to the end of the segment
+    @property
+    def duration(self):
+        return (self.samples - self.pre_roll) / self.rate
+
+    @property
+    def pre_roll_time(self):
+        return self.pre_roll / self.rate
+
+
+class Segmenter:
+    # vad decides which chunks contain voice, prev_input is the ring buffer keeping the audio heard before the voice
+    def __init__(self, vad, prev_input, rate, split_silence_time, final_silence_time,
+                 max_segment_time=max_segment_time):
+        self.vad = vad
+        self.prev_input = prev_input
+        self.rate = rate
+        self.split_silence = int(split_silence_time * rate)
+        self.final_silence = int(final_silence_time * rate)
+        self.max_segment = int(max_segment_time * rate)
+        self.counter = itertools.count()
+        # Number of samples processed since the segmenter has been created
+        self.position = 0
+        # Segment being recorded, or None
+        self.segment = None
+        # Samples of silence since the last chunk with voice of the segment, or since the end of the last segment
+        self.silence = 0
+        self.turn_start = 0
+        self.turn_segments = 0
+
+    # Starts counting the segments of a new turn
+    def new_turn(self):
+        self.turn_start = self.position
+        self.turn_segments = 0
+
+    # Sets the seconds of silence after the last segment needed to end the turn
+    def set_final_silence_time(self, final_silence_time):
+        self.final_silence = int(final_silence_time * self.rate)
+
+    # Discards the segment being recorded and the pre-roll audio (e.g. when the capture has been stopped)
+    def reset(self):
+        self.segment = None
+        self.silence = 0
+        self.prev_input.clear()
+        self.new_turn()
+
+    # Returns the list of (event, segment) that happened with the chunk (segment is None for turn_end)
+    def process(self, data):
+        n = len(data) // s_width
+        events = []
+        if self.segment is None:
+            if self.vad.is_speech(data):
+                pre_roll = len(self.prev_input)
+                # The pre-roll view is copied, as the ring buffer is written again when the segment ends
+                self.segment = Segment(next(self.counter), self.position - pre_roll,
+                                       max(self.position - self.turn_start, 0) / self.rate,
+                                       [bytes(self.prev_input.read()), data], self.rate, pre_roll)
+                self.prev_input.clear()
+                self.silence = 0
+                events.append((segment_start, self.segment))
+            else:
+                self.prev_input.write(data)
+                self.silence += n
+                if self.turn_segments and self.silence >= self.final_silence:
+                    self.turn_segments = 0
+                    events.append((turn_end, None))
+        else:
+            self.segment.append(data)
+            if self.vad.is_speech(data, active=True):
+                self.silence = 0
+            else:
+                self.silence += n
+            if self.silence >= self.split_silence or self.segment.samples >= self.max_segment:
+                events.append((segment_end, self.segment))
+                self.segment = None
+                self.turn_segments += 1
+                # The final silence is counted from the end of the segment
+                self.silence = 0
+        self.position += n
+        return events
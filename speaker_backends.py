@@ -0,0 +1,124 @@
+"""
+Authors:     Lucrezia Grassi (concept, design and code writing),
+             Carmine Tommaso Recchiuto (concept and design),
+             Antonio Sgorbissa (concept and design)
+Email:       lucrezia.grassi@edu.unige.it
+Affiliation: RICE, DIBRIS, University of Genoa, Italy
+
+This file contains the backends that can be used to identify the speakers.
+Every backend creates and enrolls the profiles and identifies the speaker of a WAV audio among a set of profiles:
+- AzureSpeakerBackend uses the Microsoft Speaker Recognition APIs;
+- LocalSpeakerBackend works offline, with the local speaker model of speaker_embedding: the audio of the segment is
+  scored against all the enrolled profiles at once with a single matrix product;
+- ScriptedSpeakerBackend always identifies the first candidate after a configurable latency, and is used to benchmark
+  the pipeline without calling any service.
+"""
+from speaker_recognition_util import create_profile, create_enrollment, identify_speaker_sharded, read_audio, \
+    confidence_threshold
+from speaker_embedding import SpeakerEmbeddings, enroll_profile
+import speaker_embedding
+import numpy as np
+import threading
+import wave
+import time
+import uuid
+import io
+import os
+
+unknown_speaker_id = "00000000-0000-0000-0000-000000000000"
+# Minimum similarity for the local backend to identify a speaker. With a single enrolled profile the similarity cannot
+# be compared with other voices, so a stricter threshold is used
+local_confidence_threshold = 0.5
+single_profile_threshold = 0.95
+
+
+class SpeakerIdBackend:
+    name = ""
+    confidence_threshold = confidence_threshold
+
+    # Creates a new profile and returns its id
+    def create_profile(self):
+        raise NotImplementedError
+
+    # Enrolls the profile with the audio recorded in the WAV file
+    def enroll(self, profile_id, wav_filename):
+        raise NotImplementedError
+
+    # Returns the id of the most likely speaker among the profiles of prof_dict and the confidence. recorder_session is
+    # the name of the session of the recorder server that sent the audio, used to label the metrics
+    def identify(self, wav_audio, prof_dict, recorder_session=None):
+        raise NotImplementedError
+
+
+class AzureSpeakerBackend(SpeakerIdBackend):
+    name = "azure"
+
+    def create_profile(self):
+        return create_profile()
+
+    def enroll(self, profile_id, wav_filename):
+        create_enrollment(profile_id, wav_filename)
+        # The local embedding is still used to pre-filter the candidates
+        enroll_profile(profile_id, os.path.dirname(os.path.dirname(os.path.abspath(wav_filename))))
+
+    def identify(self, wav_audio, prof_dict, recorder_session=None):
+        return identify_speaker_sharded(list(prof_dict.keys()), wav_audio, recorder_session=recorder_session)
+
+
+class LocalSpeakerBackend(SpeakerIdBackend):
+    name = "local"
+    confidence_threshold = local_confidence_threshold
+
+    def __init__(self, directory=None):
+        self.embeddings = SpeakerEmbeddings(directory)
+
+    def create_profile(self):
+        return str(uuid.uuid4())
+
+    def enroll(self, profile_id, wav_filename):
+        enroll_profile(profile_id, os.path.dirname(os.path.dirname(os.path.abspath(wav_filename))))
+        self.embeddings.forget(profile_id)
+
+    def identify(self, wav_audio, prof_dict, recorder_session=None):
+        with wave.open(io.BytesIO(read_audio(wav_audio)), 'rb') as wf:
+            emb = speaker_embedding.embedding(wf.readframes(wf.getnframes()), wf.getframerate())
+        if emb is None:
+            return unknown_speaker_id, 0
+        ids, scores = self.embeddings.scores(emb, list(prof_dict.keys()))
+        if not ids:
+            return unknown_speaker_id, 0
+        best = int(np.argmax(scores))
+        score = float(scores[best])
+        if len(ids) == 1 and score < single_profile_threshold:
+            return unknown_speaker_id, 0
+        return ids[best], score
+
+
+class ScriptedSpeakerBackend(SpeakerIdBackend):
+    name = "scripted"
+
+    def __init__(self, latency=0.3, confidence=0.9):
+        self.latency = latency
+        self.confidence = confidence
+        self.lock = threading.Lock()
+        self.requests = 0
+
+    def create_profile(self):
+        return str(uuid.uuid4())
+
+    def enroll(self, profile_id, wav_filename):
+        time.sleep(self.latency)
+
+    def identify(self, wav_audio, prof_dict, recorder_session=None):
+        with self.lock:
+            self.requests += 1
+        time.sleep(self.latency)
+        if not prof_dict:
+            return unknown_speaker_id, 0
+        return next(iter(prof_dict)), self.confidence
+
+
+def get_backend(name):
+    if name == LocalSpeakerBackend.name:
+        return LocalSpeakerBackend()
+    return AzureSpeakerBackend()
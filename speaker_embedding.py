@@ -0,0 +1,222 @@
+"""
+Authors:     Lucrezia Grassi (concept, design and code writing),
+             Carmine Tommaso Recchiuto (concept and design),
+             Antonio Sgorbissa (concept and design)
+Email:       lucrezia.grassi@edu.unige.it
+Affiliation: RICE, DIBRIS, University of Genoa, Italy
+
+This file contains a lightweight local speaker model, used to reduce the calls to the Speaker Recognition APIs.
+The voice in a piece of audio is described by the mean and the standard deviation of its MFCCs (computed with NumPy
+on the voiced frames only), and two voices are compared with the cosine similarity of these vectors, after removing the
+mean of the enrolled voices: the raw similarity is dominated by the component shared by all the voices recorded in the
+same room with the same microphone.
+The embeddings of the enrolled profiles are computed from the WAV files saved in the folder of each profile and cached
+in the same folder. They are used to:
+- narrow the candidate profiles sent to the service to the most similar ones;
+- recognize that a segment comes from the same voice as a segment already identified in the same turn, so that the
+  identification request can be skipped.
+"""
+from numpy.lib.stride_tricks import sliding_window_view
+from resampler import Resampler
+import numpy as np
+import threading
+import wave
+import os
+
+# Rate at which the features are computed (the audio at other rates is resampled)
+feature_rate = 16000
+frame_time = 0.025
+hop_time = 0.010
+n_fft = 512
+n_mels = 26
+n_mfcc = 13
+# Fraction of the frames with the highest energy that are considered voiced
+voiced_fraction = 0.6
+# Minimum number of voiced frames needed to compute an embedding
+min_frames = 30
+# Cosine similarity (of the centred embeddings) above which two segments of the same turn are considered spoken by the
+# same person
+same_speaker_threshold = 0.85
+# Number of most similar profiles sent to the service when there are more enrolled profiles
+max_candidates = 10
+embedding_filename = "embedding.npy"
+
+
+def mel_filterbank(rate):
+    def hz_to_mel(hz):
+        return 2595 * np.log10(1 + hz / 700)
+
+    def mel_to_hz(mel):
+        return 700 * (10 ** (mel / 2595) - 1)
+
+    mels = np.linspace(hz_to_mel(0), hz_to_mel(rate / 2), n_mels + 2)
+    bins = np.floor((n_fft + 1) * mel_to_hz(mels) / rate).astype(int)
+    filters = np.zeros((n_mels, n_fft // 2 + 1), dtype=np.float32)
+    for m in range(1, n_mels + 1):
+        left, center, right = bins[m - 1], bins[m], bins[m + 1]
+        if center > left:
+            filters[m - 1, left:center] = (np.arange(left, center) - left) / (center - left)
+        if right > center:
+            filters[m - 1, center:right] = (right - np.arange(center, right)) / (right - center)
+    return filters
+
+
+def dct_matrix():
+    n = np.arange(n_mels)
+    k = np.arange(n_mfcc)[:, None]
+    return (np.cos(np.pi * k * (2 * n + 1) / (2 * n_mels)) * np.sqrt(2 / n_mels)).astype(np.float32)
+
+
+_filters = mel_filterbank(feature_rate)
+_dct = dct_matrix()
+_frame_length = int(frame_time * feature_rate)
+_hop_length = int(hop_time * feature_rate)
+_window = np.hamming(_frame_length).astype(np.float32)
+
+
+# Returns the MFCCs (one row per frame) of the voiced frames of 16 bit PCM audio at feature_rate
+def mfcc(pcm):
+    x = np.frombuffer(pcm, dtype=np.int16).astype(np.float32) / 32768
+    if len(x) < _frame_length:
+        return np.zeros((0, n_mfcc), dtype=np.float32)
+    # Pre-emphasis, then frames taken as strided views of the signal
+    x = np.append(x[0], x[1:] - 0.97 * x[:-1])
+    frames = sliding_window_view(x, _frame_length)[::_hop_length] * _window
+    power = np.abs(np.fft.rfft(frames, n_fft)) ** 2 / n_fft
+    energy = power.sum(axis=1)
+    n_voiced = max(int(len(energy) * voiced_fraction), 1)
+    voiced = np.argsort(energy)[-n_voiced:]
+    log_mel = np.log(power[voiced] @ _filters.T + 1e-10)
+    return log_mel @ _dct.T
+
+
+# Returns the embedding of the voice in 16 bit PCM audio, or None if the audio is too short
+def embedding(pcm, rate=feature_rate):
+    if rate != feature_rate:
+        pcm = Resampler(rate, feature_rate).process(pcm)
+    coefficients = mfcc(pcm)
+    if len(coefficients) < min_frames:
+        return None
+    # The first coefficient depends on the volume only, so it is discarded
+    coefficients = coefficients[:, 1:]
+    return np.concatenate((coefficients.mean(axis=0), coefficients.std(axis=0))).astype(np.float32)
+
+
+def cosine(a, b):
+    return float(np.dot(a, b) / (np.linalg.norm(a) * np.linalg.norm(b) + 1e-10))
+
+
+def wav_embedding(filenames):
+    pcm = []
+    for filename in filenames:
+        with wave.open(filename, 'rb') as wf:
+            data = wf.readframes(wf.getnframes())
+            if wf.getframerate() != feature_rate:
+                data = Resampler(wf.getframerate(), feature_rate).process(data)
+            pcm.append(data)
+    return embedding(b''.join(pcm))
+
+
+# Computes the embedding of a profile from the WAV files in its folder and saves it in the same folder
+def enroll_profile(profile_id, directory=None):
+    folder = os.path.join(directory or os.getcwd(), profile_id)
+    filenames = sorted(os.path.join(folder, f) for f in os.listdir(folder) if f.endswith(".wav"))
+    if not filenames:
+        return None
+    emb = wav_embedding(filenames)
+    if emb is not None:
+        np.save(os.path.join(folder, embedding_filename), emb)
+    return emb
+
+
+# Embeddings of the enrolled profiles, loaded from the profile folders (and computed if missing or out of date)
+class SpeakerEmbeddings:
+    def __init__(self, directory=None):
+        self.directory = directory or os.getcwd()
+        self.lock = threading.Lock()
+        self.embeddings = {}
+
+    def load_profile(self, profile_id):
+        folder = os.path.join(self.directory, profile_id)
+        if not os.path.isdir(folder):
+            return None
+        cached = os.path.join(folder, embedding_filename)
+        wavs = [os.path.join(folder, f) for f in os.listdir(folder) if f.endswith(".wav")]
+        if os.path.isfile(cached) and all(os.path.getmtime(w) <= os.path.getmtime(cached) for w in wavs):
+            return np.load(cached)
+        return enroll_profile(profile_id, self.directory)
+
+    # Returns the ids of the profiles with an embedding and the matrix of their embeddings
+    def stack(self, prof_ids):
+        with self.lock:
+            for profile_id in prof_ids:
+                if profile_id not in self.embeddings:
+                    self.embeddings[profile_id] = self.load_profile(profile_id)
+            ids = [p for p in prof_ids if self.embeddings.get(p) is not None]
+            if not ids:
+                return ids, None
+            return ids, np.stack([self.embeddings[p] for p in ids])
+
+    # Returns the mean of the embeddings of the profiles, i.e. the component shared by all the voices, or None if
+    # there are less than two profiles with an embedding
+    def center(self, prof_ids):
+        ids, m = self.stack(prof_ids)
+        if len(ids) < 2:
+            return None
+        return m.mean(axis=0)
+
+    # Similarity between the embedding of a segment and every profile, computed with a single matrix product
+    def scores(self, emb, prof_ids):
+        ids, m = self.stack(prof_ids)
+        if m is None:
+            return ids, np.zeros(0, dtype=np.float32)
+        # Remove the component shared by all the voices, so that the similarity depends on what distinguishes them
+        center = m.mean(axis=0) if len(ids) > 1 else 0
+        m = m - center
+        v = emb - center
+        return ids, (m / (np.linalg.norm(m, axis=1, keepdims=True) + 1e-10)) @ (v / (np.linalg.norm(v) + 1e-10))
+
+    # Returns the profiles of prof_dict most similar to the embedding (all of them if they are not more than k)
+    def candidates(self, emb, prof_dict, k=max_candidates):
+        if emb is None or len(prof_dict) <= k:
+            return prof_dict
+        ids, scores = self.scores(emb, list(prof_dict.keys()))
+        # Profiles without an embedding are always kept, as they cannot be excluded
+        kept = set(p for p in prof_dict if p not in ids)
+        kept.update(ids[i] for i in np.argsort(scores)[::-1][:k])
+        return {p: name for p, name in prof_dict.items() if p in kept}
+
+    def forget(self, profile_id):
+        with self.lock:
+            self.embeddings.pop(profile_id, None)
+
+
+# Remembers the voices already identified in a turn, to avoid identifying the same voice again
+class SpeakerChangeDetector:
+    def __init__(self, threshold=same_speaker_threshold):
+        self.threshold = threshold
+        self.lock = threading.Lock()
+        self.identified = []
+
+    def reset(self):
+        with self.lock:
+            self.identified = []
+
+    # Returns the speaker id of an identified segment of the turn with the same voice, or None. The embeddings are
+    # compared after subtracting center, the mean of the enrolled voices (see SpeakerEmbeddings.center): without it
+    # the voices are not compared, as different speakers recorded by the same microphone look alike
+    def same_speaker(self, emb, center):
+        if emb is None or center is None:
+            return None
+        with self.lock:
+            best_id, best_score = None, self.threshold
+            for other, speaker_id in self.identified:
+                score = cosine(emb - center, other - center)
+                if score >= best_score:
+                    best_id, best_score = speaker_id, score
+            return best_id
+
+    def add(self, emb, speaker_id):
+        if emb is not None:
+            with self.lock:
+                self.identified.append((emb, speaker_id))
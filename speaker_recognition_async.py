@@ -0,0 +1,143 @@
+"""
+Authors:     Lucrezia Grassi (concept, design and code writing),
+             Carmine Tommaso Recchiuto (concept and design),
+             Antonio Sgorbissa (concept and design)
+Email:       lucrezia.grassi@edu.unige.it
+Affiliation: RICE, DIBRIS, University of Genoa, Italy
+
+This file contains the asyncio client for the Microsoft Speaker Recognition APIs.
+It offers the same operations as speaker_recognition_util, but as coroutines: many requests can be in flight at the
+same time without a thread each, and their number is bounded by a semaphore.
+The audio is uploaded in chunks, reading the file in a worker thread, so the event loop is never blocked by the disk.
+
+Example:
+    async with SpeakerRecognitionClient() as client:
+        await asyncio.gather(*(client.delete_profile(prof_id) for prof_id in prof_ids))
+"""
+from speaker_recognition_util import endpoint, subscription_key, connect_timeout, read_timeout, max_retries, \
+    retry_backoff, max_connections, max_profiles_per_request
+import aiohttp
+import asyncio
+import os
+
+profiles_url = endpoint + "/speaker/identification/v2.0/text-independent/profiles"
+wav_content_type = 'audio/wav; codecs=audio/pcm; samplerate=16000'
+upload_chunk_size = 64 * 1024
+retry_statuses = (429, 500, 502, 503, 504)
+
+
+class SpeakerRecognitionClient:
+    def __init__(self, max_concurrency=max_connections):
+        self.semaphore = asyncio.Semaphore(max_concurrency)
+        self.max_concurrency = max_concurrency
+        self.session = None
+
+    async def __aenter__(self):
+        connector = aiohttp.TCPConnector(limit=self.max_concurrency)
+        timeout = aiohttp.ClientTimeout(sock_connect=connect_timeout, sock_read=read_timeout)
+        self.session = aiohttp.ClientSession(connector=connector, timeout=timeout,
+                                             headers={'Ocp-Apim-Subscription-Key': subscription_key or ''})
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb):
+        await self.close()
+
+    async def close(self):
+        if self.session is not None:
+            await self.session.close()
+            self.session = None
+
+    # Sends a request and returns the status and the decoded JSON body (None if the body is empty).
+    # The requests rejected because of throttling or server errors are retried with exponential backoff.
+    # body is a function returning the data to send, as a streamed body cannot be sent twice.
+    async def request(self, method, url, body=None, headers=None):
+        async with self.semaphore:
+            for attempt in range(max_retries + 1):
+                try:
+                    async with self.session.request(method, url, headers=headers,
+                                                    data=body() if body else None) as response:
+                        if response.status in retry_statuses and attempt < max_retries:
+                            delay = response.headers.get("Retry-After")
+                            await asyncio.sleep(float(delay) if delay and delay.isdigit()
+                                                else retry_backoff * 2 ** attempt)
+                            continue
+                        text = await response.text()
+                        return response.status, (await response.json(content_type=None) if text else None)
+                except aiohttp.ClientConnectionError:
+                    if attempt == max_retries:
+                        raise
+                    await asyncio.sleep(retry_backoff * 2 ** attempt)
+
+    # Returns a function creating the body for the audio, given as the path of a WAV file or as WAV bytes,
+    # and the length of the body
+    @staticmethod
+    def audio_body(audio):
+        if isinstance(audio, str):
+            return (lambda: stream_file(audio)), os.path.getsize(audio)
+        view = memoryview(audio)
+        return (lambda: stream_bytes(view)), len(view)
+
+    async def get_profiles(self):
+        status, body = await self.request("GET", profiles_url)
+        return [profile['profileId'] for profile in body['profiles']]
+
+    async def delete_profile(self, profile_id):
+        print("Deleting", profile_id)
+        status, body = await self.request("DELETE", profiles_url + "/" + profile_id)
+        return status
+
+    async def create_profile(self):
+        status, body = await self.request("POST", profiles_url, body=lambda: "{'locale': 'en-us'}",
+                                          headers={'Content-Type': 'application/json'})
+        return body['profileId']
+
+    async def create_enrollment(self, profile_id, audio):
+        body, length = self.audio_body(audio)
+        status, result = await self.request("POST", profiles_url + "/" + profile_id + "/enrollments", body=body,
+                                            headers={'Content-Type': wav_content_type,
+                                                     'Content-Length': str(length)})
+        return result
+
+    # Returns the ranking of the candidate profiles (a list of dictionaries with profileId and score), empty on failure
+    async def identify_speaker_ranking(self, prof_ids, audio):
+        url = profiles_url + "/identifySingleSpeaker?profileIds=" + prof_ids + "&ignoreMinLength=true"
+        body, length = self.audio_body(audio)
+        try:
+            status, result = await self.request("POST", url, body=body,
+                                                headers={'Content-Type': wav_content_type,
+                                                         'Content-Length': str(length)})
+            return result['profilesRanking']
+        except (aiohttp.ClientError, asyncio.TimeoutError, ValueError, KeyError, TypeError):
+            return []
+
+    # Returns the id of the identified speaker and the confidence, or the unknown speaker with confidence 0
+    async def identify_speaker(self, prof_ids, audio):
+        ranking = await self.identify_speaker_ranking(prof_ids, audio)
+        if ranking:
+            return ranking[0]["profileId"], ranking[0]["score"]
+        return "00000000-0000-0000-0000-000000000000", 0
+
+    # Same as identify_speaker, but the candidates are split in shards identified concurrently and the rankings merged
+    async def identify_speaker_sharded(self, prof_id_list, audio, shard_size=max_profiles_per_request):
+        shards = [','.join(prof_id_list[i:i + shard_size]) for i in range(0, len(prof_id_list), shard_size)]
+        rankings = await asyncio.gather(*(self.identify_speaker_ranking(shard, audio) for shard in shards))
+        merged = sorted((entry for ranking in rankings for entry in ranking), key=lambda entry: entry["score"],
+                        reverse=True)
+        if merged:
+            return merged[0]["profileId"], merged[0]["score"]
+        return "00000000-0000-0000-0000-000000000000", 0
+
+
+# Reads the file in a worker thread, one chunk at a time
+async def stream_file(filename):
+    with open(filename, 'rb') as f:
+        while True:
+            data = await asyncio.to_thread(f.read, upload_chunk_size)
+            if not data:
+                break
+            yield data
+
+
+async def stream_bytes(view):
+    for start in range(0, len(view), upload_chunk_size):
+        yield view[start:start + upload_chunk_size]
@@ -8,42 +8,154 @@ Affiliation: RICE, DIBRIS, University of Genoa, Italy
 This file contains the methods used to recognize speakers connecting to Microsoft APIs
 """
 from dotenv import load_dotenv, find_dotenv
+from audio_capture import AudioCapture
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+from concurrent.futures import ThreadPoolExecutor
+import metrics
+import threading
 import requests
 import pyaudio
 import wave
+import time
 import os
 
 endpoint = "https://cairspeakerrecognition.cognitiveservices.azure.com"
 _ = load_dotenv(find_dotenv())
 subscription_key = os.getenv("COGNITIVE_SERVICE_KEY")
 
-
+# Timeouts (in seconds) for establishing the connection and for receiving the response
+connect_timeout = 3.05
+read_timeout = 10
+# Number of retries for the requests that cannot connect or are rejected because of throttling (429) or server errors
+# (5xx, for the idempotent requests only)
+max_retries = 3
+retry_backoff = 0.3
+# Number of connections kept alive towards the endpoint
+max_connections = 8
+# Maximum number of candidate profiles accepted by identifySingleSpeaker in a single request
+max_profiles_per_request = 50
+# Minimum score for a speaker to be considered identified
+confidence_threshold = 0.3
+
+
+# Retries the requests that failed to connect or were throttled, and the idempotent requests that got a server error.
+# A POST that got a server error is not sent again: the service may have created the profile or the enrollment before
+# failing, and the retry would create a duplicate
+class SpeakerApiRetry(Retry):
+    def is_retry(self, method, status_code, has_retry_after=False):
+        if method.upper() == "POST":
+            return status_code == 429
+        return super().is_retry(method, status_code, has_retry_after)
+
+
+# Session shared by all the requests, so that the TCP+TLS connections to the endpoint are reused
+session = requests.Session()
+_adapter = HTTPAdapter(pool_connections=1, pool_maxsize=max_connections,
+                       max_retries=SpeakerApiRetry(total=max_retries, connect=max_retries, read=0,
+                                                   backoff_factor=retry_backoff,
+                                                   status_forcelist=(429, 500, 502, 503, 504),
+                                                   respect_retry_after_header=True, raise_on_status=False))
+session.mount("https://", _adapter)
+
+# Threads used to send the requests of the different shards of candidate profiles in parallel
+_shard_executor = ThreadPoolExecutor(max_workers=max_connections, thread_name_prefix="T2")
+
+_stats_lock = threading.Lock()
+_stats = {"requests": 0, "errors": 0, "total_latency": 0.0, "max_latency": 0.0}
+
+
+# Returns the latency histogram and the request and error counters of the identifications of a session of the recorder
+# server (labelled with its name), or of the service if recorder_session is None
+def speaker_id_metrics(recorder_session=None):
+    labels = {"session": recorder_session} if recorder_session else None
+    return (metrics.registry.histogram("speaker_id_seconds", "Time taken to identify the speaker of an audio",
+                                       labels=labels),
+            metrics.registry.counter("speaker_id_requests_total", "Speaker identifications performed", labels=labels),
+            metrics.registry.counter("speaker_id_errors_total", "Speaker identifications failed with an error",
+                                     labels=labels))
+
+
+speaker_id_metrics()
+speaker_audio = metrics.registry.counter("speaker_audio_seconds_total",
+                                         "Seconds of audio uploaded to the Speaker Recognition APIs")
+metrics.registry.counter("speaker_api_requests_total", "Requests sent to the Speaker Recognition APIs",
+                         fn=lambda: _stats["requests"])
+metrics.registry.counter("speaker_api_errors_total", "Requests to the Speaker Recognition APIs failed or rejected",
+                         fn=lambda: _stats["errors"])
+metrics.registry.counter("speaker_api_latency_seconds_total", "Seconds spent waiting for the Speaker Recognition APIs",
+                         fn=lambda: _stats["total_latency"])
+metrics.registry.gauge("speaker_api_mean_latency_seconds",
+                       "Mean latency of the requests to the Speaker Recognition APIs",
+                       fn=lambda: get_stats()["mean_latency"])
+metrics.registry.gauge("speaker_api_max_latency_seconds",
+                       "Maximum latency of the requests to the Speaker Recognition APIs",
+                       fn=lambda: _stats["max_latency"])
+metrics.registry.counter("speaker_api_connections_opened_total", "Connections opened to the Speaker Recognition APIs",
+                         fn=lambda: get_stats()["new_connections"])
+metrics.registry.counter("speaker_api_connections_reused_total",
+                         "Requests to the Speaker Recognition APIs sent on an already open connection",
+                         fn=lambda: get_stats()["reused_connections"])
+
+
+# Sends a request through the shared session, updating the latency and error counters
+def send_request(method, url, **kwargs):
+    start = time.time()
+    error = True
+    try:
+        response = session.request(method, url, timeout=(connect_timeout, read_timeout), **kwargs)
+        error = response.status_code >= 400
+        return response
+    finally:
+        latency = time.time() - start
+        with _stats_lock:
+            _stats["requests"] += 1
+            _stats["errors"] += int(error)
+            _stats["total_latency"] += latency
+            _stats["max_latency"] = max(_stats["max_latency"], latency)
+
+
+# Number of connections opened so far by the connection pools of the session
+def opened_connections():
+    pools = _adapter.poolmanager.pools
+    return sum(getattr(pools[key], "num_connections", 0) for key in list(pools.keys()))
+
+
+# Statistics of the requests sent through the session, also published as metrics
+def get_stats():
+    with _stats_lock:
+        stats = dict(_stats)
+    stats["mean_latency"] = stats["total_latency"] / stats["requests"] if stats["requests"] else 0.0
+    stats["new_connections"] = opened_connections()
+    stats["reused_connections"] = max(stats["requests"] - stats["new_connections"], 0)
+    return stats
+
+
+# The enrollment audio is recorded at 16 kHz, the rate declared when it is sent to the service
 def from_speech_to_wav(output_filename):
-    chunk = 1024
+    chunk = 512
     audio_format = pyaudio.paInt16
     channels = 1
-    rate = 44100
+    rate = 16000
     record_seconds = 30
     p = pyaudio.PyAudio()
 
-    stream = p.open(format=audio_format,
-                    channels=channels,
-                    rate=rate,
-                    input=True,
-                    frames_per_buffer=chunk)
+    capture = AudioCapture(p, audio_format, channels, rate, chunk)
+    capture.start()
 
     print("** Recording **")
 
     frames = []
+    recorded_samples = 0
 
-    for i in range(0, int(rate / chunk * record_seconds)):
-        data = stream.read(chunk)
+    while recorded_samples < rate * record_seconds:
+        data = capture.read()
         frames.append(data)
+        recorded_samples += len(data) // 2
 
     print("** Recording completed **")
 
-    stream.stop_stream()
-    stream.close()
+    capture.close()
     p.terminate()
 
     wf = wave.open(output_filename, 'wb')
@@ -54,6 +166,19 @@ def from_speech_to_wav(output_filename):
     wf.close()
 
 
+# The audio can be given as the path of a WAV file or as the content of a WAV file already in memory
+def read_audio(audio):
+    if isinstance(audio, str):
+        with open(audio, 'rb') as f:
+            return f.read()
+    return audio
+
+
+# Seconds of 16 kHz 16 bit mono audio in the content of a WAV file (without its 44 bytes header)
+def wav_seconds(data):
+    return max(len(data) - 44, 0) / (2 * 16000)
+
+
 def get_profiles():
     prof_ids = []
     print("\nRetrieving profiles...")
@@ -61,7 +186,7 @@ def get_profiles():
     headers = {
         'Ocp-Apim-Subscription-Key': subscription_key,
     }
-    response = requests.request("GET", url, headers=headers)
+    response = send_request("GET", url, headers=headers)
     for profile in response.json()['profiles']:
         profile_id = profile['profileId']
         print(profile_id)
@@ -75,7 +200,7 @@ def delete_profile(profile_id):
     headers = {
         'Ocp-Apim-Subscription-Key': subscription_key,
     }
-    requests.request("DELETE", url, headers=headers)
+    send_request("DELETE", url, headers=headers)
 
 
 def create_profile():
@@ -88,53 +213,96 @@ def create_profile():
         'Ocp-Apim-Subscription-Key': subscription_key,
         'Content-Type': 'application/json'
     }
-    response = requests.request("POST", url, headers=headers, data=raw_data)
+    response = send_request("POST", url, headers=headers, data=raw_data)
     print(response.text)
     new_profile_id = response.json()['profileId']
     return new_profile_id
 
 
-def create_enrollment(new_profile_id, filename):
+def create_enrollment(new_profile_id, audio):
     print("\nCreating enrollment for", new_profile_id)
     url = endpoint + "/speaker/identification/v2.0/text-independent/profiles/" + new_profile_id + "/enrollments"
-    data = open(filename, 'rb')
+    data = read_audio(audio)
 
     headers = {
         'Ocp-Apim-Subscription-Key': subscription_key,
         'Content-Type': 'audio/wav; codecs=audio/pcm; samplerate=16000'
     }
 
-    response = requests.request("POST", url, headers=headers, data=data)
+    speaker_audio.inc(wav_seconds(data))
+    response = send_request("POST", url, headers=headers, data=data)
     print(response.json())
 
 
-def identify_speaker(prof_ids, filename):
+# Returns the ranking of the candidate profiles (a list of dictionaries with profileId and score), empty on failure.
+# The failures are counted as identification errors of the session of the recorder server that sent the audio
+def identify_speaker_ranking(prof_ids, audio, recorder_session=None):
     url = endpoint + "/speaker/identification/v2.0/text-independent/profiles/identifySingleSpeaker?" \
                      "profileIds=" + prof_ids + "&ignoreMinLength=true"
 
-    data = open(filename, 'rb')
+    data = read_audio(audio)
 
     headers = {
         'Ocp-Apim-Subscription-Key': subscription_key,
         'Content-Type': 'audio/wav; codecs=audio/pcm; samplerate=16000'
     }
 
-    response = requests.request("POST", url, headers=headers, data=data)
-    # print(response.json())
+    speaker_audio.inc(wav_seconds(data))
     try:
-        identified_speaker = response.json()['profilesRanking'][0]["profileId"]
-        confidence = response.json()["identifiedProfile"]["score"]
-    except:
-        identified_speaker = "00000000-0000-0000-0000-000000000000"
-        confidence = 0
-    return identified_speaker, confidence
-
-
-def recognize_speaker(wav_filename, prof_dict, ident_spk):
-    prof_ids = ','.join(prof_dict.keys())
+        response = send_request("POST", url, headers=headers, data=data)
+        return response.json()['profilesRanking']
+    except (requests.RequestException, ValueError, KeyError, TypeError) as e:
+        print("T2: Speaker identification request failed:", e)
+        speaker_id_metrics(recorder_session)[2].inc()
+        return []
+
+
+def identify_speaker(prof_ids, audio):
+    ranking = identify_speaker_ranking(prof_ids, audio)
+    # print(ranking)
+    if ranking:
+        return ranking[0]["profileId"], ranking[0]["score"]
+    return "00000000-0000-0000-0000-000000000000", 0
+
+
+# Splits the candidate profiles in shards accepted by the service, identifies the speaker on all the shards in
+# parallel and returns the best profile of the merged ranking with its score
+def identify_speaker_sharded(prof_id_list, audio, shard_size=max_profiles_per_request, recorder_session=None):
+    data = read_audio(audio)
+    shards = [','.join(prof_id_list[i:i + shard_size]) for i in range(0, len(prof_id_list), shard_size)]
+    if len(shards) == 1:
+        rankings = [identify_speaker_ranking(shards[0], data, recorder_session)]
+    else:
+        rankings = list(_shard_executor.map(lambda shard: identify_speaker_ranking(shard, data, recorder_session),
+                                            shards))
+    merged = sorted((entry for ranking in rankings for entry in ranking), key=lambda entry: entry["score"],
+                    reverse=True)
+    if merged:
+        return merged[0]["profileId"], merged[0]["score"]
+    return "00000000-0000-0000-0000-000000000000", 0
+
+
+# The speaker is identified with the given backend (see speaker_backends), or with the Microsoft APIs if None.
+# recorder_session is the name of the session of the recorder server that sent the audio, used to label the metrics
+def recognize_speaker(wav_audio, prof_dict, ident_spk, backend=None, recorder_session=None):
     print("T2: Trying to identify speaker...")
-    ident_speaker_id, confidence = identify_speaker(prof_ids, wav_filename)
-    if confidence > 0.3:
+    speaker_id_latency, speaker_id_requests, speaker_id_errors = speaker_id_metrics(recorder_session)
+    start = time.time()
+    try:
+        if backend is None:
+            ident_speaker_id, confidence = identify_speaker_sharded(list(prof_dict.keys()), wav_audio,
+                                                                    recorder_session=recorder_session)
+            threshold = confidence_threshold
+        else:
+            ident_speaker_id, confidence = backend.identify(wav_audio, prof_dict, recorder_session)
+            threshold = backend.confidence_threshold
+    except Exception:
+        speaker_id_errors.inc()
+        raise
+    finally:
+        speaker_id_requests.inc()
+        speaker_id_latency.observe(time.time() - start)
+    if confidence > threshold:
         ident_spk[0] = ident_speaker_id
         speaker_name = prof_dict[ident_speaker_id]
         print("T2: Identified speaker:", speaker_name)
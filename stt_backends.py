@@ -0,0 +1,157 @@
+"""
+Authors:     Lucrezia Grassi (concept, design and code writing),
+             Carmine Tommaso Recchiuto (concept and design),
+             Antonio Sgorbissa (concept and design)
+Email:       lucrezia.grassi@edu.unige.it
+Affiliation: RICE, DIBRIS, University of Genoa, Italy
+
+This file contains the backends that can be used to transcribe the segments.
+Every backend transcribes a segment of 16 bit PCM audio and returns the recognized text ("" if nothing has been
+recognized); the clients of the services are created once and reused for all the segments:
+- AzureSttBackend uses the Microsoft Speech APIs, through a pool of recognizers connected in advance;
+- GoogleSttBackend uses the Google Speech-to-Text APIs, with a single SpeechClient (google-cloud-speech is imported only
+  when this backend is created, so it is not needed by the other backends);
+- ScriptedSttBackend works offline: it returns scripted transcripts after a configurable latency, and is used to test
+  and benchmark the pipeline without calling any service.
+"""
+from recognizer_pool import RecognizerPool
+import azure.cognitiveservices.speech as speechsdk
+import metrics
+import itertools
+import threading
+import time
+import os
+
+
+# Returns the latency histogram and the request, error and audio counters of the transcriptions of a session of the
+# recorder server (labelled with its name), or of the recorder if session is None
+def stt_metrics(session=None):
+    labels = {"session": session} if session else None
+    return (metrics.registry.histogram("stt_request_seconds", "Time taken to transcribe a segment", labels=labels),
+            metrics.registry.counter("stt_requests_total", "Segments sent to the speech to text backend",
+                                     labels=labels),
+            metrics.registry.counter("stt_errors_total", "Transcriptions failed with an error", labels=labels),
+            metrics.registry.counter("stt_audio_seconds_total", "Seconds of audio sent to the speech to text backend",
+                                     labels=labels))
+
+
+stt_metrics()
+
+
+class SttBackend:
+    name = ""
+
+    def __init__(self, lang, rate, channels=1):
+        self.lang = lang
+        self.rate = rate
+        self.channels = channels
+        self.lock = threading.Lock()
+        self.requests = 0
+        self.total_time = 0.0
+
+    # Prepares the client before the first segment (e.g. opens the connections to the service)
+    def warm_up(self):
+        pass
+
+    # Returns the text recognized in the PCM data of a segment, or "" if nothing has been recognized. session is the
+    # name of the session of the recorder server that sent the segment, used to label the metrics
+    def transcribe(self, recording, session=None):
+        stt_latency, stt_requests, stt_errors, stt_audio = stt_metrics(session)
+        start = time.time()
+        stt_audio.inc(len(recording) / (2 * self.channels * self.rate))
+        try:
+            return self.recognize(recording) or ""
+        except Exception:
+            stt_errors.inc()
+            raise
+        finally:
+            latency = time.time() - start
+            stt_requests.inc()
+            stt_latency.observe(latency)
+            with self.lock:
+                self.requests += 1
+                self.total_time += latency
+
+    def recognize(self, recording):
+        raise NotImplementedError
+
+    def stats(self):
+        with self.lock:
+            return {"backend": self.name, "requests": self.requests,
+                    "mean_time": self.total_time / self.requests if self.requests else 0.0}
+
+    def close(self):
+        pass
+
+
+class AzureSttBackend(SttBackend):
+    name = "azure"
+
+    # pool_size is the number of recognizers kept connected (more are needed when several recorders share the backend)
+    def __init__(self, lang, rate, channels=1, region="westeurope", pool_size=2):
+        super().__init__(lang, rate, channels)
+        self.speech_config = speechsdk.SpeechConfig(subscription=os.environ["COGNITIVE_SERVICE_KEY"], region=region,
+                                                    speech_recognition_language=lang)
+        # Recognizers connected in advance, so that the segments do not pay the handshake with the service
+        self.pool = RecognizerPool(self.speech_config, rate, channels, size=pool_size)
+
+    def warm_up(self):
+        self.pool.warm_up()
+
+    def recognize(self, recording):
+        return self.pool.recognize(recording).text
+
+    def stats(self):
+        stats = super().stats()
+        stats.update(self.pool.stats())
+        return stats
+
+    def close(self):
+        self.pool.close()
+
+
+class GoogleSttBackend(SttBackend):
+    name = "google"
+
+    def __init__(self, lang, rate, channels=1):
+        super().__init__(lang, rate, channels)
+        from google.cloud import speech
+        self.speech = speech
+        # The client keeps its channel open, so it is created once and shared by all the threads
+        self.client = speech.SpeechClient()
+        self.config = speech.RecognitionConfig(encoding=speech.RecognitionConfig.AudioEncoding.LINEAR16,
+                                               sample_rate_hertz=rate, audio_channel_count=channels,
+                                               language_code=lang)
+
+    def recognize(self, recording):
+        audio = self.speech.RecognitionAudio(content=bytes(recording))
+        response = self.client.recognize(config=self.config, audio=audio)
+        # Each result is for a consecutive portion of the audio, the first alternative is the most likely one
+        return " ".join(result.alternatives[0].transcript for result in response.results if result.alternatives)
+
+
+class ScriptedSttBackend(SttBackend):
+    name = "local"
+
+    # transcripts are returned in order (starting again from the first one when they are over), each one after
+    # latency seconds plus latency_per_second seconds for every second of audio
+    def __init__(self, lang, rate, channels=1, transcripts=None, latency=0.3, latency_per_second=0.0):
+        super().__init__(lang, rate, channels)
+        self.transcripts = itertools.cycle(transcripts or ["hello"])
+        self.latency = latency
+        self.latency_per_second = latency_per_second
+
+    def recognize(self, recording):
+        audio_time = len(recording) / (2 * self.channels * self.rate)
+        with self.lock:
+            transcript = next(self.transcripts)
+        time.sleep(self.latency + self.latency_per_second * audio_time)
+        return transcript
+
+
+def get_stt_backend(name, lang, rate, channels=1, **kwargs):
+    if name == GoogleSttBackend.name:
+        return GoogleSttBackend(lang, rate, channels)
+    if name == ScriptedSttBackend.name:
+        return ScriptedSttBackend(lang, rate, channels, **kwargs)
+    return AzureSttBackend(lang, rate, channels, **kwargs)
@@ -0,0 +1,75 @@
+import pytest
+from client_protocol import (encode_message, FrameReader, ProtocolError, LegacyProtocol, FramedProtocol,
+                             open_protocol, header, magic, protocol_version, message_types, ack_message)
+
+
+# Connection returning the given pieces of data, then b'' as if the client had disconnected
+class FakeConnection:
+    def __init__(self, *pieces):
+        self.pieces = list(pieces)
+
+    def recv(self, size):
+        return self.pieces.pop(0) if self.pieces else b''
+
+
+def test_round_trip():
+    data = encode_message("piece", turn=1, segment=0, speaker="2", text="ciao", duration=1.5, offset=0.2)
+    assert data[:2] == magic
+    assert FrameReader().feed(data) == [("piece", {"turn": 1, "segment": 0, "speaker": "2", "text": "ciao",
+                                                   "duration": 1.5, "offset": 0.2})]
+
+
+def test_frames_split_and_merged_by_the_socket():
+    data = encode_message("ready") + encode_message("final", turn=3, xml="<turn/>", text="hi")
+    reader = FrameReader()
+    messages = []
+    for i in range(len(data)):
+        messages += reader.feed(data[i:i + 1])
+    assert messages == [("ready", {}), ("final", {"turn": 3, "xml": "<turn/>", "text": "hi"})]
+    assert reader.feed(data + data[:5]) == messages
+    assert len(reader.buffer) == 5
+
+
+def test_invalid_frames():
+    with pytest.raises(ProtocolError):
+        FrameReader().feed(b"XX" + encode_message("ready")[2:])
+    with pytest.raises(ProtocolError):
+        FrameReader().feed(header.pack(magic, protocol_version + 1, message_types["ready"], 0))
+    with pytest.raises(ProtocolError):
+        FrameReader().feed(header.pack(magic, protocol_version, 99, 0))
+    with pytest.raises(ProtocolError):
+        FrameReader().feed(header.pack(magic, protocol_version, message_types["ready"], 1 << 30))
+
+
+def test_open_protocol_chooses_the_protocol_of_the_first_message():
+    sent = []
+    framed = open_protocol(encode_message("ready"), sent.append)
+    assert isinstance(framed, FramedProtocol)
+    assert list(framed.pending) == ["ready"]
+    legacy = open_protocol(b"ready", sent.append)
+    assert type(legacy) is LegacyProtocol
+    assert list(legacy.pending) == ["ready"]
+
+
+def test_bye_is_read_as_a_disconnection():
+    protocol = FramedProtocol(lambda data: None)
+    connection = FakeConnection(encode_message("ready")[:3], encode_message("ready")[3:] + encode_message("bye"))
+    assert protocol.receive(connection) == "ready"
+    assert protocol.receive(connection) == ""
+    assert protocol.receive(connection) == ""
+
+
+def test_messages_sent_to_the_client():
+    sent = []
+    legacy = LegacyProtocol(sent.append)
+    legacy.ack(1)
+    legacy.interim(1, "hel")
+    legacy.piece(1, 0, "1", "hello", 1.0)
+    legacy.final(1, "<turn/>", "hello")
+    assert sent == [ack_message.encode('utf-8'), b"<turn/>"]
+    sent.clear()
+    framed = FramedProtocol(sent.append)
+    framed.ack(1)
+    framed.piece(1, 0, "1", "hello", 1.0, offset=0.5)
+    piece = {"turn": 1, "segment": 0, "speaker": "1", "text": "hello", "duration": 1.0, "offset": 0.5}
+    assert FrameReader().feed(b''.join(sent)) == [("ack", {"turn": 1}), ("piece", piece)]
@@ -0,0 +1,55 @@
+import numpy as np
+from endpointing import Endpointer, min_final_silence_time, max_final_silence_time
+
+rate = 16000
+
+
+def make_endpointer(**kwargs):
+    return Endpointer("en-GB", rate, 1.5, **kwargs)
+
+
+# Harmonic tone whose pitch goes from f0 to f1 and whose amplitude drops from 1 to a1 in the last 0.4 seconds
+def tone(f0, f1, a1, seconds=1.5):
+    t = np.arange(int(rate * seconds)) / rate
+    tail = np.clip((t - (seconds - 0.4)) / 0.4, 0, 1)
+    phase = 2 * np.pi * np.cumsum(f0 + (f1 - f0) * tail) / rate
+    signal = sum(np.sin(k * phase) / k for k in range(1, 6)) * np.where(tail > 0, a1, 1)
+    return (signal * 8000).astype(np.int16).tobytes()
+
+
+def test_no_cues_keep_the_default_silence():
+    assert make_endpointer().final_silence("") == 1.5
+
+
+def test_exit_keywords_end_the_turn_at_once():
+    endpointer = make_endpointer(exit_keywords=["goodbye robot"])
+    assert endpointer.final_silence("ok goodbye robot") == min_final_silence_time
+
+
+def test_trailing_conjunction_waits_longer():
+    assert make_endpointer().final_silence("I would like to go to the") > 1.5
+
+
+def test_question_and_complete_sentence_wait_less():
+    endpointer = make_endpointer()
+    assert endpointer.final_silence("what time is it") < endpointer.final_silence("I am fine thanks") < 1.5
+
+
+def test_silence_stays_within_the_bounds():
+    endpointer = make_endpointer()
+    endpointer.pitch_change, endpointer.energy_fall = -10.0, 20.0
+    assert min_final_silence_time <= endpointer.final_silence("what time is it") < 1.5
+    endpointer.pitch_change, endpointer.energy_fall = 10.0, 0.0
+    assert 1.5 < endpointer.final_silence("and") <= max_final_silence_time
+    endpointer.new_turn()
+    assert endpointer.pitch_change == endpointer.energy_fall == 0.0
+
+
+def test_prosody_of_a_falling_ending():
+    endpointer = make_endpointer()
+    endpointer.end_segment(tone(200, 150, 0.3))
+    assert endpointer.pitch_change < -2
+    assert endpointer.energy_fall > 6
+    pitch_change, energy_fall = endpointer.prosody(tone(200, 200, 1))
+    assert abs(pitch_change) < 0.5
+    assert abs(energy_fall) < 1
@@ -0,0 +1,53 @@
+import json
+import pytest
+from latency_tracer import LatencyTracer, summarize
+
+
+def write_trace(filename, records):
+    with open(filename, 'w', encoding='utf-8') as f:
+        f.writelines(json.dumps(record) + "\n" for record in records)
+
+
+def test_summarize_durations_between_stages(tmp_path):
+    filename = str(tmp_path / "trace.jsonl")
+    records = []
+    for segment, (start, duration) in enumerate(((0.0, 0.5), (1.0, 1.5), (3.0, 1.0))):
+        records.append({"time": start, "stage": "stt_start", "segment": segment})
+        records.append({"time": start + duration, "stage": "stt_end", "segment": segment, "recognized": True})
+    records.append({"time": 10.0, "stage": "final_silence", "turn": 0})
+    records.append({"time": 10.2, "stage": "xml_sent", "turn": 0})
+    # Only the first time a stage is reached is kept
+    records.append({"time": 11.0, "stage": "xml_sent", "turn": 0})
+    # A turn that did not reach the end is ignored
+    records.append({"time": 20.0, "stage": "final_silence", "turn": 1})
+    write_trace(filename, records)
+    summary = summarize(filename)
+    assert set(summary) == {"speech to text", "final silence to xml sent"}
+    stt = summary["speech to text"]
+    assert stt["count"] == 3
+    assert stt["mean"] == pytest.approx(1.0)
+    assert stt["median"] == pytest.approx(1.0)
+    assert stt["max"] == pytest.approx(1.5)
+    assert stt["p95"] == pytest.approx(1.5)
+    assert summary["final silence to xml sent"]["count"] == 1
+    assert summary["final silence to xml sent"]["max"] == pytest.approx(0.2)
+
+
+def test_tracer_writes_the_events(tmp_path):
+    filename = str(tmp_path / "trace.jsonl")
+    tracer = LatencyTracer(filename)
+    tracer.event("noise_onset", turn=0, segment=0)
+    tracer.event("segment_end", segment=0, duration=1.2)
+    tracer.close()
+    with open(filename, encoding='utf-8') as f:
+        records = [json.loads(line) for line in f]
+    assert [record["stage"] for record in records] == ["noise_onset", "segment_end"]
+    assert records[0]["turn"] == 0 and records[1]["duration"] == 1.2
+    assert summarize(filename)["segment capture"]["count"] == 1
+
+
+def test_disabled_tracer_ignores_the_events():
+    tracer = LatencyTracer()
+    tracer.event("noise_onset", turn=0)
+    tracer.close()
+    assert tracer.dropped_events == 0
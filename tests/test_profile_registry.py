@@ -0,0 +1,74 @@
+import json
+import os
+import stat
+import pytest
+import profile_registry
+from profile_registry import ProfileRegistry
+
+
+def make_registry(tmp_path):
+    return ProfileRegistry(str(tmp_path / "profiles.json"))
+
+
+def mode(filename):
+    return stat.S_IMODE(os.stat(filename).st_mode)
+
+
+def test_save_writes_the_whole_file(tmp_path):
+    registry = make_registry(tmp_path)
+    registry.add("id1", "alice")
+    registry.add("id2", "bob")
+    with open(registry.filename, encoding='utf-8') as f:
+        assert json.load(f) == {"id1": "alice", "id2": "bob"}
+    # The temporary file has been renamed
+    assert os.listdir(str(tmp_path)) == ["profiles.json"]
+    assert mode(registry.filename) == profile_registry.new_file_mode
+
+
+def test_save_keeps_the_permissions_of_the_file(tmp_path):
+    registry = make_registry(tmp_path)
+    registry.add("id1", "alice")
+    os.chmod(registry.filename, 0o600)
+    registry.add("id2", "bob")
+    assert mode(registry.filename) == 0o600
+
+
+def test_failed_save_leaves_the_file_unchanged(tmp_path, monkeypatch):
+    registry = make_registry(tmp_path)
+    registry.add("id1", "alice")
+
+    def fail(*args, **kwargs):
+        raise OSError("disk full")
+
+    monkeypatch.setattr(profile_registry.json, "dump", fail)
+    with pytest.raises(OSError):
+        registry.add("id2", "bob")
+    monkeypatch.undo()
+    assert os.listdir(str(tmp_path)) == ["profiles.json"]
+    assert make_registry(tmp_path).get() == {"id1": "alice"}
+
+
+def test_reload_when_another_process_changes_the_file(tmp_path):
+    reader = make_registry(tmp_path)
+    assert reader.get() == {}
+    make_registry(tmp_path).add("id1", "alice")
+    assert reader.get() == {"id1": "alice"}
+    make_registry(tmp_path).remove("id1")
+    assert reader.get() == {}
+    make_registry(tmp_path).clear()
+    assert reader.get() == {}
+
+
+def test_file_read_only_when_it_changes(tmp_path, monkeypatch):
+    registry = make_registry(tmp_path)
+    registry.add("id1", "alice")
+    reader = make_registry(tmp_path)
+    loads = []
+    load = profile_registry.json.load
+    monkeypatch.setattr(profile_registry.json, "load", lambda f: loads.append(1) or load(f))
+    for i in range(3):
+        assert reader.get() == {"id1": "alice"}
+    assert len(loads) == 1
+    registry.add("id2", "bob")
+    assert reader.get() == {"id1": "alice", "id2": "bob"}
+    assert len(loads) == 2
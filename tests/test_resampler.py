@@ -0,0 +1,45 @@
+import numpy as np
+from resampler import Resampler
+
+
+def tone(frequency, rate, seconds, amplitude=8000):
+    t = np.arange(int(rate * seconds)) / rate
+    return (amplitude * np.sin(2 * np.pi * frequency * t)).astype(np.int16)
+
+
+def dominant_frequency(samples, rate):
+    spectrum = np.abs(np.fft.rfft(samples.astype(np.float64) * np.hanning(len(samples))))
+    return np.fft.rfftfreq(len(samples), 1 / rate)[np.argmax(spectrum)]
+
+
+def test_output_length():
+    resampler = Resampler(48000, 16000)
+    out = resampler.process(tone(440, 48000, 1).tobytes())
+    assert abs(len(out) // 2 - 16000) <= 1
+
+
+def test_chunks_give_the_same_output_as_a_single_call():
+    signal = tone(440, 44100, 0.5).tobytes()
+    whole = Resampler(44100, 16000).process(signal)
+    resampler = Resampler(44100, 16000)
+    chunk = 1411 * 2
+    pieces = b''.join(resampler.process(signal[i:i + chunk]) for i in range(0, len(signal), chunk))
+    assert pieces == whole
+
+
+def test_keeps_the_frequency_of_a_tone():
+    out = np.frombuffer(Resampler(48000, 16000).process(tone(1000, 48000, 1).tobytes()), dtype=np.int16)
+    assert abs(dominant_frequency(out[1000:], 16000) - 1000) < 5
+
+
+def test_removes_the_frequencies_above_the_new_nyquist():
+    out = np.frombuffer(Resampler(48000, 16000).process(tone(12000, 48000, 1).tobytes()), dtype=np.int16)
+    assert np.abs(out[1000:]).max() < 400
+
+
+def test_reset_forgets_the_history():
+    signal = tone(440, 48000, 0.1).tobytes()
+    resampler = Resampler(48000, 16000)
+    first = resampler.process(signal)
+    resampler.reset()
+    assert resampler.process(signal) == first
@@ -0,0 +1,47 @@
+import numpy as np
+from ring_buffer import RingBuffer
+
+
+def pcm(values):
+    return np.asarray(values, dtype=np.int16).tobytes()
+
+
+def read(buffer):
+    return np.frombuffer(bytes(buffer.read()), dtype=np.int16).tolist()
+
+
+def test_empty():
+    buffer = RingBuffer(4)
+    assert len(buffer) == 0
+    assert read(buffer) == []
+
+
+def test_keeps_the_last_samples_in_order():
+    buffer = RingBuffer(4)
+    buffer.write(pcm([1, 2, 3]))
+    assert read(buffer) == [1, 2, 3]
+    buffer.write(pcm([4, 5, 6]))
+    assert len(buffer) == 4
+    assert read(buffer) == [3, 4, 5, 6]
+
+
+def test_frame_longer_than_the_capacity():
+    buffer = RingBuffer(3)
+    buffer.write(pcm([1, 2, 3, 4, 5]))
+    assert read(buffer) == [3, 4, 5]
+
+
+def test_clear():
+    buffer = RingBuffer(3)
+    buffer.write(pcm([1, 2]))
+    buffer.clear()
+    assert len(buffer) == 0
+    buffer.write(pcm([7]))
+    assert read(buffer) == [7]
+
+
+def test_no_capacity():
+    buffer = RingBuffer(0)
+    buffer.write(pcm([1, 2, 3]))
+    assert len(buffer) == 0
+    assert read(buffer) == []
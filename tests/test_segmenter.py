@@ -0,0 +1,82 @@
+import numpy as np
+from ring_buffer import RingBuffer
+from segmenter import Segmenter, segment_start, segment_end, turn_end
+
+rate = 1000
+chunk = 100
+
+
+# Voice activity detector hearing a voice in the chunks that are not silent
+class LoudVad:
+    def is_speech(self, frame, active=False):
+        return any(frame)
+
+
+def voice():
+    return np.full(chunk, 1000, dtype=np.int16).tobytes()
+
+
+def silence():
+    return bytes(chunk * 2)
+
+
+# Segmenter with 0.2 s of pre-roll, segments split by 0.3 s of silence and turns ended by 1 s of silence
+def make_segmenter(max_segment_time=30):
+    return Segmenter(LoudVad(), RingBuffer(200), rate, 0.3, 1.0, max_segment_time=max_segment_time)
+
+
+# Returns the events of the chunks, as (index of the chunk, event)
+def run(segmenter, chunks):
+    return [(i, event) for i, data in enumerate(chunks) for event, segment in segmenter.process(data)]
+
+
+def test_segment_starts_with_the_pre_roll():
+    segmenter = make_segmenter()
+    events = []
+    for data in [silence()] * 5 + [voice()]:
+        events += segmenter.process(data)
+    assert [event for event, segment in events] == [segment_start]
+    segment = events[0][1]
+    assert segment.samples == 300
+    assert segment.pcm() == silence() * 2 + voice()
+    # The offset and the duration are measured from the onset of the voice
+    assert segment.pre_roll_time == 0.2
+    assert segment.offset == 0.5
+    assert segment.duration == 0.1
+
+
+def test_segment_ends_after_the_split_silence_and_turn_after_the_final_silence():
+    segmenter = make_segmenter()
+    chunks = [voice()] * 5 + [silence()] * 3 + [voice()] * 2 + [silence()] * 13
+    events = run(segmenter, chunks)
+    assert events == [(0, segment_start), (7, segment_end), (8, segment_start), (12, segment_end), (22, turn_end)]
+    assert segmenter.turn_segments == 0
+
+
+def test_final_silence_can_change_during_the_turn():
+    segmenter = make_segmenter()
+    run(segmenter, [voice()] * 2 + [silence()] * 3)
+    segmenter.set_final_silence_time(0.5)
+    assert run(segmenter, [silence()] * 5) == [(4, turn_end)]
+
+
+def test_long_segments_are_cut():
+    segmenter = make_segmenter(max_segment_time=1)
+    events = []
+    for data in [voice()] * 25:
+        events += segmenter.process(data)
+    assert [event for event, segment in events] == [segment_start, segment_end, segment_start, segment_end,
+                                                    segment_start]
+    assert events[1][1].duration == 1.0
+    assert [segment.index for event, segment in events] == [0, 0, 1, 1, 2]
+
+
+def test_reset_discards_the_segment_and_the_pre_roll():
+    segmenter = make_segmenter()
+    run(segmenter, [silence()] * 2 + [voice()])
+    segmenter.reset()
+    assert segmenter.segment is None
+    assert len(segmenter.prev_input) == 0
+    segment = segmenter.process(voice())[0][1]
+    assert segment.pcm() == voice()
+    assert segment.offset == 0
@@ -0,0 +1,67 @@
+import os
+import wave
+import numpy as np
+from speaker_embedding import SpeakerEmbeddings, SpeakerChangeDetector, embedding, cosine, same_speaker_threshold
+
+rate = 16000
+
+
+# Voice with the given pitch, formants and spectral tilt, recorded through the same microphone (a resonance at
+# 2.5 kHz, no low frequencies) with some noise
+def voice(f0, formants, tilt, seed, seconds=2.0):
+    rng = np.random.default_rng(seed)
+    t = np.arange(int(rate * seconds)) / rate
+    f = f0 * (1 + 0.08 * np.sin(2 * np.pi * (0.7 + rng.random()) * t + rng.random() * 6))
+    phase = 2 * np.pi * np.cumsum(f) / rate
+    wobble = 1 + 0.1 * np.sin(2 * np.pi * 1.5 * t + rng.random() * 6)
+    signal = np.zeros_like(t)
+    for k in range(1, int(4000 / f0)):
+        envelope = sum(np.exp(-((k * f - formant * wobble) / (80 + 0.05 * formant)) ** 2) for formant in formants)
+        signal += (envelope + 0.02) * k ** -tilt * np.sin(k * phase)
+    signal *= (0.55 + 0.45 * np.sin(2 * np.pi * 4 * t)) ** 2
+    freqs = np.fft.rfftfreq(len(signal), 1 / rate)
+    microphone = 1 + 3 * np.exp(-((freqs - 2500) / 400) ** 2) - 0.7 * (freqs < 200)
+    signal = np.fft.irfft(np.fft.rfft(signal) * microphone, len(signal))
+    signal += rng.normal(0, 0.01 * np.abs(signal).max(), len(signal))
+    return (signal / np.abs(signal).max() * 8000).astype(np.int16).tobytes()
+
+
+alice = (120, (500, 1500, 2500), 1.0)
+bob = (150, (600, 1400, 2500), 1.0)
+others = [(160, (600, 1700, 2600), 0.8), (100, (450, 1100, 2300), 1.2), (210, (750, 1200, 2900), 0.6)]
+
+
+# Enrolls the voices in profile folders, as the registration does, and returns their embeddings
+def enrolled_embeddings(directory, voices):
+    for i, params in enumerate(voices):
+        folder = os.path.join(directory, str(i))
+        os.makedirs(folder)
+        with wave.open(os.path.join(folder, "enrollment.wav"), 'wb') as wf:
+            wf.setnchannels(1)
+            wf.setsampwidth(2)
+            wf.setframerate(rate)
+            wf.writeframes(voice(*params, seed=100 + i))
+    return SpeakerEmbeddings(directory)
+
+
+def test_distinct_voices_of_the_same_microphone_are_not_merged(tmp_path):
+    embeddings = enrolled_embeddings(str(tmp_path), [alice, bob] + others)
+    center = embeddings.center([str(i) for i in range(5)])
+    first, again, other = (embedding(voice(*params, seed=seed)) for params, seed in ((alice, 1), (alice, 2), (bob, 3)))
+    # The raw similarity is dominated by what the voices share
+    assert cosine(first, other) > same_speaker_threshold
+    detector = SpeakerChangeDetector()
+    detector.add(first, "alice")
+    assert detector.same_speaker(again, center) == "alice"
+    assert detector.same_speaker(other, center) is None
+    detector.reset()
+    assert detector.same_speaker(again, center) is None
+
+
+def test_voices_are_not_compared_without_enough_profiles(tmp_path):
+    embeddings = enrolled_embeddings(str(tmp_path), [alice])
+    assert embeddings.center(["0", "missing"]) is None
+    detector = SpeakerChangeDetector()
+    first = embedding(voice(*alice, seed=1))
+    detector.add(first, "alice")
+    assert detector.same_speaker(first, None) is None
@@ -0,0 +1,65 @@
+import pytest
+
+pytest.importorskip("pyaudio")
+import speaker_recognition_util as util
+
+unknown_speaker_id = "00000000-0000-0000-0000-000000000000"
+
+
+def test_posts_are_retried_only_when_throttled():
+    retry = util._adapter.max_retries
+    assert retry.is_retry("POST", 429)
+    assert not retry.is_retry("POST", 500)
+    assert not retry.is_retry("POST", 503)
+
+
+def test_idempotent_requests_are_retried_on_server_errors():
+    retry = util._adapter.max_retries
+    assert retry.is_retry("GET", 503)
+    assert retry.is_retry("DELETE", 500)
+    assert not retry.is_retry("GET", 404)
+
+
+def test_failed_identifications_are_counted(monkeypatch):
+    def fail(method, url, **kwargs):
+        raise util.requests.ConnectionError("unreachable")
+
+    monkeypatch.setattr(util, "send_request", fail)
+    errors = util.speaker_id_metrics("test-session")[2]
+    before = errors.get()
+    assert util.identify_speaker_ranking("a,b", bytes(1000), "test-session") == []
+    assert errors.get() == before + 1
+
+
+# Identification of each shard replaced by a ranking in which the score of a profile is its number divided by 100
+def fake_ranking(calls):
+    def identify_speaker_ranking(prof_ids, audio, recorder_session=None):
+        calls.append(prof_ids)
+        ranking = [{"profileId": p, "score": int(p[1:]) / 100} for p in prof_ids.split(",")]
+        return sorted(ranking, key=lambda entry: entry["score"], reverse=True)
+    return identify_speaker_ranking
+
+
+def test_profiles_are_split_in_shards_and_the_rankings_merged(monkeypatch):
+    calls = []
+    monkeypatch.setattr(util, "identify_speaker_ranking", fake_ranking(calls))
+    profiles = ["p{}".format(i) for i in (5, 40, 12, 7, 33, 21, 3)]
+    assert util.identify_speaker_sharded(profiles, b"audio", shard_size=3) == ("p40", 0.4)
+    assert sorted(calls) == sorted(["p5,p40,p12", "p7,p33,p21", "p3"])
+
+
+def test_single_shard(monkeypatch):
+    calls = []
+    monkeypatch.setattr(util, "identify_speaker_ranking", fake_ranking(calls))
+    assert util.identify_speaker_sharded(["p1", "p2"], b"audio") == ("p2", 0.02)
+    assert calls == ["p1,p2"]
+
+
+def test_failed_shards_are_ignored(monkeypatch):
+    def identify_speaker_ranking(prof_ids, audio, recorder_session=None):
+        return [] if "p9" in prof_ids else [{"profileId": "p1", "score": 0.5}]
+
+    monkeypatch.setattr(util, "identify_speaker_ranking", identify_speaker_ranking)
+    assert util.identify_speaker_sharded(["p1", "p9"], b"audio", shard_size=1) == ("p1", 0.5)
+    monkeypatch.setattr(util, "identify_speaker_ranking", lambda prof_ids, audio, recorder_session=None: [])
+    assert util.identify_speaker_sharded(["p1", "p9"], b"audio", shard_size=1) == (unknown_speaker_id, 0)
@@ -0,0 +1,72 @@
+import threading
+import time
+from transcription_pool import TranscriptionPool
+
+
+def delayed(value, delay):
+    time.sleep(delay)
+    return value
+
+
+def test_results_in_capture_order():
+    pool = TranscriptionPool(4)
+    tasks = pool.new_turn()
+    # The first segments take longer than the last ones
+    for i, delay in enumerate((0.2, 0.1, 0.05, 0.0)):
+        tasks.submit(delayed, i, delay)
+    assert len(tasks) == 4
+    assert tasks.join() == [0, 1, 2, 3]
+    pool.shutdown()
+
+
+def test_failed_and_late_tasks_give_none():
+    def fail():
+        raise RuntimeError("service unavailable")
+
+    pool = TranscriptionPool(3)
+    tasks = pool.new_turn()
+    tasks.submit(delayed, "a", 0)
+    tasks.submit(fail)
+    tasks.submit(delayed, "c", 1)
+    assert tasks.join(timeout=0.3) == ["a", None, None]
+    pool.shutdown()
+
+
+def test_done_results_skip_the_running_tasks():
+    pool = TranscriptionPool(2)
+    tasks = pool.new_turn()
+    release = threading.Event()
+    tasks.submit(delayed, "a", 0)
+    tasks.submit(release.wait)
+    time.sleep(0.1)
+    assert tasks.done_results() == ["a"]
+    assert pool.in_flight() == 1
+    release.set()
+    assert tasks.join() == ["a", True]
+    assert pool.in_flight() == 0
+    pool.shutdown()
+
+
+def test_queue_depth():
+    pool = TranscriptionPool(1)
+    tasks = pool.new_turn()
+    release = threading.Event()
+    tasks.submit(release.wait)
+    tasks.submit(delayed, "b", 0)
+    time.sleep(0.1)
+    assert pool.queue_depth() == 1
+    release.set()
+    tasks.join()
+    assert pool.queue_depth() == 0
+    pool.shutdown()
+
+
+def test_turns_are_separate():
+    pool = TranscriptionPool(2)
+    first = pool.new_turn()
+    first.submit(delayed, 1, 0)
+    second = pool.new_turn()
+    second.submit(delayed, 2, 0)
+    assert first.join() == [1]
+    assert second.join() == [2]
+    pool.shutdown()
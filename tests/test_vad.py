@@ -0,0 +1,132 @@
+import numpy as np
+from ring_buffer import RingBuffer
+from vad import AdaptiveVad, SpeechGate
+
+rate = 16000
+chunk = 1024
+
+
+# level is the rms of the chunk, in the units of audio_analysis.rms (thousandths of the full scale)
+def noise_chunk(level, seed=0):
+    samples = np.random.default_rng(seed).normal(0, level * 32.768, chunk)
+    return np.clip(samples, -32768, 32767).astype(np.int16).tobytes()
+
+
+def make_vad(min_threshold=40):
+    return AdaptiveVad(min_threshold, chunk / rate)
+
+
+def test_calibrate_sets_the_noise_floor():
+    vad = make_vad()
+    vad.calibrate([noise_chunk(20, seed) for seed in range(16)])
+    assert vad.calibrated
+    assert 18 < vad.noise_floor < 22
+    assert vad.start_threshold() == vad.noise_floor * 3
+    assert vad.stop_threshold() == vad.noise_floor * 2
+
+
+# Capture returning the chunks of a list
+class ListCapture:
+    def __init__(self, chunks):
+        self.chunks = list(chunks)
+
+    def read(self):
+        return self.chunks.pop(0)
+
+
+def test_calibrate_from_the_capture_keeps_the_audio_as_pre_roll():
+    vad = make_vad()
+    capture = ListCapture(noise_chunk(20, seed) for seed in range(40))
+    prev_input = RingBuffer(chunk * 4)
+    vad.calibrate_from(capture, prev_input)
+    assert vad.calibrated
+    assert 18 < vad.noise_floor < 22
+    # One second of audio has been read, and the last chunks are kept as pre-roll
+    assert len(capture.chunks) == 40 - rate // chunk
+    assert bytes(prev_input.read()) == b''.join(noise_chunk(20, seed) for seed in range(11, 15))
+    vad.calibrate_from(capture, prev_input)
+    assert len(capture.chunks) == 40 - rate // chunk
+
+
+def test_quiet_floor_keeps_the_fixed_threshold():
+    vad = make_vad()
+    vad.calibrate([noise_chunk(2, seed) for seed in range(16)])
+    assert vad.start_threshold() == 40
+    assert not any(vad.is_speech(noise_chunk(20, seed)) for seed in range(16, 64))
+    assert vad.triggers == 0
+
+
+def test_loud_noise_does_not_trigger():
+    vad = make_vad()
+    vad.calibrate([noise_chunk(100, seed) for seed in range(16)])
+    assert not any(vad.is_speech(noise_chunk(100, seed)) for seed in range(16, 64))
+
+
+def test_hysteresis():
+    vad = make_vad()
+    vad.calibrate([noise_chunk(20, seed) for seed in range(16)])
+    # Between the stop and the start threshold: it continues a segment but does not start one
+    between = noise_chunk(50, 100)
+    assert not vad.is_speech(between)
+    assert vad.is_speech(between, active=True)
+    assert vad.is_speech(noise_chunk(200, 101))
+    assert vad.triggers == 1
+
+
+# Returns the PCM data of the signal with half a second of silence before and after it, with a peak of 8000
+def padded(signal):
+    silence = np.zeros(rate // 2)
+    signal = np.concatenate([silence, signal, silence])
+    return (signal / np.abs(signal).max() * 8000).astype(np.int16).tobytes()
+
+
+def time(seconds=2):
+    return np.arange(int(rate * seconds)) / rate
+
+
+def motor():
+    t = time()
+    return padded(sum(np.sin(2 * np.pi * k * 650 * t) / k for k in range(1, 5)))
+
+
+def chord():
+    t = time()
+    return padded(sum(np.sin(2 * np.pi * f * t) for f in (523.2, 659.3, 784.0, 1046.5)))
+
+
+# Harmonic voice with a moving pitch and the energy modulated at 4 syllables per second
+def voice():
+    t = time()
+    phase = 2 * np.pi * np.cumsum(140 + 30 * np.sin(2 * np.pi * 1.3 * t)) / rate
+    harmonics = sum((1.0 if 3 <= k <= 20 else 0.3) * np.sin(k * phase) for k in range(1, 24))
+    return padded(harmonics * (0.55 + 0.45 * np.sin(2 * np.pi * 4 * t)) ** 2)
+
+
+def test_gate_keeps_the_voice_and_trims_the_silence():
+    recording = voice()
+    gate = SpeechGate(rate)
+    result = gate.filter(recording)
+    assert result is not None
+    assert len(result) < len(recording)
+    assert gate.rejected == 0
+    assert gate.trimmed_time > 0
+
+
+def test_gate_rejects_steady_sounds():
+    gate = SpeechGate(rate)
+    assert gate.filter(motor()) is None
+    assert gate.filter(chord()) is None
+    assert gate.rejected == 2
+
+
+def test_gate_rejects_silence_and_clicks():
+    gate = SpeechGate(rate)
+    assert gate.filter(bytes(rate * 2)) is None
+    click = np.zeros(rate, dtype=np.int16)
+    click[rate // 2:rate // 2 + 32] = 8000
+    assert gate.filter(click.tobytes()) is None
+
+
+def test_modulation_of_short_sounds_is_not_measured():
+    assert SpeechGate.modulation(np.ones(5)) is None
+    assert SpeechGate.modulation(np.ones(100)) < 1e-6
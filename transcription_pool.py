@@ -0,0 +1,91 @@
+"""
+Authors:     Lucrezia Grassi (concept, design and code writing),
+             Carmine Tommaso Recchiuto (concept and design),
+             Antonio Sgorbissa (concept and design)
+Email:       lucrezia.grassi@edu.unige.it
+Affiliation: RICE, DIBRIS, University of Genoa, Italy
+
+This file contains the pool of worker threads that transcribe the segments recorded by the Recorder.
+The number of threads is bounded, and the tasks of each dialogue turn are collected in a group that can be joined
+before the turn is sent to the client: the results are returned in the order in which the segments were captured,
+regardless of which request completes first.
+"""
+from concurrent.futures import ThreadPoolExecutor, wait
+import threading
+
+max_transcription_workers = 4
+
+
+class TranscriptionPool:
+    def __init__(self, max_workers=max_transcription_workers):
+        self.executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="T1")
+        self.lock = threading.Lock()
+        self.queued = 0
+        self.running = 0
+
+    def run(self, fn, args):
+        with self.lock:
+            self.queued -= 1
+            self.running += 1
+        try:
+            return fn(*args)
+        finally:
+            with self.lock:
+                self.running -= 1
+
+    def submit(self, fn, *args):
+        with self.lock:
+            self.queued += 1
+        return self.executor.submit(self.run, fn, args)
+
+    # Number of tasks waiting for a free worker
+    def queue_depth(self):
+        with self.lock:
+            return self.queued
+
+    # Number of tasks currently executed by a worker
+    def in_flight(self):
+        with self.lock:
+            return self.running
+
+    def new_turn(self):
+        return TurnTaskGroup(self)
+
+    def shutdown(self):
+        self.executor.shutdown(wait=True)
+
+
+class TurnTaskGroup:
+    def __init__(self, pool):
+        self.pool = pool
+        self.futures = []
+
+    def submit(self, fn, *args):
+        future = self.pool.submit(fn, *args)
+        self.futures.append(future)
+        return future
+
+    def __len__(self):
+        return len(self.futures)
+
+    # Results of the tasks already completed, in capture order (the ones still running are skipped)
+    def done_results(self):
+        futures = list(self.futures)
+        return [f.result() for f in futures if f.done() and f.exception() is None]
+
+    # Waits for every task of the turn and returns the results in capture order.
+    # A task that raised an exception is reported and its result is None.
+    def join(self, timeout=None):
+        futures = list(self.futures)
+        wait(futures, timeout=timeout)
+        results = []
+        for f in futures:
+            if not f.done():
+                print("T1: Segment transcription did not complete in time")
+                results.append(None)
+            elif f.exception() is not None:
+                print("T1: Segment transcription failed:", f.exception())
+                results.append(None)
+            else:
+                results.append(f.result())
+        return results
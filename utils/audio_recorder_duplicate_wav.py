@@ -1,8 +1,8 @@
 from Microphone.speaker_reco_util import *
 import threading
 import pyaudio
-import math
-import struct
+import audio_analysis
+from ring_buffer import RingBuffer
 import wave
 import time
 import os
@@ -11,7 +11,6 @@ import azure.cognitiveservices.speech as speechsdk
 from pydub import AudioSegment
 
 rms_threshold = 30
-SHORT_NORMALIZE = (1.0/32768.0)
 chunk = 1024
 FORMAT = pyaudio.paInt16
 channels = 1
@@ -19,6 +18,8 @@ RATE = 16000
 swidth = 2
 split_silence_time = 1
 final_silence_time = 3
+# Seconds of audio preceding the noise detection that are kept and prepended to each segment
+PRE_ROLL_TIME = 0.5
 
 f_name_directory = os.getcwd()
 speech_config = speechsdk.SpeechConfig(subscription="8f95505a0a7f49edaa75edcf6440dcbf", region="westeurope")
@@ -33,8 +34,8 @@ class Recorder:
                                   input=True,
                                   output=True,
                                   frames_per_buffer=chunk)
-        self.prev_input = []
-        self.max_chunks = 20
+        # Audio heard just before the noise is detected, prepended to every segment
+        self.prev_input = RingBuffer(int(PRE_ROLL_TIME * RATE))
         self.string_to_send = ""
 
     def microsoft_sender(self, wav_filename):
@@ -96,23 +97,13 @@ class Recorder:
 
     @staticmethod
     def rms(frame):
-        count = len(frame) / swidth
-        frmt = "%dh" % count
-        shorts = struct.unpack(frmt, frame)
-
-        sum_squares = 0.0
-        for sample in shorts:
-            n = sample * SHORT_NORMALIZE
-            sum_squares += n * n
-        rms = math.pow(sum_squares / count, 0.5)
-        return rms * 1000
+        return audio_analysis.rms(frame)
 
     def record(self):
         print('*** Noise detected: start recording ***')
         rec = []
         if self.prev_input:
-            for c in self.prev_input:
-                rec.append(c)
+            rec.append(self.prev_input.read())
 
         current = time.time()
         end = time.time() + split_silence_time
@@ -124,7 +115,7 @@ class Recorder:
             current = time.time()
             rec.append(data)
 
-        self.prev_input = []
+        self.prev_input.clear()
         self.write(b''.join(rec))
 
     def write(self, recording):
@@ -156,9 +147,7 @@ class Recorder:
                     end = time.time() + final_silence_time
                     self.record()
                 else:
-                    self.prev_input.append(audio_input)
-                    if len(self.prev_input) > self.max_chunks:
-                        self.prev_input = self.prev_input[1:]
+                    self.prev_input.write(audio_input)
                     current = time.time()
             if self.string_to_send:
                 print("String to send to the Hub:", self.string_to_send)
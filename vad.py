@@ -0,0 +1,191 @@
+"""
+Authors:     Lucrezia Grassi (concept, design and code writing),
+             Carmine Tommaso Recchiuto (concept and design),
+             Antonio Sgorbissa (concept and design)
+Email:       lucrezia.grassi@edu.unige.it
+Affiliation: RICE, DIBRIS, University of Genoa, Italy
+
+This file contains the voice activity detector used by the recorders to decide when a segment starts and ends.
+Instead of comparing the rms of each chunk with a fixed threshold, the detector follows the noise floor of the room and
+requires the chunks to be louder than a multiple of it:
+- the noise floor is the minimum of the rms of the chunks over the last few seconds (minimum statistics), so it rises
+  with a fan or the crowd noise, but not with the speech, which always contains short pauses;
+- a segment starts when a chunk exceeds start_ratio times the noise floor and continues while the chunks exceed
+  stop_ratio times the noise floor (hysteresis), so it is not cut by the softer syllables;
+- the fixed threshold of the recorder is kept as the minimum start threshold, so nothing changes in a quiet room.
+The noise floor is calibrated on the first second of audio captured by the device.
+It also contains the spectral gate applied to every segment before it is sent to the services: the segments with too
+little speech (door slams, hiss, hums and whines of motors, sustained musical notes, ...) are rejected, saving a
+transcription and an identification each. Tonal sounds pass the spectral checks of the single frames, so the gate also
+requires the energy to be modulated at the rate of the syllables (2-8 Hz), as speech is and steady sounds are not.
+"""
+import audio_analysis
+import numpy as np
+import collections
+
+# Multiples of the noise floor needed to start and to continue a segment
+start_ratio = 3.0
+stop_ratio = 2.0
+# Seconds over which the minimum is taken, split in blocks so that the minimum is updated in constant time
+floor_window_time = 5.0
+floor_block_time = 0.5
+# Seconds of audio used to calibrate the noise floor when the device starts
+calibration_time = 1.0
+# Percentile of the rms of the calibration chunks used as the initial noise floor (robust to some speech)
+calibration_percentile = 20
+
+
+class AdaptiveVad:
+    # min_threshold is the fixed rms threshold of the recorder, chunk_time the duration of a chunk in seconds
+    def __init__(self, min_threshold, chunk_time, start_ratio=start_ratio, stop_ratio=stop_ratio):
+        self.min_threshold = min_threshold
+        self.chunk_time = chunk_time
+        self.start_ratio = start_ratio
+        self.stop_ratio = stop_ratio
+        self.block_chunks = max(int(round(floor_block_time / chunk_time)), 1)
+        self.blocks = collections.deque(maxlen=max(int(round(floor_window_time / floor_block_time)), 1))
+        self.block_min = None
+        self.block_count = 0
+        self.noise_floor = 0.0
+        self.calibrated = False
+        self.triggers = 0
+
+    # Sets the initial noise floor from the chunks captured when the device starts
+    def calibrate(self, chunks):
+        if not chunks:
+            return
+        levels = audio_analysis.rms(audio_analysis.frames(b''.join(chunks), len(chunks[0]) // 2))
+        self.noise_floor = float(np.percentile(levels, calibration_percentile))
+        self.blocks.clear()
+        self.blocks.append(self.noise_floor)
+        self.block_min = None
+        self.block_count = 0
+        self.calibrated = True
+
+    # Calibrates the noise floor on the first calibration_time seconds read from the capture of a recorder, unless it
+    # is already calibrated, and keeps that audio as the pre-roll of the first segment
+    def calibrate_from(self, capture, prev_input):
+        if self.calibrated:
+            return
+        chunks = [capture.read() for i in range(int(calibration_time / self.chunk_time))]
+        self.calibrate(chunks)
+        for data in chunks:
+            prev_input.write(data)
+        print("*** Noise floor:", self.noise_floor, "- start threshold:", self.start_threshold(), "***")
+
+    def start_threshold(self):
+        return max(self.min_threshold, self.noise_floor * self.start_ratio)
+
+    def stop_threshold(self):
+        return max(self.min_threshold * self.stop_ratio / self.start_ratio, self.noise_floor * self.stop_ratio)
+
+    def update_floor(self, level):
+        self.block_min = level if self.block_min is None else min(self.block_min, level)
+        self.block_count += 1
+        if self.block_count >= self.block_chunks:
+            self.blocks.append(self.block_min)
+            self.block_min = None
+            self.block_count = 0
+            self.noise_floor = min(self.blocks)
+        elif level < self.noise_floor:
+            # The floor follows a drop of the noise immediately
+            self.noise_floor = level
+
+    # Returns True if the chunk contains voice. active is True while a segment is being recorded, so that the lower
+    # stop threshold is used
+    def is_speech(self, frame, active=False):
+        level = audio_analysis.rms(frame)
+        self.update_floor(level)
+        if active:
+            return level >= self.stop_threshold()
+        speech = level > self.start_threshold()
+        if speech:
+            self.triggers += 1
+        return speech
+
+
+# Frequencies (in Hz) where most of the energy of the voice is
+speech_band = (300, 3400)
+# Duration of the frames analysed by the spectral gate
+gate_frame_time = 0.032
+# Only the frames at most this many dB below the loudest frame of the segment are analysed
+gate_dynamic_range = 30
+# Thresholds for a frame to be considered speech: most of the energy in the speech band, a spectrum far from flat
+# (harmonics and formants, unlike fans, slams and hiss) and a zero crossing rate typical of voiced and unvoiced sounds
+min_band_ratio = 0.5
+max_flatness = 0.4
+min_zcr = 0.01
+max_zcr = 0.4
+# Modulation frequencies (in Hz) of the syllables, and minimum modulation index (rms of the modulation in that band
+# divided by the mean amplitude) of the speech band energy for a segment to be considered speech
+syllable_band = (2, 8)
+min_modulation = 0.15
+# Seconds of sound needed to measure the modulation: shorter segments are not checked
+min_modulation_time = 0.5
+# Seconds of speech frames needed to keep a segment, and seconds kept before the first and after the last speech frame
+min_speech_time = 0.15
+trim_margin_time = 0.3
+
+
+# Spectral check performed on a segment before sending it to the services: the segments without enough speech are
+# rejected, and the silence or noise before and after the speech is trimmed
+class SpeechGate:
+    def __init__(self, rate):
+        self.rate = rate
+        self.frame_size = int(gate_frame_time * rate)
+        self.n_fft = 1 << (self.frame_size - 1).bit_length()
+        self.window = np.hanning(self.frame_size).astype(np.float32)
+        freqs = np.fft.rfftfreq(self.n_fft, 1 / rate)
+        self.band = (freqs >= speech_band[0]) & (freqs <= speech_band[1])
+        self.rejected = 0
+        self.trimmed_time = 0.0
+
+    # Returns a boolean for each frame of the PCM data, True if the frame looks like speech
+    def speech_frames(self, pcm):
+        return self.analyse(pcm)[0]
+
+    # Returns the speech frames and the amplitude of each frame in the speech band
+    def analyse(self, pcm):
+        frames = audio_analysis.frames(pcm, self.frame_size)
+        if len(frames) == 0:
+            return np.zeros(0, dtype=bool), np.zeros(0)
+        power = np.abs(np.fft.rfft(frames.astype(np.float32) * self.window, self.n_fft)) ** 2 + 1e-10
+        band_power = power[:, self.band]
+        band_ratio = band_power.sum(axis=1) / power.sum(axis=1)
+        flatness = np.exp(np.log(band_power).mean(axis=1)) / band_power.mean(axis=1)
+        zcr = audio_analysis.zero_crossing_rate(frames)
+        level = audio_analysis.dbfs(frames)
+        loud = level >= level.max() - gate_dynamic_range
+        speech = loud & (band_ratio >= min_band_ratio) & (flatness <= max_flatness)
+        speech &= (zcr >= min_zcr) & (zcr <= max_zcr)
+        return speech, np.sqrt(band_power.sum(axis=1))
+
+    # Returns the modulation index of the amplitude in the syllable band, or None if the sound is too short
+    @staticmethod
+    def modulation(amplitude):
+        if len(amplitude) < min_modulation_time / gate_frame_time or amplitude.mean() <= 0:
+            return None
+        spectrum = np.abs(np.fft.rfft(amplitude - amplitude.mean())) ** 2
+        freqs = np.fft.rfftfreq(len(amplitude), gate_frame_time)
+        band = (freqs >= syllable_band[0]) & (freqs <= syllable_band[1])
+        # Parseval: rms of the component of the amplitude in the band (one-sided spectrum)
+        return float(np.sqrt(2 * spectrum[band].sum()) / len(amplitude) / amplitude.mean())
+
+    # Returns the segment trimmed around its speech, or None if it does not contain enough speech
+    def filter(self, recording):
+        speech, amplitude = self.analyse(recording)
+        if np.count_nonzero(speech) * self.frame_size < min_speech_time * self.rate:
+            self.rejected += 1
+            return None
+        indexes = np.flatnonzero(speech)
+        # The modulation is measured inside the first and the last speech frame (which can be partly silent), as the
+        # silence around a steady sound would modulate it
+        modulation = self.modulation(amplitude[indexes[0] + 1:indexes[-1]])
+        if modulation is not None and modulation < min_modulation:
+            self.rejected += 1
+            return None
+        margin = int(trim_margin_time * self.rate)
+        start = max(indexes[0] * self.frame_size - margin, 0) * 2
+        end = min((indexes[-1] + 1) * self.frame_size + margin, len(recording) // 2) * 2
+        self.trimmed_time += (len(recording) - (end - start)) / (2 * self.rate)
+        return recording[start:end]